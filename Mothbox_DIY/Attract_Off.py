@@ -4,6 +4,11 @@ import RPi.GPIO as GPIO
 import time
 import datetime
 from datetime import datetime
+import sys
+
+# --lights-only turns off just Ch1 and leaves Ch3 on for the flash
+# (Scheduler.py uses it when the energy planner ends the attractor's part of a session early)
+lights_only = "--lights-only" in sys.argv[1:]
 
 print("----------------- Attract OFF DIY-------------------")
 now = datetime.now()
@@ -41,6 +46,9 @@ def AttractOn():
     
 def AttractOff():
     GPIO.output(Relay_Ch1,GPIO.HIGH)
+    if lights_only:
+        print("Attract Lights Off (flash left on its supply)\n")
+        return
     if(onlyflash):
         GPIO.output(Relay_Ch2,GPIO.HIGH)
         print("Always Flash mode is on")
@@ -40,8 +40,11 @@ def AttractOn():
     GPIO.output(Relay_Ch1,GPIO.LOW)
     print("Attract Lights On\n")
     
-def AttractOff():
+def AttractOff(lights_only=False):
     GPIO.output(Relay_Ch1,GPIO.HIGH)
+    if lights_only:
+        print("Attract Lights Off (flash left on its supply)\n")
+        return
     if(onlyflash):
         GPIO.output(Relay_Ch2,GPIO.HIGH)
         print("Always Flash mode is on")
@@ -54,7 +57,24 @@ def AttractOff():
 
 #control_values = get_control_values("/boot/firmware/mothbox_custom/system/controls.txt")
 #onlyflash = control_values.get("OnlyFlash", "True").lower() == "true"
-AttractOn()
+def attract_time_over():
+    """The energy planner (energy_planner.py) can end the attractor's part of a session early"""
+    try:
+        with open("/boot/firmware/mothbox_custom/system/controls/energy.txt") as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                if key == "attract_until":
+                    return 0 < float(value) < time.time()
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+if attract_time_over():
+    print("The energy budget has no more attractor time this session")
+    AttractOff(lights_only=True) # Ch3 also feeds the flash
+else:
+    AttractOn()
 #AttractOff()
 
 quit()
\ No newline at end of file
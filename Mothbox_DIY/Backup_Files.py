@@ -302,7 +302,7 @@ def copy_folders_with_files(source_folder, target_folder):
         if os.path.isfile(source_path):
             # If the source is a file, copy it directly
             try:
-                shutil.copy2(source_path, target_path,dirs_exist_ok = True)
+                shutil.copy2(source_path, target_path)
                 print(f"Copied file: {source_path} to {target_path}")
             except Exception as e:
                 print(f"Error copying {source_path} to {target_path}: {e}")
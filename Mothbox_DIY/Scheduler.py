@@ -38,14 +38,16 @@ from subprocess import Popen  # For executing external scripts
 import os
 import numpy as np
 import sys
-import schedule
 
-import crontab
-from crontab import CronTab
 import logging
 import re
 import RPi.GPIO as GPIO
 import fcntl
+from boot_tasks import BootGraph
+from wake_schedule import WakeSchedule
+from control_watch import ControlWatch
+from energy_planner import EnergyPlanner, parse_vin, parse_end, session_limits
+from modes import mode_from_switches, running_mode, shuts_down
 # -----Scheduler Functions-------------------
 
 
@@ -260,7 +262,7 @@ def load_settings(filename):
 
     default_path = "/boot/firmware/mothbox_custom/mothbox_settings.csv"
     file_path=filename
-    global runtime, utc_off, ssid, wifipass, newwifidetected, onlyflash,autoname, manName, manTimezone, autoTime, manTime, bat80, bat20, bat_Wh, bat_voltage
+    global runtime, utc_off, ssid, wifipass, newwifidetected, onlyflash,autoname, manName, manTimezone, autoTime, manTime, bat80, bat20, bat_Wh, bat_voltage, deployment_end
     runtime = 0  # this is how long to run the mothbox in minutes for once we wakeup 0 is forever
     # newwifidetected=False
     onlyflash = 0
@@ -316,6 +318,8 @@ def load_settings(filename):
                     bat80 =float(value)
                 elif setting == "bat_20perVolts":
                     bat20 =float(value)
+                elif setting == "deployment_end":
+                    deployment_end = value.strip()
                 else:
                     print(f"Warning: Unknown setting: {setting}. Ignoring.")
 
@@ -391,25 +395,73 @@ def get_control_values(filename):
     return control_values
 
 
-def schedule_shutdown(minutes):
-    """Schedules the execution of shutdown after the specified delay in minutes."""
-    if rpiModel == 4:
-        "pi4 no longer suppored"
-        schedule.every(minutes).minutes.do(run_shutdown_pi5)
-    if rpiModel == 5:
-        schedule.every(minutes).minutes.do(run_shutdown_pi5)
+def append_log_csv(filename, header, values):
+    """Appends one row to a csv in the logs folder, writing the header if the file is new"""
+    log_path = os.path.join("/home/pi/Desktop/Mothbox/logs", filename)
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        new = not os.path.exists(log_path)
+        with open(log_path, "a") as f:
+            if new:
+                f.write(header + "\n")
+            f.write(",".join(str(v) for v in [datetime.datetime.now().isoformat(timespec='seconds')] + list(values)) + "\n")
+    except OSError as e:
+        print(f"⚠️ Could not write {filename}: {e}")
+
+
+def schedule_shutdown(minutes, attract_minutes=None):
+    """
+    Shuts down after the specified delay in minutes, unless shutdown_enabled is set to false first.
+    Sleeps until the deadline or until something changes in the controls folder (control_watch.py),
+    and only reads shutdown_enabled when its file changed, instead of every second.
+    attract_minutes turns the attractor lights off earlier than that (the energy planner's duty).
+    """
+    deadline = time.monotonic() + minutes * 60
+    attract_off = None if attract_minutes is None else time.monotonic() + attract_minutes * 60
+    started = time.monotonic()
+    watch = ControlWatch(CONTROL_ROOT)
+    inotify = int(watch.watching)
+    wakeups = 0
+    reads = 1
+    ended = "stopped"
+    shutdown_enabled = read_control("shutdown_enabled", "true").lower() == "true"
 
     try:
-        while True:
-            #control_values = get_control_values("/boot/firmware/mothbox_custom/system/controls.txt")
-            shutdown_enabled = read_control("shutdown_enabled", "true").lower() == "true"
-            if not shutdown_enabled:
-                print("Shutdown scheduling stopped.")
+        while shutdown_enabled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                ended = "shutdown"
                 break
-
-            schedule.run_pending()
-            time.sleep(1)
+            if attract_off is not None:
+                if attract_off <= time.monotonic():
+                    print("Attractor duty is over for this session, turning the lights off")
+                    run_cmd("python /home/pi/Desktop/Mothbox/Attract_Off.py --lights-only")
+                    attract_off = None
+                    continue
+                remaining = min(remaining, attract_off - time.monotonic())
+            changed = watch.wait(remaining)
+            wakeups += 1
+            if changed is None or "shutdown_enabled.txt" in changed:
+                reads += 1
+                shutdown_enabled = read_control("shutdown_enabled", "true").lower() == "true"
     except KeyboardInterrupt:
+        ended = "interrupted"
+    finally:
+        watch.close()
+
+    # what polling every second would have cost for the same time
+    waited = time.monotonic() - started
+    polled = int(waited)
+    print(f"Shutdown timer woke {wakeups} times and read shutdown_enabled {reads} times in {waited / 60:.1f} min "
+          f"(every second: {polled} wakeups and reads, saved {polled - wakeups} and {polled - reads})")
+    append_log_csv("shutdown_timer.csv",
+                   "time,minutes,waited_s,ended,inotify,wakeups,reads,saved_wakeups,saved_reads",
+                   [minutes, round(waited), ended, inotify, wakeups, reads,
+                    polled - wakeups, polled - reads])
+
+    if ended == "shutdown":
+        run_shutdown_pi5()
+    else:
         print("Shutdown scheduling stopped.")
 
 
@@ -429,6 +481,9 @@ def run_shutdown_pi5():
 
     #-------------------#
     
+    # let the capture daemon release the camera cleanly
+    run_cmd("python /home/pi/Desktop/Mothbox/TriggerPhoto.py --stop")
+
     print("about to launch the shutdown")
     print("but we are running ONE LAST WAKEUP SCHEDULER")
 
@@ -439,30 +494,11 @@ def run_shutdown_pi5():
 
     print(settings)
 
-    # don't need to modify the hours to UTC like we do for pijuice
-    # Build Cron expression
-    # The cron expression is made of five fields. Each field can have the following values.
-    # minute (0-59) |	hour (0 - 23)	|day of the month (1 - 31)	| month (1 - 12)	| day of the week (0 - 6)
-
-    # Loop through each key-value pair in the dictionary
-    for key, value in settings.items():
-        # Check if the value is a string and contains semicolons
-        if isinstance(value, str) and ";" in value:
-            # Replace semicolons with commas
-            settings[key] = value.replace(";", ",")
-    cron_expression = (
-        str(settings["minute"])
-        + " "
-        + str(settings["hour"])
-        + " "
-        + "*"
-        + " "
-        + "*"
-        + " "
-        + str(settings["weekday"])
-    )
-    print(cron_expression)
-    next_epoch_time = calculate_next_event(cron_expression, utc_off)
+    # the settings are read again in case they changed during the session
+    wake = compile_schedule(settings)
+    print(wake)
+    print("utc_off ",utc_off)
+    next_epoch_time = wake.next_wake()
 
     # Clear existing wakeup alarm (assuming sudo access)
     clear_wakeup_alarm()
@@ -557,31 +593,11 @@ def run_shutdown_pi5_FAST():
 
     #print(settings)
 
-    # don't need to modify the hours to UTC like we do for pijuice
-    # Build Cron expression
-    # The cron expression is made of five fields. Each field can have the following values.
-    # minute (0-59) |	hour (0 - 23)	|day of the month (1 - 31)	| month (1 - 12)	| day of the week (0 - 6)
-
-    # Loop through each key-value pair in the dictionary
-    for key, value in settings.items():
-        # Check if the value is a string and contains semicolons
-        if isinstance(value, str) and ";" in value:
-            # Replace semicolons with commas
-            settings[key] = value.replace(";", ",")
-    cron_expression = (
-        str(settings["minute"])
-        + " "
-        + str(settings["hour"])
-        + " "
-        + "*"
-        + " "
-        + "*"
-        + " "
-        + str(settings["weekday"])
-    )
+    # the settings are read again in case they changed during the session
+    wake = compile_schedule(settings)
+    print(wake)
     print("utc_off ",utc_off)
-    #print(cron_expression)
-    next_epoch_time = calculate_next_event(cron_expression, utc_off)
+    next_epoch_time = wake.next_wake()
 
     # Clear existing wakeup alarm (assuming sudo access)
     clear_wakeup_alarm()
@@ -679,24 +695,13 @@ def modify_hours(data, offsett_value, key="hour"):
 
     return data  # Return the modified dictionary (or original if no modification)
 
-def calculate_next_event(cron_expression, utcOff):
-    cron = CronTab(user="root")
-    job = cron.new(command="echo hello_world")
-    job.setall(cron_expression)
-
-    # Work entirely in UTC
-    now_utc = datetime.datetime.now(datetime.timezone.utc)
-
-    # Convert UTC → LOCAL using known offset
-    now_local = now_utc + datetime.timedelta(hours=float(utcOff))
-
-    schedule = job.schedule(date_from=now_local)
-    next_local = schedule.get_next()
-
-    # Convert back LOCAL → UTC
-    next_utc = next_local - datetime.timedelta(hours=float(utcOff))
-
-    return int(next_utc.timestamp())
+def compile_schedule(settings, runtime_minutes=0):
+    """
+    The minute/hour/weekday settings compiled into all their session starts for the coming weeks
+    (wake_schedule.py). Uses the timezone from the controls, or utc_off if there isn't one.
+    """
+    return WakeSchedule(settings["minute"], settings["hour"], settings["weekday"], runtime_minutes,
+                        utc_offset=utc_off, timezone=read_control("timezone"))
 
 def clear_wakeup_alarm():
     """
@@ -760,50 +765,11 @@ def run_script(script_path, *args, show_output=True):
 
 # Check if now is in schedule 
 
-def parse_int_list(value):
-    if isinstance(value, int):
-        return [value]
-    if isinstance(value, str):
-        return [int(v.strip()) for v in value.split(",") if v.strip()]
-    return []
-
-def is_now_in_schedule(settings, runtime_minutes):
-    now = datetime.datetime.now()
-
-    minutes = parse_int_list(settings.get("minute", ""))
-    hours = parse_int_list(settings.get("hour", ""))
-    weekdays_raw = parse_int_list(settings.get("weekday", ""))
-
-    # Convert CSV weekday (1–7) → Python weekday (0–6)
-    weekdays = [(d - 1) % 7 for d in weekdays_raw]
-
-    now_weekday = now.weekday()
-
-    # Try all scheduled start times for today *and* yesterday
-    # (needed for cross-midnight runtimes)
-    for day_offset in (0, -1):
-        day = now.date() + datetime.timedelta(days=day_offset)
-        weekday = (now_weekday + day_offset) % 7
-
-        if weekday not in weekdays:
-            print("not active day")
-            continue
-
-        for h in hours:
-            for m in minutes:
-                start = datetime.datetime.combine(
-                    day,
-                    datetime.time(hour=h, minute=m)
-                )
-                end = start + datetime.timedelta(minutes=runtime_minutes)
-
-                #print(start)
-                #print(now)
-                #print(end)
-                if start <= now < end:
-                    return True
-
-    return False
+def is_now_in_schedule(wake):
+    start = wake.in_session()
+    if start is not None:
+        print(f"In the session that started at {time.strftime('%Y-%m-%d %H:%M', time.localtime(start))}")
+    return start is not None
 
 #don't use set_timezone anymore
 '''def set_timezone(filepath, tz):
@@ -869,6 +835,12 @@ print("------------------------------------")
 print("----------------- STARTING Scheduler!-------------------")
 print("------------------------------------")
 
+# The wake up steps run as a graph of tasks (boot_tasks.py), each one as soon as the ones it needs are
+# done, and their timeline goes to logs/boot_timeline.csv
+boot = BootGraph()
+BOOT_TIMELINE_PATH = "/home/pi/Desktop/Mothbox/logs/boot_timeline.csv"
+ENERGY_HISTORY_PATH = "/home/pi/Desktop/Mothbox/logs/energy.csv"
+
 # EEPROM STUFFFFFFFFFF
 # First figure out if this is a Pi4 or a Pi5
 rpiModel = None
@@ -877,7 +849,9 @@ rpiModel = determinePiModel()
 if rpiModel == 4:
     print("The Pi4 is not fully supported anymore. It will be unable to wake itself back up. If you really need to use this with a pi4, there are old images you can try, but without a pijuice it won't be able to wake itself up.")
 
-if rpiModel == 5:
+def eeprom_task():
+    if rpiModel != 5:
+        return
 
     desired_settings = {"POWER_OFF_ON_HALT": "1", "WAKE_ON_GPIO": "0"}
     current_settings = check_eeprom_settings()
@@ -892,6 +866,8 @@ if rpiModel == 5:
                 current_settings[key] = value
         set_eeprom_settings(current_settings)
         print("EEPROM settings updated.")
+
+boot.add("eeprom", eeprom_task)
 ### ---------- End EEPROM stuff
 
 # Figuring out the controls and settings
@@ -914,6 +890,7 @@ bat80=2.0 # These are bad default values that help us notice if something went w
 bat20=1.0
 bat_Wh=10
 bat_voltage=1
+deployment_end="" # the energy planner makes the battery last until this date, see energy_planner.py
 # Load custom settings
 settings = load_settings(usersettingsFpath)
 print(settings)
@@ -934,83 +911,93 @@ atomic_update_kv(os.path.join(CONTROL_ROOT, "timezone.txt"), "timezone", manTime
 # Check the timezone
 
 # run timezone updater
-print("|><| running the timezone updater to make sure our timezone is correct |><| ")
-process = subprocess.Popen(['python', '/home/pi/Desktop/Mothbox/TimezoneUpdater.py'],
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-stdout, stderr = process.communicate()
-if stderr:
-  print(f"Error running script: {stderr.decode()}")
-else:
-  print(stdout.decode())
+def timezone_task():
+    print("|><| running the timezone updater to make sure our timezone is correct |><| ")
+    process = subprocess.Popen(['python', '/home/pi/Desktop/Mothbox/TimezoneUpdater.py'],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if stderr:
+      print(f"Error running script: {stderr.decode()}")
+    else:
+      print(stdout.decode())
+
+boot.add("timezone", timezone_task)
 
 # See if we should manually set the time
 # Todo: fix the time setting algorithm
 # Set the time manually!
-if(autoTime=="false"):
-    print("We are going to set time manually!")
-    
-    subprocess.run(["timedatectl", "set-ntp", "false"], check=True) # Try to disable auto time
-    subprocess.run([
-    "python3",
-    "/home/pi/Desktop/Mothbox/SetTimeandDate.py",
-    manTime
-    ], check=True)
-    #Turn the manTime off to prevent Groundhog Days
-    update_csv_setting(usersettingsFpath, "autoSystemTime", "True")
+def clock_task():
+    if(autoTime=="false"):
+        print("We are going to set time manually!")
+
+        subprocess.run(["timedatectl", "set-ntp", "false"], check=True) # Try to disable auto time
+        subprocess.run([
+        "python3",
+        "/home/pi/Desktop/Mothbox/SetTimeandDate.py",
+        manTime
+        ], check=True)
+        #Turn the manTime off to prevent Groundhog Days
+        update_csv_setting(usersettingsFpath, "autoSystemTime", "True")
 
-    
-else:
-    print("Time is using autotime")
-    subprocess.run(["timedatectl", "set-ntp", "true"], check=True)    
-    print("Sync hwclock to main clock for security")
-    os.system("sudo hwclock -w")
+    else:
+        print("Time is using autotime")
+        subprocess.run(["timedatectl", "set-ntp", "true"], check=True)
+        print("Sync hwclock to main clock for security")
+        os.system("sudo hwclock -w")
 
-#Reset python's cached version of the time
-time.tzset()
+    #Reset python's cached version of the time
+    time.tzset()
+
+    now = datetime.datetime.now()
+    formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")  # Adjust the format as needed
 
-now = datetime.datetime.now()
-formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")  # Adjust the format as needed
+    print(f"Current time: {formatted_time} on a RPi model " + str(rpiModel))
 
-print(f"Current time: {formatted_time} on a RPi model " + str(rpiModel))
+boot.add("clock", clock_task, after=("timezone",))
 
 
 # ~~~~~~ Setting the Mothbox's unique name ~~~~~~~~~~~~~~~~~~
 
-print("Should we use an automatic name?: ",autoname)
-# Add option for people to manually set a name, but default to autoname made by pi5 serial number 
-if(autoname=="true"):
-    filename = "/home/pi/Desktop/Mothbox/wordlist.csv"  # Replace with your actual filename
-    data = read_csv_into_lists(filename)
-
-    # Access data by category (column name)
-    animals = data["Animal2"]
-    adjectives = data["Adjectives"]
-    colors = data["Colors"]
-    verbs = data["Verbs"]
-    animales = data["Animales"]
-    # print(animales)
-    adjectivos = data["Adjectivos"]
-    # print(adjectivos)
-    verbos = data["Verbos"]
-    # print(verbos)
-    colores = data["Colores"]
-    # print(colores)
-    sustantivos = data["Sustantivos"]
-    # print(sustantivos)
-
-    # SetRaspberrypiName
-    serial_number = get_serial_number()
-    # 0 is english 1 is spanish 2 is either spanish or enlgish 3 is spanglish
-    unique_name = generate_unique_name(serial_number, 3)
-    print(f"Unique name for device: {unique_name}")
-
-    # Change it in controls
-    #set_computerName("/boot/firmware/mothbox_custom/system/controls.txt", unique_name)
-    atomic_update_kv(os.path.join(CONTROL_ROOT, "name.txt"), "name", unique_name)
-else:
-  computerName=manName
-  print(f"manual name for Mothbox: {computerName}")
+def name_task():
+    # generate_unique_name() picks from the word lists as globals
+    global computerName, animals, adjectives, colors, verbs, animales, adjectivos, verbos, colores, sustantivos
+    print("Should we use an automatic name?: ",autoname)
+    # Add option for people to manually set a name, but default to autoname made by pi5 serial number 
+    if(autoname=="true"):
+        filename = "/home/pi/Desktop/Mothbox/wordlist.csv"  # Replace with your actual filename
+        data = read_csv_into_lists(filename)
+
+        # Access data by category (column name)
+        animals = data["Animal2"]
+        adjectives = data["Adjectives"]
+        colors = data["Colors"]
+        verbs = data["Verbs"]
+        animales = data["Animales"]
+        # print(animales)
+        adjectivos = data["Adjectivos"]
+        # print(adjectivos)
+        verbos = data["Verbos"]
+        # print(verbos)
+        colores = data["Colores"]
+        # print(colores)
+        sustantivos = data["Sustantivos"]
+        # print(sustantivos)
+
+        # SetRaspberrypiName
+        serial_number = get_serial_number()
+        # 0 is english 1 is spanish 2 is either spanish or enlgish 3 is spanglish
+        unique_name = generate_unique_name(serial_number, 3)
+        print(f"Unique name for device: {unique_name}")
+
+        # Change it in controls
+        #set_computerName("/boot/firmware/mothbox_custom/system/controls.txt", unique_name)
+        atomic_update_kv(os.path.join(CONTROL_ROOT, "name.txt"), "name", unique_name)
+    else:
+      computerName=manName
+      print(f"manual name for Mothbox: {computerName}")
+
+boot.add("name", name_task)
 # ---- End figure out name -----
 
 
@@ -1037,169 +1024,121 @@ Party: sw-Debug=1 + sw-Active=1 + sw-C1=1 ----- subset of debug mode, but it run
 
 '''
 mode = "ACTIVE"
+runtime = (
+    0  # this is how long to run the mothbox in minutes for once we wakeup, if 0 we did something wrong 
+)
+onlyflash = 0
 
-# Update hardware switch snapshot
-run_script("/home/pi/Desktop/Mothbox/GetConfigSwitches.py", show_output=True)
-
-# Read switches snapshot
-switch_path = os.path.join(CONTROL_ROOT, "switches.txt")
-switch_vals = get_control_values(switch_path)
+def switches_task():
+    global mode
+    # Update hardware switch snapshot
+    run_script("/home/pi/Desktop/Mothbox/GetConfigSwitches.py", show_output=True)
 
-sActive = int(switch_vals.get("Active", 1))
-sDebug  = int(switch_vals.get("Debug", 0))
-sC1     = int(switch_vals.get("C1", 0))
-sU1     = int(switch_vals.get("U1", 0))
-sHI     = int(switch_vals.get("HI", 0))
+    # Read switches snapshot
+    switch_path = os.path.join(CONTROL_ROOT, "switches.txt")
+    switch_vals = get_control_values(switch_path)
 
-print("Active:", sActive)
-print("Debug:",  sDebug)
-print("C1:",     sC1)
-print("U1:",     sU1)
-print("HI:",     sHI)
+    for key in ("Active", "Debug", "C1", "U1", "HI"):
+        print(key + ":", int(switch_vals.get(key, 1 if key == "Active" else 0)))
 
-# Read UTC offset from new control layout
-utc_off = float(read_control("utc", 0))
+    #### Check OFF mode, and the subsets of Active Mode, like Party Mode or Debug (modes.py)
+    mode = mode_from_switches(switch_vals)
+    if mode == "OFF":
+        print("should go to off!")
+        atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
+        # the clock and the schedule still finish, the shutdown sets the next wakeup with them
+        boot.skip("diagnostics", "standby")
+        return
 
-#### Check OFF mode
-if sActive == 0:
-    mode = "OFF"
-    print("should go to off!")
+    # If Active Switch is OFF, it should never make it past here
 
-if mode == "OFF":
+    print("Mothbox mode is:  "+ mode)
+    # Write mode to controls.txt
+    #set_Mode(controlsFpath, mode)
     atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
-    run_shutdown_pi5_FAST()
-    quit()
-
-# If Active Switch is OFF, it should never make it past here
-
-
-#### Check ACtive Modes
-# Now check for subsets of Active Mode, like Party Mode or Debug
-# TODO
-
-if(sDebug==1):
-    None
-    mode="DEBUG"
-
-if(sDebug==1 and sC1==1):
-    None
-    mode="PARTY"
-
-if(sDebug==1 and sU1==1):
-    None
-    mode="QR_PROG"
-
-
-if(sDebug==0 and sU1==1):
-    None
-    mode="SWITCHES"
-
 
-if(sDebug==0 and sHI==1):
-    None
-    mode="HI_POW"
+    # ----------END SWITCH CHECK----------------
 
-print("Mothbox mode is:  "+ mode)
-# Write mode to controls.txt
-#set_Mode(controlsFpath, mode)
-atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
 
-# ----------END SWITCH CHECK----------------
+    # TODO - Implement these modes I haven't coded for yet
+    # for now, temp solution
 
+    if running_mode(mode) != mode:
+        mode = running_mode(mode)
+        atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
+        #set_Mode(controlsFpath, mode)
+        print("temp correct mode: ",mode)
 
-# TODO - Implement these modes I haven't coded for yet
-# for now, temp solution
+    # User Switch Schedule
+    if( mode=="SWITCHES"):
+        None
+        print("Schedule Set by User Switches")
+        #TODO - actually change the code so the user switches determine the schedule
+    else:
+        print("Schedule set by Internal Schedule")
 
-if mode=="HI_POW" or mode=="SWITCHES" or mode=="QR_PROG":
-    mode="ACTIVE"
-    atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
-    #set_Mode(controlsFpath, mode)
-    print("temp correct mode: ",mode)
-   
+boot.add("switches", switches_task)
 
 
 #------ Log Some Diagnostics with Sensors -----------
+# (not when OFF, it only runs once the switches say the Mothbox is on)
 
-run_script("/home/pi/Desktop/Mothbox/Diagnostics.py", "Startup_Check", show_output=True)
-
-
+def diagnostics_task():
+    global vin_reading
+    # like run_script, but keeps the battery reading (read_Vin.py) for the energy planner
+    try:
+        result = subprocess.run(["python3", "/home/pi/Desktop/Mothbox/Diagnostics.py", "Startup_Check"],
+                                capture_output=True, text=True, check=True)
+        print(result.stdout.strip())
+        vin_reading = parse_vin(result.stdout)
+    except subprocess.CalledProcessError as e:
+        print(f"⚠️ Error running Diagnostics.py: {e.stderr.strip() if e.stderr else 'Unknown error'}")
 
+boot.add("diagnostics", diagnostics_task, after=("switches",))
 
 
 # ~~~~~~~~~~~~ Figuring out Scheduling Details ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # ~~~~ Pi 5 specific things to change cron-like commands to the next UTC target
 
-# User Switch Schedule
-if( mode=="SWITCHES"):
-    None
-    print("Schedule Set by User Switches")
-    #TODO - actually change the code so the user switches determine the schedule
-else:
-    print("Schedule set by Internal Schedule")
-
-
-runtime = (
-    0  # this is how long to run the mothbox in minutes for once we wakeup, if 0 we did something wrong 
-)
-onlyflash = 0
-
-
 # ~~~~~~~ Do the Scheduling ~~~~~~~~~~~~~~~~~~~~
 
 #set_timings("/boot/firmware/mothbox_custom/system/controls.txt", settings["minute"], settings["hour"],settings["weekday"],settings["runtime"])
 
+def schedule_task():
+    global runtime, utc_off, next_epoch_time, wake_schedule
+    # Read UTC offset from new control layout (the timezone updater has set it by now)
+    utc_off = float(read_control("utc", 0))
 
+    set_timings(settings["minute"],
+                settings["hour"],
+                settings["weekday"],
+                settings["runtime"])
+    if "runtime" in settings:
+        runtime= int(settings["runtime"])
+        del settings["runtime"]
+    print("printing schedule settings")
+    # compiled once, the standby check uses the same table
+    wake_schedule = compile_schedule(settings, runtime)
+    print(wake_schedule)
 
+    if rpiModel == 4:
+        print("pi4 not supported anymore, it won't be able to wake itself")
 
+    if rpiModel == 5:
+        print("utc_off ", utc_off)
 
-set_timings(settings["minute"],
-            settings["hour"],
-            settings["weekday"],
-            settings["runtime"])
-if "runtime" in settings:
-    runtime= int(settings["runtime"])
-    del settings["runtime"]
-print("printing schedule settings")
-
-if rpiModel == 4:
-    print("pi4 not supported anymore, it won't be able to wake itself")
+        next_epoch_time = wake_schedule.next_wake()
 
-if rpiModel == 5:
-    # don't need to modify the hours to UTC like we do for pijuice
-    # Build Cron expression
-    # The cron expression is made of five fields. Each field can have the following values.
-    # minute (0-59) |	hour (0 - 23)	|day of the month (1 - 31)	| month (1 - 12)	| day of the week (0 - 6)
+        # Clear existing wakeup alarm (assuming sudo access)
+        clear_wakeup_alarm()
 
-    # Loop through each key-value pair in the dictionary
-    for key, value in settings.items():
-        # Check if the value is a string and contains semicolons
-        if isinstance(value, str) and ";" in value:
-            # Replace semicolons with commas
-            settings[key] = value.replace(";", ",")
-    cron_expression = (
-        str(settings["minute"])
-        + " "
-        + str(settings["hour"])
-        + " "
-        + "*"
-        + " "
-        + "*"
-        + " "
-        + str(settings["weekday"])
+    print(
+        f"Next wakeup event scheduled for: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_epoch_time))}"
     )
-    print(cron_expression)
-    print("utc_off ", utc_off)
-
-    next_epoch_time = calculate_next_event(cron_expression, utc_off)
-
-    # Clear existing wakeup alarm (assuming sudo access)
-    clear_wakeup_alarm()
+    set_wakeup_alarm(next_epoch_time)
+    print("Wakeup Alarms have been set!")
 
-print(
-    f"Next wakeup event scheduled for: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_epoch_time))}"
-)
-set_wakeup_alarm(next_epoch_time)
-print("Wakeup Alarms have been set!")
+boot.add("schedule", schedule_task, after=("clock",))
 
 #-- End Scheduling complete, now set all the other settings
 
@@ -1207,37 +1146,39 @@ print("Wakeup Alarms have been set!")
 
 #---------Standby Check - - Check if we should be running now according to schedule, and if not, turn off -------------
 
-if mode == "ACTIVE":  # ignore this if we are in debug mode
-    if is_now_in_schedule(settings, int(runtime)):
-        now_is_in_schedule = 1
-        print("Active, Within schedule window — staying awake")
-    else:
-        now_is_in_schedule = 0
-        print("Active, but outside schedule window, STANDBY mode — shutting down")
-        mode="STANDBY"
-        # Write mode to controls.txt
-        #set_Mode(controlsFpath, mode)
-        atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
-        # Flashing Sequence to indicate to user we are in Standby mode
-        # Have to use non boot locked versions
-        run_cmd("python /home/pi/Desktop/Mothbox/scripts/blink_standby.py")
-        #input("wait debug")
-        #----- End Flash ----
-        run_shutdown_pi5_FAST()
-        quit()
+def standby_task():
+    global mode, now_is_in_schedule
+    if mode == "ACTIVE":  # ignore this if we are in debug mode
+        if is_now_in_schedule(wake_schedule):
+            now_is_in_schedule = 1
+            print("Active, Within schedule window — staying awake")
+        else:
+            now_is_in_schedule = 0
+            print("Active, but outside schedule window, STANDBY mode — shutting down")
+            mode="STANDBY"
+            # Write mode to controls.txt
+            #set_Mode(controlsFpath, mode)
+            atomic_update_kv(os.path.join(CONTROL_ROOT, "mode.txt"), "mode", mode)
+            # the diagnostics still finish, no GPS or display, then the shutdown
+            boot.skip("gps", "display")
+
+boot.add("standby", standby_task, after=("switches", "schedule"))
 
 
 # GPS check / 10 second delay
-print("Checking GPS (if available) for 10 seconds")
-process = subprocess.Popen(['python', '/home/pi/Desktop/Mothbox/GPS.py'],
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-stdout, stderr = process.communicate()
-if stderr:
-  print(f"Error running script: {stderr.decode()}")
-else:
-  print(stdout.decode())
-  
+def gps_task():
+    print("Checking GPS (if available) for 10 seconds")
+    process = subprocess.Popen(['python', '/home/pi/Desktop/Mothbox/GPS.py'],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if stderr:
+      print(f"Error running script: {stderr.decode()}")
+    else:
+      print(stdout.decode())
+
+boot.add("gps", gps_task, after=("standby",))
+
 
 # Toggle a mode where the flash lights are always on
 #enable_onlyflash()
@@ -1247,17 +1188,77 @@ else:
 # ~~~~~~~ Display ~~~~~~~~~~~~~~~~~~~~
 
 #Update the Epaper screen if it is available
-GPIO.cleanup()
-print("Updating Epaper display (if available)")
-process = subprocess.Popen(['python', '/home/pi/Desktop/Mothbox/UpdateDisplay.py'],
-                          stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-stdout, stderr = process.communicate()
-if stderr:
-  print(f"Error running script: {stderr.decode()}")
-else:
-  print(stdout.decode())
+def display_task():
+    GPIO.cleanup()
+    print("Updating Epaper display (if available)")
+    process = subprocess.Popen(['python', '/home/pi/Desktop/Mothbox/UpdateDisplay.py'],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if stderr:
+      print(f"Error running script: {stderr.decode()}")
+    else:
+      print(stdout.decode())
 
+# not next to the diagnostics, both switch the 3V3 sensor line (and this cleans up the GPIO)
+boot.add("display", display_task, after=("standby", "name", "diagnostics"))
+
+
+# ~~~~~~~ Energy budget ~~~~~~~~~~~~~~~~~~~~
+# Records the battery and picks how much of tonight's session it can afford (energy_planner.py)
+ENERGY_PATH = os.path.join(CONTROL_ROOT, "energy.txt")
+vin_reading = None
+energy_plan = None
+session_runtime = 0  # runtime as the energy planner cut it, 0 until it has
+attract_minutes = None
+
+def energy_task():
+    global energy_plan, session_runtime, attract_minutes
+    now = time.time()
+    minutes_per_day = wake_schedule.minutes_per_day(now)
+    planner = EnergyPlanner(ENERGY_HISTORY_PATH)
+    energy_plan = planner.plan(vin_reading, bat_Wh, bat20, bat80, minutes_per_day, parse_end(deployment_end), now)
+    if mode != "ACTIVE":
+        # STANDBY only records the battery, DEBUG and PARTY run until they are turned off
+        energy_plan.update(level=0, factor=1.0, attract_duty=1.0, capture_every=1, runtime=1.0)
+    planner.record(energy_plan, mode, now)
+
+    session_runtime, attract_minutes, attract_until = session_limits(runtime, energy_plan, now)
+    atomic_write(ENERGY_PATH, "".join(f"{k}={v}\n" for k, v in (
+        ("level", energy_plan["level"]), ("capture_every", energy_plan["capture_every"]),
+        ("attract_until", attract_until), ("runtime", session_runtime),
+        ("nights_left", energy_plan["nights_left"]), ("nights_needed", energy_plan["nights_needed"]))))
+    print(f"Energy: {energy_plan['percent']}% ({energy_plan['wh_left']} Wh usable), "
+          f"{energy_plan['wh_per_night']} Wh per night, {energy_plan['nights_left']} nights left, "
+          f"{energy_plan['nights_needed']} needed -> level {energy_plan['level']}: runtime {session_runtime} min, "
+          f"every {energy_plan['capture_every']} trigger(s), attractor {int(energy_plan['attract_duty'] * 100)}%")
+
+boot.add("energy", energy_task, after=("diagnostics", "standby"))
+
+# no limits until energy_task has planned this session, so if it fails the lights and photos
+# don't keep last night's (an attract_until in the past would keep the lights off all session)
+try:
+    atomic_write(ENERGY_PATH, "level=0\ncapture_every=1\nattract_until=0\n")
+except OSError as e:
+    print(f"⚠️ Could not reset {ENERGY_PATH}: {e}")
+
+
+# ~~~~~~~ Run the wake up steps ~~~~~~~~~~~~~~~~~~~~
+# the GPS overlaps the diagnostics and then the display, the clock and the schedule run while the switches are read
+boot.run()
+
+if mode == "OFF" or mode == "STANDBY":
+    if mode == "STANDBY":
+        # Flashing Sequence to indicate to user we are in Standby mode
+        # Have to use non boot locked versions
+        run_cmd("python /home/pi/Desktop/Mothbox/scripts/blink_standby.py")
+        #input("wait debug")
+        #----- End Flash ----
+    boot.mark("shutdown")
+    boot.report()
+    boot.log(BOOT_TIMELINE_PATH)
+    run_shutdown_pi5_FAST()
+    quit()
 
 
 
@@ -1306,15 +1307,32 @@ else:
 
 if os.path.exists(BOOT_LOCK):
     os.remove(BOOT_LOCK)
+boot.mark("boot_lock_released")
 
 ###--------------------------------------###
 
 
-if runtime > 0 and mode != "DEBUG":
+if mode == "ACTIVE":
+    # Keep the camera warm for the whole session, cron triggers photos through TriggerPhoto.py
+    print("Starting the capture daemon")
+    os.makedirs("/home/pi/Desktop/Mothbox/logs", exist_ok=True)
+    capture_log = open("/home/pi/Desktop/Mothbox/logs/CaptureDaemon.log", "a")
+    Popen(["python", "/home/pi/Desktop/Mothbox/CaptureDaemon.py"],
+          stdout=capture_log,
+          stderr=subprocess.STDOUT,
+          start_new_session=True)
+    boot.mark("capture_daemon")
+
+# How long this wake up took, and which steps it waited for
+boot.report()
+boot.log(BOOT_TIMELINE_PATH)
+
+if shuts_down(mode, runtime):
     enable_shutdown()
     time.sleep(0.05)
-    print("Stuff will run for " + str(runtime) + " minutes before shutdown")
-    schedule_shutdown(runtime)
+    session_runtime = session_runtime or runtime
+    print("Stuff will run for " + str(session_runtime) + " minutes before shutdown")
+    schedule_shutdown(session_runtime, attract_minutes)
 else:
     print("no shutdown scheduled, will run indefinitely")
 
@@ -25,11 +25,33 @@ import sys
 #######---- Check for Boot lock ------
 BOOT_LOCK = "/run/boot_script_running"
 
-if os.path.exists(BOOT_LOCK):
+if __name__ == "__main__" and os.path.exists(BOOT_LOCK):
     sys.exit(0)
 
+#######---- Hand the photo to the CaptureDaemon ------
+# In ACTIVE mode the Scheduler starts CaptureDaemon.py, which holds the camera for the whole session.
+# A cron job that still runs TakePhoto.py asks it for the photo (capture_client.py, like TriggerPhoto.py)
+# instead of failing to open the camera. Without a daemon answering, the photo is taken here the old way.
+if __name__ == "__main__":
+    import socket
+    from capture_client import send, SOCKET_PATH as CAPTURE_SOCKET, TIMEOUT as CAPTURE_TIMEOUT
+    if os.path.exists(CAPTURE_SOCKET):
+        try:
+            reply = send({"cmd": "capture"})
+        except socket.timeout:
+            # the daemon is alive but busy, don't fight it for the camera
+            print(f"Capture daemon did not answer within {CAPTURE_TIMEOUT} seconds")
+            sys.exit(1)
+        except (OSError, ValueError) as e:
+            print(f"Capture daemon not available ({e}), taking the photo here")
+        else:
+            print(reply)
+            sys.exit(0 if reply.get("ok") else 1)
+
 #-----------------------------##
 import time
+#before the slow imports, so a restart after calibration (CalibrationRestart) is counted in full
+session_start = float(os.environ.get("MOTHBOX_SESSION_START", time.time()))
 from picamera2 import Picamera2, Preview
 from libcamera import controls
 from libcamera import Transform
@@ -54,6 +76,22 @@ import time
 import os, platform
 from pathlib import Path
 
+from flash_control import FlashController
+from photo_pipeline import EncodePipeline, RequestFrame, ArrayFrame, PREVIEW_WIDTHS, with_suffix, frame_bytes
+from bracketing import BracketEngine
+from exposure_model import ExposureModel, read_ambient_lux
+from focus import FocusTracker, LensTable, read_board_temp, read_cpu_temp, sharpness
+from exposure_feedback import ExposureTracker, frame_stats
+from change_detect import ChangeDetector, SaveDecision
+from frame_metadata import MetadataLog, frame_record, metadata_path
+from storage_planner import StoragePlanner, minutes_left_tonight
+from wake_schedule import WakeSchedule
+from energy_planner import energy_skip
+from raw_spool import RawSpool, SpoolCompressor, external_power
+from multi_camera import CameraRig, MULTI_CAMERA_SIZE, camera_count, camera_filepath
+from burst import BurstEngine, BUFFERS as BURST_BUFFERS
+from sheet_crop import detect_sheet, to_sensor, to_frame, scaler_crop, parse_crop, format_crop, CropSavings
+
        
 CONTROL_ROOT = Path("/boot/firmware/mothbox_custom/system/controls")
 CAMERA_SETTINGS_PATH = "/boot/firmware/mothbox_custom/camera_settings.csv"
@@ -61,6 +99,12 @@ DEFAULT_CAMERA_SETTINGS_PATH = "/boot/firmware/mothbox_custom/system/controls/de
 AF_LENS_PATH = CONTROL_ROOT / "aflensposition.txt"
 AF_GAIN_PATH=CONTROL_ROOT / "autogain.txt"
 AF_EXPOSURE_PATH =CONTROL_ROOT / "exposuretime.txt"
+EXPOSURE_HISTORY_PATH = CONTROL_ROOT / "exposure_history.csv"
+OLD_FOCUS_PATH = CONTROL_ROOT / "focus.txt"  # where the focus and exposure trackers used to be, still read once
+OLD_EXPOSURE_FEEDBACK_PATH = CONTROL_ROOT / "exposure_feedback.txt"
+LENS_TABLE_PATH = CONTROL_ROOT / "lens_table.csv"
+SHEET_CROP_PATH = CONTROL_ROOT / "sheetcrop.txt"
+ENERGY_PATH = CONTROL_ROOT / "energy.txt"
 
 
 def read_control(path: Path, key: str, default=None):
@@ -105,12 +149,20 @@ desktop_path = Path(
     "/home/pi/Desktop/Mothbox"
 )  # Assuming user is "pi" on your Raspberry Pi
 
+# the trackers are saved after every photo, so they live next to the logs on the SD card's root partition,
+# not in the controls folder on the FAT boot partition
+FOCUS_PATH = desktop_path / "logs" / "focus.txt"
+EXPOSURE_FEEDBACK_PATH = desktop_path / "logs" / "exposure_feedback.txt"
+
 def restart_script():
     """
     Terminates the current script and restarts it.
     """
     print("Restarting script...")
     time.sleep(1)  # Optional: Add a small delay for clarity
+    #so the restarted script can still report how long calibration + photo took
+    os.environ["MOTHBOX_SESSION_START"] = str(session_start)
+    os.environ["MOTHBOX_CALIBRATION_END"] = str(time.time())
     python_executable = sys.executable
     script_path = sys.argv[0]
     os.execv(python_executable, [python_executable, script_path])
@@ -153,14 +205,23 @@ def run_cmd(cmd):
     """Run a shell command safely"""
     subprocess.run(cmd, shell=True, check=False)
 
+# GPIO is driven in-process now, shelling out to Flash_On.py kept the flash lit for hundreds of ms
+# made by setup_flash() in main() or the CaptureDaemon's startup, so importing TakePhoto doesn't touch the GPIO
+flash = None
+
+def setup_flash():
+    """Sets up the flash and attractor pins and turns the attractors on, before any shot is timed"""
+    global flash
+    if flash is None:
+        flash = FlashController()
+    flash.prepare()
+
 def flashOff():
-    run_cmd("python /home/pi/Desktop/Mothbox/Flash_Off.py")
-    print("Flash Off\n")
-    run_cmd("python /home/pi/Desktop/Mothbox/Attract_On.py") # keep regulator on
+    lit = flash.off()
+    print("Flash Off  (lit for " + str(round(lit, 3)) + " s)\n")
 
 def flashOn():
-    run_cmd("python /home/pi/Desktop/Mothbox/Attract_On.py")
-    run_cmd("python /home/pi/Desktop/Mothbox/Flash_On.py")
+    flash.on()
 
     print("Flash On\n")
 
@@ -195,7 +256,7 @@ def auto_cast_value(setting, value):
     if setting in ("AeEnable", "AwbEnable"):
         return value.lower() in ("1", "true", "yes", "on")
 
-    if setting in ("LensPosition", "AnalogueGain", "ExposureValue"):
+    if setting in ("LensPosition", "AnalogueGain", "ExposureValue", "SpoolExternalVolts"):
         return float(value)
 
     if setting in (
@@ -204,7 +265,13 @@ def auto_cast_value(setting, value):
         "HDR", "HDR_width",
         "AutoCalibration", "AutoCalibrationPeriod",
         "ImageFileType", "VerticalFlip",
-        "onlyflash"
+        "onlyflash",
+        "EncoderWorkers", "EncodeQueueDepth", "ZeroCopyFrames", "JpegEncoder",
+        "CalibrationRestart", "ExposurePrediction",
+        "SharpnessTrigger", "MaxCalibrationPeriod", "LensCache",
+        "RedundantFrames", "ChangePixels", "Previews", "StoragePlanning",
+        "SpoolFrames", "SpoolGB", "SpoolIdleSeconds", "CameraCount",
+        "BurstFrames", "BurstFps", "SheetCrop", "CaptureFormat", "ExposureFeedback"
     ):
         return int(float(value))
 
@@ -333,8 +400,26 @@ def start_cron():
 def print_af_state(request):
     md = request.get_metadata()
     #print(("Idle", "Scanning", "Success", "Fail")[md['AfState']], md.get('LensPosition'))
-def run_calibration():
-    global calib_lens_position, calib_exposure, camera_settings, width, height, picam2
+def run_calibration(restart=False, predicted=None, lens=None):
+    """
+    Runs the exposure and autofocus calibration and saves the results to the control files.
+    The results go straight to the still capture in the same camera session. restart=True is the old
+    behaviour of re-executing the whole script afterwards (CalibrationRestart in the camera CSV)
+    predicted is an exposure from predict_calibration(), with it only the focus is calibrated
+    lens is a lens position from predict_lens(), with it autofocus_cycle() is skipped
+    With both, the camera doesn't even need to run.
+    """
+    global calib_lens_position, calib_exposure, calib_gain, LastCalibration, camera_settings, width, height, picam2
+
+    if predicted and lens is not None and not (SheetCrop and sheet_rect is None):
+        print("Exposure from the light sensor and focus from the lens table, no need to run the camera")
+        calib_exposure = predicted["ExposureTime"]
+        calib_gain = predicted["AnalogueGain"]
+        calib_lens_position = lens
+        lens_from_table(lens)
+        save_calibration()
+        return
+
     #preview_config = picam2.create_preview_configuration(main={'format': 'RGB888', 'size': (4624, 3472)})
     preview_config = picam2.create_preview_configuration(main={'size': (1920*2, 1080*2)})
     #still_config = picam2.create_still_configuration(main={"size": (width, height), "format": "RGB888"}, buffer_count=1)
@@ -343,96 +428,345 @@ def run_calibration():
     
     #picam2.set_controls({"AfMode":0,"AfSpeed":0,"AfRange":0, "LensPosition":7.0})
 
-    
-    #time.sleep(1)
     picam2.pre_callback = print_af_state
     
-    
-    time.sleep(2)
-    picam2.set_controls({"LensPosition":7.0})
+    picam2.set_controls({"LensPosition":7.0 if lens is None else lens})
     #picam2.set_controls({"AfSpeed":controls.AfSpeedEnum.Fast})
 
     
     exposurevalue=camera_settings["ExposureValue"]
     picam2.set_controls({"ExposureValue":exposurevalue})# Floating point number between -8.0 and 8.0
-    picam2.set_controls({"ExposureTime":500}) #we want a fast photo so we don't get blurry insects. We lock the exposure time and adjust gain. The max speed seems to be 469, but we will leave some overhead
-
-
-    time.sleep(1)
+    if predicted:
+        picam2.set_controls({"ExposureTime": predicted["ExposureTime"], "AnalogueGain": predicted["AnalogueGain"]})
+    else:
+        auto_gain_on() #a camera that stays open (CaptureDaemon) still has the last photo's manual gain
+        picam2.set_controls({"ExposureTime":500}) #we want a fast photo so we don't get blurry insects. We lock the exposure time and adjust gain. The max speed seems to be 469, but we will leave some overhead
 
     print("!!! Autofocusing !!!")
     afstart = time.time()
     flashOn()
     picam2.start(show_preview=False)
     #picam2.start()
-    
-    for i in range(5):
-        if i == 15:
-            pass
-            #picam2.set_controls({'AnalogueGain': 4.0})
-            #picam2.set_controls({"ExposureValue":-4.0})# Floating point number between -8.0 and 8.0
-
-        elif i == 50:
-            pass
-            #picam2.set_controls({'AnalogueGain': 1.2})
-            #picam2.set_controls({"ExposureValue":8.0})# Floating point number between -8.0 and 8.0
 
-        md = picam2.capture_metadata()
-        print(i, "Calibrating for BRIGHTNESS--  exposure: ", md['ExposureTime'],"  gain: ", md['AnalogueGain'], "  Lensposition:", md['LensPosition'])
-    
-    md = picam2.capture_metadata()
-    calib_exposure = md['ExposureTime']
-    autogain= md['AnalogueGain']
+    if predicted:
+        #the light sensor already told us the exposure, no need to meter it with the camera
+        calib_exposure = predicted["ExposureTime"]
+        autogain = predicted["AnalogueGain"]
+    else:
+        #wait for the auto gain to actually converge instead of trusting whatever it says after a fixed number of frames
+        md = settle_camera(label="Calibrating for BRIGHTNESS")
+        calib_exposure = md['ExposureTime']
+        autogain= md['AnalogueGain']
+        if ambient_lux is not None:
+            exposure_model.add(ambient_lux, 1, exposurevalue, calib_exposure, autogain)
+    calib_gain = autogain
 
     print("Exposure: "+str(calib_exposure))
     print("Autogain: "+str(autogain))
     
     time.sleep(.1) #give a tiny bit of time to let the flash start up
 
-    #picam2.set_controls({"AfMode": 2})
-    #time.sleep(7)
-    print("Running autofocus...")
-    #picam2.start(show_preview=True, ) #preview has to be on for some reason to work
-    success = picam2.autofocus_cycle()
+    if lens is None:
+        #picam2.set_controls({"AfMode": 2})
+        #time.sleep(7)
+        print("Running autofocus...")
+        #picam2.start(show_preview=True, ) #preview has to be on for some reason to work
+        success = picam2.autofocus_cycle()
 
-    #picam2.pre_callback = None
+        #picam2.pre_callback = None
+        md = picam2.capture_metadata()
+        
+        
+
+        calib_lens_position = md['LensPosition']
+        #new focus, the next shots teach us what sharp looks like now
+        focus_tracker.reset()
+        save_focus_tracker()
+        lens_table.add("af", board_temp, cpu_temp, calib_lens_position)
+        focusstate = md['AfState']
+
+        print("LensPosition: "+str(calib_lens_position))
+        print(focusstate)
+    else:
+        calib_lens_position = lens
+        lens_from_table(lens)
+
+    #Photos used to come out slightly brighter than a fresh start when we went straight from here to the photo,
+    #because the auto gain was still running with its own digital gain on top of what we measured.
+    #Pin the measured values now and wait until the frames actually come out with them, so the still capture
+    #starts from the same state a freshly started camera would be in.
+    locked = {"ExposureTime": int(calib_exposure), "AnalogueGain": float(calib_gain), "LensPosition": float(calib_lens_position)}
+    picam2.set_controls(locked)
+    settle_camera(locked, label="Locking calibration")
+    if SheetCrop:
+        find_sheet()
     flashOff()
     print("Autofocus completed! "+str(time.time()-afstart))
-    md = picam2.capture_metadata()
-    
-    
 
-    calib_lens_position = md['LensPosition']
-    atomic_update_kv(AF_LENS_PATH, "aflensposition", calib_lens_position)
-    focusstate = md['AfState']
+    picam2.stop()
+    picam2.stop_preview()
+    picam2.pre_callback = None
+
+    save_calibration()
+    
+    #the old way: restart the whole script because if we just ran the photo taking it was always slightly brighter
+    if restart:
+        time.sleep(1)
+        restart_script()
 
-    print("LensPosition: "+str(calib_lens_position))
-    print(focusstate)
 
+def save_calibration():
+    """Writes the calibrated lens position, exposure and gain to the control files"""
+    global LastCalibration
+    atomic_update_kv(AF_LENS_PATH, "aflensposition", calib_lens_position)
 
-    #camera_settings["LensPosition"]=calib_lens_position
-    
     #camera_settings["ExposureTime"]=calib_exposure
     atomic_update_kv(AF_EXPOSURE_PATH, "exposuretime", calib_exposure)
 
     #camera_settings["AnalogueGain"]=autogain
-    atomic_update_kv(AF_GAIN_PATH, "autogain", autogain)
+    atomic_update_kv(AF_GAIN_PATH, "autogain", calib_gain)
 
-    picam2.stop()
-    picam2.stop_preview()
-    
     #save last time
     #set_last_calibration(control_values_fpath)
-    atomic_update_kv(os.path.join(CONTROL_ROOT, "lastcalibration.txt"), "lastcalibration", str(time.time()))
+    LastCalibration = time.time()
+    atomic_update_kv(os.path.join(CONTROL_ROOT, "lastcalibration.txt"), "lastcalibration", str(LastCalibration))
+    #the new exposure is right for the sheet as it is now, start learning what that looks like again
+    exposure_tracker.reset()
+    save_exposure_tracker()
 
     #save the calibrated settings back to the CSV
     #new_settings = {"LensPosition": calib_lens_position, "ExposureTime": calib_exposure, "AnalogueGain": autogain} 
     #update_camera_settings(chosen_settings_path, new_settings)
-    
-    #restart the whole script now because for some reason if we just run the phot taking it is always slightly brighter
-    time.sleep(1)
-    restart_script()
-    
+
+
+def find_sheet():
+    """Finds the sheet on a preview frame (with the flash on) and saves where it is, see sheet_crop.py"""
+    global sheet_rect, crop_savings
+    request = picam2.capture_request()
+    try:
+        metadata = request.get_metadata()
+        array = request.make_array("main")
+    finally:
+        request.release()
+    size = (array.shape[1], array.shape[0])
+    box = detect_sheet(array, picam2.camera_configuration()["main"]["format"])
+    sheet_rect = to_sensor(box, metadata.get("ScalerCrop", (0, 0) + size)) if box else None
+    crop_savings = None
+    if box:
+        print(f"Sheet found at {format_crop(sheet_rect)} on the sensor, {box[2] * box[3]:.0%} of the frame")
+    else:
+        print("⚠️ Couldn't find the sheet, saving whole photos")
+    atomic_update_kv(SHEET_CROP_PATH, "sheetcrop", format_crop(sheet_rect))
+
+
+def predict_lens():
+    """
+    Reads the board and CPU temperature and looks up where autofocus put the lens at that temperature before.
+    Returns the lens position, or None when autofocus has to run
+    """
+    global board_temp, cpu_temp
+    board_temp = read_board_temp()
+    cpu_temp = read_cpu_temp()
+    if not LensCache:
+        return None
+    if focus_tracker.table_failed():
+        print("Photos got blurry with the lens from the lens table, running a real autofocus")
+        return None
+    lens = lens_table.lookup(board_temp, cpu_temp)
+    if lens is None:
+        print(f"Lens table has nothing trusted for board {board_temp} C  cpu {cpu_temp} C, running autofocus")
+    else:
+        print(f"Lens position {lens:.3f} from the lens table (board {board_temp} C  cpu {cpu_temp} C)")
+    return lens
+
+
+def lens_from_table(lens):
+    lens_table.add("table", board_temp, cpu_temp, lens)
+    focus_tracker.lens_from_table()
+    save_focus_tracker()
+
+
+def predict_calibration():
+    """
+    Reads the light sensor and asks the exposure model what calibration would find.
+    Returns the prediction, or None when the camera has to meter it (a real calibration then adds to the history)
+    """
+    global ambient_lux
+    ambient_lux = read_ambient_lux()
+    if not ExposurePrediction:
+        return None
+    min_exp, max_exp, _ = picam2.camera_controls["ExposureTime"]
+    min_gain, max_gain, _ = picam2.camera_controls["AnalogueGain"]
+    return exposure_model.predict(ambient_lux, 1, camera_settings["ExposureValue"], (min_exp, max_exp), (min_gain, max_gain))
+
+
+def apply_prediction(prediction):
+    """Uses a predicted exposure for the photo instead of the one saved by the last calibration"""
+    global calib_exposure, calib_gain
+    if prediction and AutoCalibration:
+        calib_exposure = prediction["ExposureTime"]
+        calib_gain = prediction["AnalogueGain"]
+
+
+def load_focus_tracker():
+    global focus_tracker
+    path = FOCUS_PATH if FOCUS_PATH.exists() else OLD_FOCUS_PATH
+    state = {k: read_control(path, k, 0) for k in ("baseline", "samples", "low", "cached")}
+    focus_tracker = FocusTracker(state, drop=SharpnessTrigger / 100)
+
+
+def save_focus_tracker():
+    try:
+        FOCUS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(FOCUS_PATH, "".join(f"{k}={v}\n" for k, v in focus_tracker.state().items()))
+    except OSError as e:
+        print(f"⚠️ Could not save focus state: {e}")
+
+
+def load_exposure_tracker():
+    global exposure_tracker
+    keys = ("baseline", "baseline_clipped", "samples", "stops", "at_limit")
+    path = EXPOSURE_FEEDBACK_PATH if EXPOSURE_FEEDBACK_PATH.exists() else OLD_EXPOSURE_FEEDBACK_PATH
+    exposure_tracker = ExposureTracker({k: read_control(path, k, 0) for k in keys})
+
+
+def save_exposure_tracker():
+    try:
+        EXPOSURE_FEEDBACK_PATH.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(EXPOSURE_FEEDBACK_PATH, "".join(f"{k}={v}\n" for k, v in exposure_tracker.state().items()))
+    except OSError as e:
+        print(f"⚠️ Could not save exposure feedback state: {e}")
+
+
+def corrected_exposure():
+    """The calibrated exposure and gain with the exposure feedback's correction, see exposure_feedback.py"""
+    min_exp, max_exp, _ = picam2.camera_controls["ExposureTime"]
+    min_gain, max_gain, _ = picam2.camera_controls["AnalogueGain"]
+    return exposure_tracker.apply(calib_exposure, calib_gain, (max(1.0, min_gain), max_gain), (min_exp, max_exp))
+
+
+def record_exposure(results):
+    """
+    Feeds the brightness the encode workers measured to the exposure tracker, logs the correction
+    and sets it up for the next shot
+    """
+    for r in results:
+        stats = r.get("analysis", {}).get("exposure")
+        if stats is None:
+            continue
+        before = (camera_settings["ExposureTime"], camera_settings["AnalogueGain"])
+        error = exposure_tracker.record(stats)
+        save_exposure_tracker()
+        camera_settings["ExposureTime"], camera_settings["AnalogueGain"] = corrected_exposure()
+        append_log_csv("exposure_feedback.csv",
+                       "time,file,mean,clipped,p01,p50,p90,p99,baseline,error_stops,correction_stops,"
+                       "exposure,gain,next_exposure,next_gain",
+                       [os.path.basename(r["file"]), stats["mean"], stats["clipped"], stats["p01"], stats["p50"],
+                        stats["p90"], stats["p99"], round(exposure_tracker.baseline, 2),
+                        "" if error is None else round(error, 3), round(exposure_tracker.stops, 3),
+                        before[0], before[1], camera_settings["ExposureTime"], camera_settings["AnalogueGain"]])
+        if error is None:
+            print(f"Brightness {stats['p90']} (learning the baseline after calibration)")
+        else:
+            print(f"Brightness {stats['p90']} of baseline {exposure_tracker.baseline:.0f} ({error:+.2f} stops)  "
+                  f"next shot {camera_settings['ExposureTime']}us gain {camera_settings['AnalogueGain']} "
+                  f"({exposure_tracker.stops:+.2f} stops from calibration)")
+
+
+def record_sharpness(results):
+    """Feeds the sharpness the encode workers measured to the focus tracker and logs it for every shot"""
+    for r in results:
+        value = r.get("analysis", {}).get("sharpness")
+        if value is None:
+            continue
+        ratio = focus_tracker.record(value)
+        save_focus_tracker()
+        append_log_csv("sharpness.csv",
+                       "time,file,sharpness,baseline,ratio,lensposition,exposure,low_shots,refocus",
+                       [os.path.basename(r["file"]), round(value, 2), round(focus_tracker.baseline, 2),
+                        "" if ratio is None else round(ratio, 3), calib_lens_position, calib_exposure,
+                        focus_tracker.low, int(focus_tracker.needs_focus())])
+        if ratio is None:
+            print(f"Sharpness {value:.1f}  (learning the baseline after autofocus)")
+        else:
+            print(f"Sharpness {value:.1f}  {ratio:.0%} of baseline {focus_tracker.baseline:.1f}")
+
+
+def auto_gain_on():
+    """Hands the gain back to the auto exposure (newer libcamera splits AeEnable into per control modes)"""
+    if "AnalogueGainMode" in picam2.camera_controls:
+        picam2.set_controls({"AnalogueGainMode": 0}) # 0 is Auto
+    else:
+        picam2.set_controls({"AeEnable": True, "AnalogueGain": 0.0}) # older libcamera: a gain of 0 means auto
+
+
+def controls_match(md, targets):
+    """True if a frame's metadata shows the controls we asked for (the sensor rounds exposure to whole lines)"""
+    for name, want in targets.items():
+        got = md.get(name)
+        if got is None:
+            continue
+        if name == "ExposureTime":
+            ok = abs(got - want) <= max(50, 0.05 * want)
+        elif name == "LensPosition":
+            ok = abs(got - want) <= 0.1
+        else:
+            ok = abs(got - want) <= 0.05 * want
+        if not ok:
+            return False
+    return True
+
+
+def settle_camera(targets=None, max_frames=30, stable_frames=3, label="Settling"):
+    """
+    Reads frames from the running camera until the brightness it is producing has stopped changing
+    (ExposureTime x AnalogueGain x DigitalGain steady for stable_frames frames) and, if targets are given,
+    the frames show those control values. Returns the metadata of the last frame.
+    This replaces fixed sleeps: it is done as soon as the camera is, and never before.
+    """
+    global last_settle
+    history = []
+    md = {}
+    for i in range(max_frames):
+        md = picam2.capture_metadata()
+        total = md.get("ExposureTime", 0) * md.get("AnalogueGain", 1.0) * md.get("DigitalGain", 1.0)
+        print(i, label + "--  exposure: ", md.get("ExposureTime"), "  gain: ", md.get("AnalogueGain"),
+              "  digital gain: ", md.get("DigitalGain"), "  Lensposition:", md.get("LensPosition"))
+        if targets and not controls_match(md, targets):
+            history = []
+            continue
+        history.append(total)
+        recent = history[-stable_frames:]
+        if len(recent) == stable_frames and max(recent) - min(recent) <= 0.02 * max(recent):
+            break
+    else:
+        print("⚠️ Camera did not settle after " + str(max_frames) + " frames")
+    last_settle = {"frames": i + 1, "digital_gain": md.get("DigitalGain")}
+    return md
+
+
+def append_log_csv(filename, header, values):
+    """Appends one row to a csv in the logs folder, writing the header if the file is new"""
+    log_path = desktop_path / "logs" / filename
+    try:
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        new = not log_path.exists()
+        with open(log_path, "a") as f:
+            if new:
+                f.write(header + "\n")
+            f.write(",".join(str(v) for v in [datetime.now().isoformat(timespec='seconds')] + list(values)) + "\n")
+    except OSError as e:
+        print(f"⚠️ Could not write {filename}: {e}")
+
+
+def log_calibration_timing(mode, calibration_s, shot_s):
+    """Appends one line per calibrated session so in-place and restart calibration can be compared"""
+    append_log_csv("calibration_timing.csv",
+                   "time,mode,calibration_s,shot_s,total_s,exposure,gain,shot_digital_gain,settle_frames",
+                   [mode, f"{calibration_s:.2f}", f"{shot_s:.2f}", f"{calibration_s + shot_s:.2f}",
+                    calib_exposure, calib_gain, last_settle.get('digital_gain'), last_settle.get('frames')])
+    print(f"Calibration {calibration_s:.2f} s + photo {shot_s:.2f} s = {calibration_s + shot_s:.2f} s  ({mode})")
+
 
 def list_exposuretimes(middle_exposuretime, num_photos, exposure_width):
   """
@@ -490,17 +824,7 @@ def create_dated_folder(base_path):
   os.chmod(folder_path, 0o777)  # mode=0o777 for read write for all users
   return folder_path+"/"
 
-def takePhoto_Manual():
-    global middleexposure, calib_lens_position, calib_exposure
-    # LensPosition: Manual focus, Set the lens position.
-    now = datetime.now()
-    timestamp = now.strftime("%Y_%m_%d__%H_%M_%S")  # Adjust the format as needed
-    #TODO MAKE ALL TIME ISO FORMAT
-    #timestamp = now.strftime("%y%m%d%H%M%S")
-    #serial_number = get_serial_number()
-    #lastfivedigits=serial_number[-5:]
-
-
+def apply_capture_controls():
     ''''''
     if camera_settings:
         picam2.set_controls(camera_settings)
@@ -514,16 +838,52 @@ def takePhoto_Manual():
     #important note, to actually 100% lock down an AWB you need to set ColourGains! (0,0) works well for plain white LEDS
     cgains = 2.25943877696990967, 1.500129925489425659
     picam2.set_controls({"ColourGains": cgains})
+
+    #the other cameras take the same photo, with what camera 0 calibrated
+    for cam in extra_cameras:
+        if camera_settings:
+            cam.set_controls(camera_settings)
+        cam.set_controls({"ColourGains": cgains})
+
+
+def capture_targets():
+    """The control values a frame has to show before it is good for a photo"""
+    return {k: camera_settings[k] for k in ("ExposureTime", "AnalogueGain", "LensPosition") if k in camera_settings}
+
+
+def takePhoto_Manual(keep_running=False):
+    """
+    Captures one photo (or an HDR bracket) and saves it to the dated photo folder.
+    keep_running=True leaves the camera streaming afterwards so the next call can skip the warm up sleeps.
+    Returns the list of saved file paths.
+    """
+    global middleexposure, calib_lens_position, calib_exposure, last_capture_time, last_pipeline_timings, last_bracket_stats
+    global last_storage_plan, last_rig_stats, last_burst_stats, crop_savings
+    # LensPosition: Manual focus, Set the lens position.
+    now = datetime.now()
+    timestamp = now.strftime("%Y_%m_%d__%H_%M_%S")  # Adjust the format as needed
+    #TODO MAKE ALL TIME ISO FORMAT
+    #timestamp = now.strftime("%y%m%d%H%M%S")
+    #serial_number = get_serial_number()
+    #lastfivedigits=serial_number[-5:]
+
+
+    apply_capture_controls()
    
     middleexposure = camera_settings["ExposureTime"]
     #middleexposure = calib_exposure  # this is more correct i think, but it's messing it up if it is here!
     exposure_times = list_exposuretimes(middleexposure, num_photos,exposuretime_width)
     print(exposure_times)
     
-    time.sleep(1)
-    picam2.start()
-        
-    time.sleep(3)
+    #a camera that is still streaming from the last shot already has these settings sunk in
+    warm = keep_running and picam2.started
+    if not warm:
+        for cam in extra_cameras:
+            if not cam.started:
+                cam.start()
+        picam2.start()
+        #wait for the frames to show our exposure, gain and lens position rather than a fixed few seconds
+        settle_camera(capture_targets(), label="Starting")
 
     start = time.time()
 
@@ -535,93 +895,436 @@ def takePhoto_Manual():
 
 
     exposureset_delay=.3 #values less than 5 don't seem to work! (unless you restart the cam!)
-    requests = []  # Create an empty list to store requests
-    PILs = []
-    metadatas = []
-    #HDR loop
-    for i in range(num_photos):
-        #middleexposure = camera_settings["ExposureTime"]
-        
-        picam2.set_controls({"ExposureTime":exposure_times[i] })
-        print("exp  ",exposure_times[i],"  ",i)
-        #picam2.set_controls({"NoiseReductionMode":controls.draft.NoiseReductionModeEnum.HighQuality})
-        picam2.start() #need to restart camera or wait a couple frames for settings to change
 
-        time.sleep(exposureset_delay)#need some time for the settings to sink into the camera)
-        
-        flashOn()
-        request = picam2.capture_request(flush=True)
-
-        flashOff()
-        #if not onlyflash:
-            #flashOff()
-        flashtime=time.time()-start
-
-        pilImage = request.make_image("main")
-        PILs.append(pilImage)
-        #image_buffer = request.make_array("main")
-        #requests.append(image_buffer)
-        
+    # Save the image using PIL to get the image data on disk
+    folderPath= "/home/pi/Desktop/Mothbox/photos/" #can't use relative directories with cron
+    if not os.path.exists(folderPath):
+      os.makedirs(folderPath)
+    os.chmod(folderPath, 0o777)  # mode=0o777 for read write for all users
+
+    folderPath = create_dated_folder(folderPath)
+
+    burst = burst_length() if BurstFrames > 1 and num_photos == 1 and not extra_cameras else 0
+    #a burst gets a queue deep enough for all of its frames, so the camera never waits for the encoders
+    pipeline = get_burst_pipeline(burst) if burst else get_pipeline()
+    #every camera has its own encode pipeline, camera 0's is the usual one
+    pipelines = [pipeline] + get_extra_pipelines()
+    timings_before = [len(p.timings) for p in pipelines]
+    saved_paths = []
+    capture_start = time.time()
+    #save smaller if the free space wouldn't last the night otherwise
+    plan = plan_storage()
+    quality = plan["quality"] if plan else 96
+    #the middle exposure decides if this shot shows anything new, the rest of a bracket follows it
+    decision = SaveDecision(plan["redundant"] if plan else RedundantFrames)
+    frame_metadata = {}
+    main_size = picam2.camera_configuration()["main"]["size"]
+    main_format = picam2.camera_configuration()["main"]["format"]
+
+    def hand_off(i, request, cam=0):
+        """frames go to the encoder workers as soon as they are captured"""
+        global last_capture_time, crop_savings
+        if not saved_paths:
+            last_capture_time = time.time()
+        metadata = request.get_metadata()
+        if burst:
+            # a copy, so the camera gets its buffer back before the next frame of the burst
+            frame = ArrayFrame(request.make_array("main"), main_format, main_size)
+            request.release()
+        elif ZeroCopyFrames:
+            # the encoder reads the camera buffer directly and releases the request when it is done
+            frame = RequestFrame(request, "main")
+        elif main_format == "YUV420":
+            # make_image can't do YUV, a copy of the planes is just as good for the encoders
+            frame = ArrayFrame(request.make_array("main"), main_format, main_size)
+            request.release()
+        else:
+            frame = request.make_image("main")
+            #image_buffer = request.make_array("main")
+            request.release()
         #print(request.get_metadata()) # this is the metadata for this image
-        metadatas.append(request.get_metadata())
-        request.release()
+        capture_s = time.time() - capture_start
+        print("picture take time: "+str(time.time()-start))
+
+        if burst:
+            filepath = with_suffix(photo_filepath(folderPath, timestamp, 0), f"_burst{i}")
+        else:
+            filepath = photo_filepath(folderPath, timestamp, i)
+        if extra_cameras:
+            filepath = camera_filepath(filepath, cam)
+        frame_metadata[filepath] = dict(frame_record(metadata), hdr=i, file=os.path.basename(filepath))
+        exif_bytes = build_exif(exposure_times[min(i, len(exposure_times) - 1)])
+        #the middle exposure is the one we judge the focus and the change on (camera 0's, the others follow it)
+        analyzers = None
+        if i == 0 and cam == 0:
+            analyzers = {"sharpness": sharpness, "change": get_change_detector().analyze}
+            if ExposureFeedback and AutoCalibration:
+                analyzers["exposure"] = frame_stats
+        #the sheet was found by camera 0, the others keep their whole frame
+        crop = sheet_box(metadata, main_size) if cam == 0 else None
+        measure = False
+        if crop:
+            if crop_savings is None:
+                crop_savings = CropSavings((crop[2] - crop[0]) * (crop[3] - crop[1]) / (main_size[0] * main_size[1]))
+            #the first photo with a new crop is also encoded whole, to see what cropping saves
+            measure = i == 0 and crop_savings.bytes_ratio is None
+        pipelines[cam].submit(frame, filepath, {"exif": exif_bytes, "quality": quality}, capture_s, analyzers, decision,
+                              crop, measure)
+        saved_paths.append(filepath)
+
+    last_bracket_stats = {}
+    last_rig_stats = {}
+    last_burst_stats = {}
+    if burst:
+        #every frame of the burst under one flash window, as fast as the sensor goes (or BurstFps)
+        last_burst_stats = BurstEngine(picam2, flash).capture(burst, exposure_times[0], BurstFps, hand_off)
+        append_log_csv("burst.csv", "time,frames,target_fps,fps,dropped,lit_ms",
+                       [last_burst_stats[k] for k in ("frames", "target_fps", "fps", "dropped", "lit_ms")])
+    elif extra_cameras:
+        #every exposure is taken by all cameras at once under one flash
+        rig = CameraRig([picam2] + extra_cameras, flash)
+        skews = []
+        for i, exposure in enumerate(exposure_times):
+            for cam in rig.cameras:
+                cam.set_controls({"ExposureTime": exposure})
+            if i > 0 or not warm:
+                time.sleep(exposureset_delay)
+            skews.append(rig.capture(exposure, lambda cam, request, i=i: hand_off(i, request, cam))["skew_ms"])
+        last_rig_stats = {"cameras": len(rig.cameras), "skew_ms": skews}
+    elif num_photos > 1:
+        #HDR - every exposure gets queued into the running camera, no stop/start between them
+        last_bracket_stats = BracketEngine(picam2, flash).capture(exposure_times, hand_off)
+    else:
+        picam2.set_controls({"ExposureTime":exposure_times[0] })
+        print("exp  ",exposure_times[0])
+        #picam2.set_controls({"NoiseReductionMode":controls.draft.NoiseReductionModeEnum.HighQuality})
+        if not warm:
+            time.sleep(exposureset_delay)#need some time for the settings to sink into the camera)
+        # the flash is only lit around the frame we keep
+        hand_off(0, flash.capture_with_flash(picam2, exposure_times[0]))
 
+    if not keep_running:
         picam2.stop()
-        print("picture take time: "+str(flashtime))
-        
-    # Saving loop (can be done later)
-    i=0
-    for img in PILs:  
-          exif_data=metadatas[i]
-          pil_image = img
-          # Save the image using PIL to get the image data on disk
-          folderPath= "/home/pi/Desktop/Mothbox/photos/" #can't use relative directories with cron
-          if not os.path.exists(folderPath):
-            os.makedirs(folderPath)
-          os.chmod(folderPath, 0o777)  # mode=0o777 for read write for all users
-
-          folderPath = create_dated_folder(folderPath)
-          
-          
-          print(ImageFileType)
-          if ImageFileType==1: #png
-              filepath = folderPath+computerName+"_"+timestamp+"_HDR"+str(i)+".png"
-          elif ImageFileType==0: #jpeg
-              filepath = folderPath+computerName+"_"+timestamp+"_HDR"+str(i)+".jpg"
-          elif ImageFileType==2: #bmp
-              filepath = folderPath+computerName+"_"+timestamp+"_HDR"+str(i)+".bmp"
+        for cam in extra_cameras:
+            cam.stop()
+
+    for p in pipelines:
+        p.wait()
+    last_pipeline_timings = pipeline.report(timings_before[0])
+    results = []
+    errors = []
+    for p, before in zip(pipelines, timings_before):
+        results += p.results(before)
+        errors += p.errors
+    if last_rig_stats:
+        log_rig(last_rig_stats, results, time.time() - capture_start)
+    record_sharpness(results)
+    if ExposureFeedback and AutoCalibration:
+        record_exposure(results)
+    log_change(results)
+    log_sheet_crop(results)
+    log_frame_metadata(folderPath, results, frame_metadata, errors)
+    last_storage_plan = {}
+    if plan:
+        change = next((r["analysis"]["change"] for r in results if r.get("analysis", {}).get("change")), {})
+        storage_planner.record(plan, sum(r["bytes"] for r in results), len(results), change.get("novel", True))
+        last_storage_plan = plan
+    if pipeline.spool is not None:
+        backlog = pipeline.spool.backlog()
+        print(f"Spool: {backlog['pending']} frames ({backlog['pending_gb']} GB) waiting to be encoded, "
+              f"oldest {backlog['oldest_s']}s  {backlog['free_slots']} slots free")
+    #reduced and thumbnail frames were saved under a new name, skipped ones not at all, spooled ones later
+    return [r["file"] for r in results if r["action"] != "skip"]
+
+
+def photo_filepath(folderPath, timestamp, i):
+    if ImageFileType==1: #png
+        filepath = folderPath+computerName+"_"+timestamp+"_HDR"+str(i)+".png"
+    elif ImageFileType==2: #bmp
+        filepath = folderPath+computerName+"_"+timestamp+"_HDR"+str(i)+".bmp"
+    else: #jpeg
+        filepath = folderPath+computerName+"_"+timestamp+"_HDR"+str(i)+".jpg"
+    return filepath
+
+
+def build_exif(exposure_time):
+    #https://github.com/hMatoba/Piexif/blob/3422fbe7a12c3ebcc90532d8e1f4e3be32ece80c/piexif/_exif.py#L406
+    #https://piexif.readthedocs.io/en/latest/functions.html#dump
+    zeroth_ifd = {piexif.ImageIFD.Make: u"MothboxV5",
+        }
+    exif_ifd = {#piexif.ExifIFD.DateTimeOriginal: u"2099:09:29 10:10:10",
+      #piexif.ExifIFD.LensMake: u"LensMake",
+      piexif.ExifIFD.ExposureTime: (1,int(1/(abs(exposure_time)/1000000))),
+      piexif.ExifIFD.FocalLength: (int(calib_lens_position * 100), 10),
+      piexif.ExifIFD.ISOSpeed: int(calib_gain * 100),
+      piexif.ExifIFD.ISOSpeedRatings: int(calib_gain * 100),
+
+      }
+    gps_ifd = {
+     #piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
+     #piexif.GPSIFD.GPSAltitudeRef: 1,
+     #piexif.GPSIFD.GPSDateStamp: u"1999:99:99 99:99:99",
+     }
+    first_ifd = {piexif.ImageIFD.Make: u"Arducam64mp",
+       #piexif.ImageIFD.XResolution: (40, 1),
+       #piexif.ImageIFD.YResolution: (40, 1),
+       piexif.ImageIFD.Software: u"piexif"
+       }
+    
+    exif_dict = {"0th":zeroth_ifd, "Exif":exif_ifd, "GPS":gps_ifd, "1st":first_ifd}
+    return piexif.dump(exif_dict)
 
-        
-          #print(exif_data) #This is a LOT of data
-          print(camera_settings.get("LensPosition"))
-          #https://github.com/hMatoba/Piexif/blob/3422fbe7a12c3ebcc90532d8e1f4e3be32ece80c/piexif/_exif.py#L406
-          #https://piexif.readthedocs.io/en/latest/functions.html#dump
-          zeroth_ifd = {piexif.ImageIFD.Make: u"MothboxV5",
-              }
-          exif_ifd = {#piexif.ExifIFD.DateTimeOriginal: u"2099:09:29 10:10:10",
-            #piexif.ExifIFD.LensMake: u"LensMake",
-            piexif.ExifIFD.ExposureTime: (1,int(1/(abs(exposure_times[i])/1000000))),
-            piexif.ExifIFD.FocalLength: (int(calib_lens_position * 100), 10),
-            piexif.ExifIFD.ISOSpeed: int(calib_gain * 100),
-            piexif.ExifIFD.ISOSpeedRatings: int(calib_gain * 100),
-
-            }
-          gps_ifd = {
-           #piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
-           #piexif.GPSIFD.GPSAltitudeRef: 1,
-           #piexif.GPSIFD.GPSDateStamp: u"1999:99:99 99:99:99",
-           }
-          first_ifd = {piexif.ImageIFD.Make: u"Arducam64mp",
-             #piexif.ImageIFD.XResolution: (40, 1),
-             #piexif.ImageIFD.YResolution: (40, 1),
-             piexif.ImageIFD.Software: u"piexif"
-             }
-          
-          exif_dict = {"0th":zeroth_ifd, "Exif":exif_ifd, "GPS":gps_ifd, "1st":first_ifd}
-          exif_bytes = piexif.dump(exif_dict)
-          img.save(filepath,exif=exif_bytes, quality=96)
-          print("Image saved to "+filepath)
-          i=i+1
+
+def plan_storage():
+    """
+    The JPEG quality and RedundantFrames policy for the next shot so the free space lasts until the
+    end of tonight's schedule (see storage_planner.py). None with StoragePlanning off.
+    """
+    global storage_planner, storage_schedule
+    if not StoragePlanning:
+        return None
+    if storage_planner is None:
+        storage_planner = StoragePlanner(STORAGE_PLAN_PATH)
+    try:
+        if storage_schedule is None:
+            # the schedule the Scheduler wrote to the controls at boot, in the Mothbox's timezone like its wake alarm
+            storage_schedule = WakeSchedule(
+                read_control(CONTROL_ROOT / "minutes.txt", "minutes", "0"),
+                read_control(CONTROL_ROOT / "hours.txt", "hours", ""),
+                read_control(CONTROL_ROOT / "weekdays.txt", "weekdays", "1;2;3;4;5;6;7"),
+                read_control(CONTROL_ROOT / "runtime.txt", "runtime", 0),
+                utc_offset=read_control(CONTROL_ROOT / "utc.txt", "utc", 0),
+                timezone=read_control(CONTROL_ROOT / "timezone.txt", "timezone"),
+            )
+        minutes_left = minutes_left_tonight(storage_schedule)
+    except (ValueError, IndexError) as e:
+        print(f"⚠️ Can't read the schedule to plan storage: {e}")
+        return None
+    _, free = get_storage_info(desktop_path)
+    plan = storage_planner.plan(free, extra_photo_storage_minimum * 1024**3, minutes_left, RedundantFrames)
+    print(f"Storage plan: {plan['shots_left']} shots left tonight x {plan['shot_bytes'] / 1024**2:.1f} MB "
+          f"= {plan['forecast_bytes'] / 1024**3:.2f} GB of {plan['budget_bytes'] / 1024**3:.2f} GB  "
+          f"level {plan['level']} (quality {plan['quality']}, RedundantFrames {plan['redundant']})")
+    return plan
+
+
+def log_frame_metadata(folderPath, results, frame_metadata, errors):
+    """Adds what the workers found out to what the camera said about each frame, and appends the shot to the night's file"""
+    for r in results:
+        row = frame_metadata.get(r["submitted"])
+        if row is None:
+            continue
+        analysis = r.get("analysis", {})
+        row.update({"file": os.path.basename(r["file"]), "action": r["action"], "bytes": r["bytes"],
+                    "sharpness": analysis.get("sharpness"),
+                    "change_score": (analysis.get("change") or {}).get("score"),
+                    "capture_s": r["capture_s"], "encode_s": r["encode_s"]})
+        stats = analysis.get("exposure") or {}
+        row.update({"mean_luma": stats.get("mean"), "clipped": stats.get("clipped"), "p01": stats.get("p01"),
+                    "p50": stats.get("p50"), "p90": stats.get("p90"), "p99": stats.get("p99")})
+    for filepath, _ in errors:
+        if filepath in frame_metadata:
+            frame_metadata[filepath].update({"file": os.path.basename(filepath), "action": "error"})
+    rows = []
+    for row in frame_metadata.values():
+        row.update({"ambient_lux": ambient_lux, "board_temp": board_temp, "cpu_temp": cpu_temp})
+        rows.append(row)
+    MetadataLog(metadata_path(folderPath)).append(rows)
+
+
+def sheet_box(metadata, size):
+    """Where the sheet is in a frame of `size` with SheetCrop 1, None keeps the whole frame"""
+    if SheetCrop != 1 or sheet_rect is None:
+        return None
+    return to_frame(sheet_rect, metadata.get("ScalerCrop", (0, 0) + tuple(size)), size, VerticalFlip)
+
+
+def log_sheet_crop(results):
+    """What cropping to the sheet saved on every full size photo, see sheet_crop.py"""
+    if not SheetCrop or crop_savings is None:
+        return
+    for r in results:
+        if r.get("full_bytes"):
+            crop_savings.measure(r["bytes"], r["encode_s"], r["full_bytes"], r["full_encode_s"])
+    total_bytes = total_s = 0
+    for r in results:
+        if r["action"] != "full" or not r["bytes"] or (SheetCrop == 1 and "crop" not in r):
+            continue
+        saved_bytes, saved_s, measured = crop_savings.saved(r["bytes"], r["encode_s"])
+        total_bytes += saved_bytes
+        total_s += saved_s
+        append_log_csv("sheet_crop.csv", "time,file,mode,area,bytes,saved_bytes,encode_s,saved_encode_s,measured",
+                       [os.path.basename(r["file"]), SheetCrop, round(crop_savings.area, 3), r["bytes"],
+                        saved_bytes, r["encode_s"], saved_s, int(measured)])
+    if total_bytes:
+        print(f"Sheet crop saved {total_bytes / 1024**2:.1f} MB and {total_s:.2f}s of encoding on this shot")
+
+
+def capture_format():
+    """
+    YUV420 when the photos are JPEGs: half the memory of RGB888 and already what a JPEG is made of.
+    PNG and BMP are RGB, so they still get RGB888 frames.
+    """
+    if CaptureFormat and ImageFileType == 0:
+        return "YUV420"
+    return "RGB888"
+
+
+def get_change_detector():
+    global change_detector
+    if change_detector is None or change_detector.change_pixels != ChangePixels:
+        change_detector = ChangeDetector(CHANGE_BACKGROUND_PATH, ChangePixels)
+    return change_detector
+
+
+def log_change(results):
+    """Logs whether each shot showed anything new and what was done with it"""
+    for r in results:
+        change = r.get("analysis", {}).get("change")
+        if change is None:
+            continue
+        append_log_csv("change_detection.csv", "time,file,score,novel,keyframe,action,bytes",
+                       [os.path.basename(r["file"]), change.get("score"), int(change.get("novel", True)),
+                        int(change.get("keyframe", False)), r["action"], r["bytes"]])
+        print(f"Change score {change.get('score')}  novel: {change.get('novel')}  saved as: {r['action']}")
+
+
+def get_pipeline():
+    """
+    The encode pipeline outlives a single photo so the capture daemon can keep its workers around
+    """
+    global pipeline
+    previews = PREVIEW_WIDTHS if Previews else ()
+    wanted = (EncoderWorkers, EncodeQueueDepth, JpegEncoder, previews, get_spool() if SpoolFrames else None)
+    if pipeline is None or (pipeline.workers, pipeline.depth, pipeline.encoder_choice, pipeline.previews,
+                            pipeline.spool) != wanted:
+        if pipeline is not None:
+            pipeline.close()
+        pipeline = EncodePipeline(workers=EncoderWorkers, depth=EncodeQueueDepth, encoder=JpegEncoder,
+                                  previews=previews, spool=wanted[-1])
+    return pipeline
+
+
+def burst_length():
+    """BurstFrames, fewer if that many copies of a frame wouldn't fit in half the free memory"""
+    main = picam2.camera_configuration()["main"]
+    size = frame_bytes(main["size"], main["format"])
+    try:
+        with open("/proc/meminfo") as f:
+            available = next(int(l.split()[1]) * 1024 for l in f if l.startswith("MemAvailable"))
+    except (OSError, StopIteration, ValueError):
+        return BurstFrames
+    frames = max(1, min(BurstFrames, int(available * 0.5 // size)))
+    if frames < BurstFrames:
+        print(f"⚠️ Only enough memory for a burst of {frames} frames")
+    return frames
+
+
+def get_burst_pipeline(frames):
+    """An encode pipeline like the usual one, with room in its queue for a whole burst"""
+    global burst_pipeline
+    base = get_pipeline()
+    wanted = (base.workers, frames, base.encoder_choice, base.previews, base.spool)
+    if burst_pipeline is None or (burst_pipeline.workers, burst_pipeline.depth, burst_pipeline.encoder_choice,
+                                  burst_pipeline.previews, burst_pipeline.spool) != wanted:
+        if burst_pipeline is not None:
+            burst_pipeline.close()
+        burst_pipeline = EncodePipeline(workers=base.workers, depth=frames, encoder=JpegEncoder,
+                                        previews=base.previews, spool=base.spool)
+    return burst_pipeline
+
+
+def get_extra_pipelines():
+    """One encode pipeline per extra camera, made like camera 0's"""
+    global extra_pipelines
+    wanted = (pipeline.workers, pipeline.depth, pipeline.encoder_choice, pipeline.previews, pipeline.spool)
+    for p in extra_pipelines:
+        if (p.workers, p.depth, p.encoder_choice, p.previews, p.spool) != wanted:
+            p.close()
+            extra_pipelines = []
+            break
+    while len(extra_pipelines) > len(extra_cameras):
+        extra_pipelines.pop().close()
+    while len(extra_pipelines) < len(extra_cameras):
+        extra_pipelines.append(EncodePipeline(workers=pipeline.workers, depth=pipeline.depth, encoder=JpegEncoder,
+                                              previews=pipeline.previews, spool=pipeline.spool))
+    return extra_pipelines
+
+
+def cameras_wanted():
+    """CameraCount, 0 is every camera attached"""
+    if CameraCount == 1:
+        return 1
+    attached = camera_count()
+    return attached if CameraCount == 0 else max(1, min(CameraCount, attached))
+
+
+def setup_extra_cameras(count, capture_main, buffer_count):
+    """Opens (or closes) cameras 1.. so there are count cameras, configured like camera 0"""
+    global extra_cameras
+    while len(extra_cameras) > count - 1:
+        cam = extra_cameras.pop()
+        cam.stop()
+        cam.close()
+    for n in range(count):
+        if n == 0:
+            continue
+        if n > len(extra_cameras):
+            extra_cameras.append(Picamera2(n))
+        cam = extra_cameras[n - 1]
+        if cam.started:
+            cam.stop()
+        transform = Transform(vflip=True, hflip=True) if VerticalFlip else Transform()
+        cam.configure(cam.create_still_configuration(main=capture_main, transform=transform, raw=None,
+                                                     lores=None, buffer_count=buffer_count))
+    if extra_cameras:
+        print(f"Using {count} cameras at {capture_main['size'][0]}x{capture_main['size'][1]}")
+
+
+def log_rig(stats, results, seconds):
+    """How far apart the cameras took their frames, and how fast the whole shot was saved"""
+    skews = [s for s in stats["skew_ms"] if s is not None]
+    mb = sum(r["bytes"] for r in results) / 1024**2
+    stats.update({"frames": len(results), "seconds": round(seconds, 2),
+                  "fps": round(len(results) / seconds, 2), "mb_per_s": round(mb / seconds, 1),
+                  "max_skew_ms": max(skews) if skews else None})
+    print(f"{stats['cameras']} cameras: skew {stats['skew_ms']} ms  {stats['frames']} frames in "
+          f"{stats['seconds']}s ({stats['fps']} frames/s, {stats['mb_per_s']} MB/s)")
+    append_log_csv("multicamera.csv", "time,cameras,frames,max_skew_ms,seconds,fps,mb_per_s",
+                   [stats["cameras"], stats["frames"], stats["max_skew_ms"], stats["seconds"],
+                    stats["fps"], stats["mb_per_s"]])
+
+
+def get_spool():
+    """The raw spool, also opened with SpoolFrames off so frames left in it still get encoded"""
+    global spool
+    if spool is None:
+        spool = RawSpool(SPOOL_PATH, SpoolGB * 1024**3, frame_bytes((width, height), capture_format()))
+    return spool
+
+
+def on_external_power():
+    """True if SpoolExternalVolts is set and the Vin line is above it"""
+    return SpoolExternalVolts > 0 and bool(external_power(SpoolExternalVolts))
+
+
+def drain_spool(keep_going=lambda: True):
+    """Encodes spooled frames while keep_going() says so, returns how many"""
+    if not SpoolFrames and not SPOOL_PATH.exists():
+        return 0
+    compressor_pipeline = EncodePipeline(workers=1, depth=1, encoder=JpegEncoder,
+                                         previews=PREVIEW_WIDTHS if Previews else ())
+    try:
+        encoded = SpoolCompressor(get_spool(), compressor_pipeline).drain(keep_going)
+    finally:
+        compressor_pipeline.close()
+    backlog = get_spool().backlog()
+    for e in encoded:
+        append_log_csv("spool.csv", "time,file,spooled_s,encode_s,pending",
+                       [os.path.basename(e["file"]), e["spooled_s"], e["encode_s"], backlog["pending"]])
+    if encoded:
+        print(f"Encoded {len(encoded)} spooled frames, {backlog['pending']} still waiting")
+    return len(encoded)
 
 
 def determinePiModel():
@@ -668,52 +1371,209 @@ def get_storage_info(path):
     except OSError:
         return 0, 0  # Handle non-existent or inaccessible storages
 
-#---------------MAIN CODE--------------------- #
+def check_storage():
+    """
+    Returns True if there is enough space left on the desktop to keep taking photos
+    """
+    #First check and see if we have enough storage left to keep taking photos, or else do nothing
+    # Get total and available space on desktop and external storage
+    desktop_total, desktop_available = get_storage_info(desktop_path)
+    print("Desktop Total    Storage: \t" + str(desktop_total))
 
-print("----------------- STARTING TAKEPHOTO-------------------")
-now = datetime.now()
-formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")  # Adjust the format as needed
+    print("Desktop Available Storage: \t" + str(desktop_available))
+    x=extra_photo_storage_minimum
 
-print(f"Current time: {formatted_time}")
+    print("Minimum storage needed: \t" +str(x * 1024**3))
 
+    if desktop_available < x * 1024**3:  # x GB in bytes
+        print("not enough space to take more photos")
+        return False
+    return True
 
-#First check and see if we have enough storage left to keep taking photos, or else do nothing
-# Get total and available space on desktop and external storage
-desktop_total, desktop_available = get_storage_info(desktop_path)
-print("Desktop Total    Storage: \t" + str(desktop_total))
 
-print("Desktop Available Storage: \t" + str(desktop_available))
-x=extra_photo_storage_minimum
+def setup_resolution():
+    global rpiModel, width, height
+    #First figure out if this is a Pi4 or a Pi5
+    rpiModel=None
+    rpiModel=determinePiModel()
 
-print("Minimum storage needed: \t" +str(x * 1024**3))
+    #default resolution
+    width=9000
+    height=6000
 
-if desktop_available < x * 1024**3:  # x GB in bytes
-    print("not enough space to take more photos")
-    quit()
+    #the Pi4 can't really handle the FULL resolution, but pi5 can!
+    if(rpiModel==5):
+        width=9248
+        height=6944
 
 
+def load_session_settings():
+    """
+    Reads the camera CSV and the calibration control files into the globals the capture code uses
+    """
+    global camera_settings, LastCalibration, computerName
+    global calib_lens_position, human_lens_position, calib_exposure, human_exposure, calib_gain
+    global AutoCalibration, AutoCalibrationPeriod, CalibrationRestart, ExposurePrediction
+    global SharpnessTrigger, MaxCalibrationPeriod, LensCache, SheetCrop, sheet_rect, crop_savings, ExposureFeedback
+
+    #LastCalibration = float(control_values.get("LastCalibration", 0))
+    LastCalibration= float(read_control(CONTROL_ROOT / "lastcalibration.txt", "lastcalibration", 0))
+
+    #computerName = control_values.get("name", "wrong")
+    computerName = read_control(CONTROL_ROOT / "name.txt", "name", "errorname")
+
+    #camera_settings = load_camera_settings("camera_settings.csv")#CRONTAB CAN'T TAKE RELATIVE LINKS! 
+    camera_settings = load_camera_settings()
+
+    #before calibration, set these values to the default we read in
+    calib_lens_position = float(read_control(AF_LENS_PATH, "aflensposition", None))
+    human_lens_position = camera_settings.get("LensPosition", None)
+
+    calib_exposure = float(read_control(AF_EXPOSURE_PATH, "exposuretime", None))
+    human_exposure = camera_settings["ExposureTime"]
+
+    calib_gain = float(read_control(AF_GAIN_PATH, "autogain", None))
+
+    AutoCalibration = camera_settings.pop("AutoCalibration",1) #defaults to what is set above if not in the files being read
+    AutoCalibrationPeriod = int(camera_settings.pop("AutoCalibrationPeriod",1000))
+    CalibrationRestart = int(camera_settings.pop("CalibrationRestart",0))
+    ExposurePrediction = int(camera_settings.pop("ExposurePrediction",1))
+    SharpnessTrigger = int(camera_settings.pop("SharpnessTrigger",70))
+    MaxCalibrationPeriod = int(camera_settings.pop("MaxCalibrationPeriod",3600))
+    LensCache = int(camera_settings.pop("LensCache",1))
+    SheetCrop = int(camera_settings.pop("SheetCrop",0))
+    rect = parse_crop(read_control(SHEET_CROP_PATH, "sheetcrop", "none"))
+    if rect != sheet_rect:
+        sheet_rect = rect
+        crop_savings = None
+    ExposureFeedback = int(camera_settings.pop("ExposureFeedback",1))
+    load_focus_tracker()
+    load_exposure_tracker()
+
+
+def calibration_due():
+    """
+    With SharpnessTrigger on, calibrate when the photos got blurry (or MaxCalibrationPeriod passed),
+    otherwise every AutoCalibrationPeriod seconds like before
+    """
+    current_time = int(time.time())
+    timesincelastcalibration= current_time - LastCalibration
+    if not AutoCalibration:
+        return False
+    if ExposureFeedback and exposure_tracker.needs_calibration():
+        print("Exposure feedback has been at its limit for a while, recalibrating")
+        return True
+    if SharpnessTrigger:
+        print("Last calibration was   ",timesincelastcalibration,"  seconds ago \n Calibrating when sharpness drops below ", SharpnessTrigger, "% or after ", MaxCalibrationPeriod)
+        if focus_tracker.needs_focus():
+            print("Photos are getting blurry, refocusing")
+            return True
+        return timesincelastcalibration > MaxCalibrationPeriod
+    print("Last calibration was   ",timesincelastcalibration,"  seconds ago \n Autocalibration period is   ", AutoCalibrationPeriod)
+    return timesincelastcalibration > AutoCalibrationPeriod
+
+
+def configure_still():
+    """
+    Pops the non-picamera2 settings, builds the still configuration and pushes the
+    calibrated controls into the camera. Leaves the camera configured but stopped.
+    """
+    global camera_settings, calib_lens_position, calib_exposure
+    global ImageFileType, VerticalFlip, onlyflash, num_photos, exposuretime_width
+    global EncoderWorkers, EncodeQueueDepth, ZeroCopyFrames, JpegEncoder
+    global RedundantFrames, ChangePixels, Previews, StoragePlanning
+    global SpoolFrames, SpoolGB, SpoolIdleSeconds, SpoolExternalVolts, CameraCount, BurstFrames, BurstFps
+    global CaptureFormat
+    global capture_config, capture_config_flipped, crop_savings
+
+    if AutoCalibration:
+        None
+    else:
+        calib_lens_position = human_lens_position
+        calib_exposure = human_exposure
+
+    #remove settings that aren't actually in picamera2
+    oldsettingsnames = camera_settings.pop("Name",computerName) #defaults to what is set above if not in the files being read
+    ImageFileType = int(camera_settings.pop("ImageFileType",0))
+    VerticalFlip = int(camera_settings.pop("VerticalFlip",0))
+    onlyflash =int(camera_settings.pop("onlyflash",0))
+
+    #Encode pipeline - how many frames get encoded at once, and how many captured frames may wait for them
+    EncoderWorkers = int(camera_settings.pop("EncoderWorkers",EncoderWorkers))
+    EncodeQueueDepth = int(camera_settings.pop("EncodeQueueDepth",EncodeQueueDepth))
+    ZeroCopyFrames = int(camera_settings.pop("ZeroCopyFrames",ZeroCopyFrames))
+    JpegEncoder = int(camera_settings.pop("JpegEncoder",JpegEncoder))
+
+    #what to do with photos that show nothing new on the sheet, see change_detect.py
+    RedundantFrames = int(camera_settings.pop("RedundantFrames",RedundantFrames))
+    ChangePixels = int(camera_settings.pop("ChangePixels",ChangePixels))
+    Previews = int(camera_settings.pop("Previews",Previews))
+    StoragePlanning = int(camera_settings.pop("StoragePlanning",StoragePlanning))
+
+    #encode later instead of while the lights are on, see raw_spool.py
+    SpoolFrames = int(camera_settings.pop("SpoolFrames",SpoolFrames))
+    SpoolGB = int(camera_settings.pop("SpoolGB",SpoolGB))
+    SpoolIdleSeconds = int(camera_settings.pop("SpoolIdleSeconds",SpoolIdleSeconds))
+    SpoolExternalVolts = float(camera_settings.pop("SpoolExternalVolts",SpoolExternalVolts))
+    CameraCount = int(camera_settings.pop("CameraCount",CameraCount))
+    BurstFrames = int(camera_settings.pop("BurstFrames",BurstFrames))
+    BurstFps = int(camera_settings.pop("BurstFps",BurstFps))
+    CaptureFormat = int(camera_settings.pop("CaptureFormat",CaptureFormat))
+    if rpiModel == 4:
+        ZeroCopyFrames = 0 # the pi4's CMA memory can't hold several 54MP camera buffers
+
+    # every frame waiting for / inside an encoder holds on to a camera buffer, plus one to keep capturing
+    buffer_count = EncoderWorkers + EncodeQueueDepth + 1 if ZeroCopyFrames else 1
+    if BurstFrames > 1 and rpiModel != 4:
+        buffer_count = max(buffer_count, BURST_BUFFERS)
+
+    #HDR settings
+    num_photos = int(camera_settings.pop("HDR",num_photos)) #defaults to what is set above if not in the files being read
+
+    exposuretime_width = int(camera_settings.pop("HDR_width",exposuretime_width))
+    if(num_photos<1 or num_photos==2):
+        num_photos=1
+
+    cameras = cameras_wanted()
+    size = MULTI_CAMERA_SIZE if cameras > 1 else (width, height)
+    if SheetCrop == 2 and sheet_rect and cameras == 1:
+        #the camera only puts out the sheet, at the same pixels per mm as the whole photo
+        camera_settings["ScalerCrop"], size = scaler_crop(sheet_rect, picam2.camera_properties["ScalerCropMaximum"],
+                                                          size)
+        crop_savings = CropSavings(size[0] * size[1] / (width * height))
+        print(f"Camera cropped to the sheet: {size[0]}x{size[1]}")
+    capture_main = {"size": size, "format": capture_format(), }
+    capture_config = picam2.create_still_configuration(main=capture_main,raw=None, lores=None, buffer_count=buffer_count)
+    capture_config_flipped =  picam2.create_still_configuration(main=capture_main, transform=Transform(vflip=True, hflip=True), raw=None, lores=None, buffer_count=buffer_count)
+    picam2.configure(capture_config)
 
 
-#First figure out if this is a Pi4 or a Pi5
-rpiModel=None
-rpiModel=determinePiModel()
+    if camera_settings:
+        print(camera_settings)
+        print(calib_lens_position, calib_exposure, calib_gain)
+        camera_settings["LensPosition"] = float(calib_lens_position)
+        camera_settings["ExposureTime"] = int(calib_exposure)
+        camera_settings["AnalogueGain"] = float(calib_gain)
+        if ExposureFeedback and AutoCalibration:
+            #what the last shots said the calibration needs to stay as bright as it started
+            camera_settings["ExposureTime"], camera_settings["AnalogueGain"] = corrected_exposure()
+        picam2.set_controls(camera_settings)
+
+    #run until the sensor is really producing frames with the calibrated values before we go to the photo
+    picam2.start()
+    settle_camera(capture_targets(), label="Warming up")
 
-#default resolution
-width=9000
-height=6000
+    print("cam started");
 
-#the Pi4 can't really handle the FULL resolution, but pi5 can!
-if(rpiModel==5):
-    width=9248
-    height=6944
+    picam2.stop()
 
+    if(VerticalFlip):
+        picam2.configure(capture_config_flipped)
+    else:
+        picam2.configure(capture_config)
+    setup_extra_cameras(cameras, capture_main, buffer_count)
 
-#I don't really know why we need this below code, but it's here. it may have been an earlier attempt to find the pi model
-if platform.system() == "Windows":
-	print(platform.uname().node)
-else:
-	#computerName = os.uname()[1]
-	print(os.uname()[1])   # doesnt work on windows
+    time.sleep(.5)
 
 
 #HDR Controls
@@ -721,140 +1581,157 @@ num_photos = 1
 exposuretime_width = 18000
 middleexposure=500 # 500 #minimum exposure time for Hawkeye camera 64mp arducam
 
+#Encode pipeline
+EncoderWorkers = 2
+EncodeQueueDepth = 1
+ZeroCopyFrames = 1
+JpegEncoder = 1 # 0 PIL  1 libjpeg-turbo  2 YUV planes, see encoders.py
+
+#Change detection
+RedundantFrames = 0 # 0 save  1 half resolution  2 thumbnail  3 skip, see change_detect.py
+ChangePixels = 20
+CHANGE_BACKGROUND_PATH = desktop_path / "logs" / "change_background.npy"
+change_detector = None
+
+Previews = 1 # small jpegs of every photo in previews/1024 and previews/256 of the dated folder
+
+#Storage planning, see storage_planner.py
+StoragePlanning = 1
+STORAGE_PLAN_PATH = desktop_path / "logs" / "storage_plan.csv"
+storage_planner = None
+storage_schedule = None
+last_storage_plan = {}
+
+#Raw spool, see raw_spool.py
+SpoolFrames = 0
+SpoolGB = 4
+SpoolIdleSeconds = 20
+SpoolExternalVolts = 0.0
+SPOOL_PATH = desktop_path / "spool.raw"
+spool = None
+
+#More cameras, see multi_camera.py
+CameraCount = 1 # 0 every camera attached
+extra_cameras = []
+extra_pipelines = []
+last_rig_stats = {}
+
+#Burst, see burst.py
+BurstFrames = 0 # 0 or 1 no burst
+BurstFps = 0 # 0 as fast as the sensor goes
+burst_pipeline = None
+last_burst_stats = {}
+
+#Only keeping the sheet, see sheet_crop.py
+SheetCrop = 0 # 0 whole photo  1 cropped by the encoders  2 cropped by the camera
+
+ImageFileType = 0 # 0 jpg  1 png  2 bmp
+CaptureFormat = 1 # 0 RGB888  1 YUV420 for jpegs, see capture_format()
+
+ExposureFeedback = 1 # nudge the exposure between calibrations, see exposure_feedback.py
+sheet_rect = None
+crop_savings = None
+pipeline = None
+
+picam2 = None
+exposure_model = ExposureModel(EXPOSURE_HISTORY_PATH)
+focus_tracker = None
+exposure_tracker = None
+lens_table = LensTable(LENS_TABLE_PATH)
+board_temp = None
+cpu_temp = None
+ambient_lux = None
+last_settle = {}
+last_capture_time = None
+last_pipeline_timings = {}
+last_bracket_stats = {}
 
-#global onlyflash
-#onlyflash=False
-
-
-
-#control_values_fpath = "/boot/firmware/mothbox_custom/system/controls.txt"
-#control_values = get_control_values(control_values_fpath)
-
-#onlyflash = control_values.get("OnlyFlash", "True").lower() == "true"
-#onlyflash = read_control(CONTROL_ROOT / "onlyflash.txt", "onlyflash", "0")
-
-#LastCalibration = float(control_values.get("LastCalibration", 0))
-LastCalibration= float(read_control(CONTROL_ROOT / "lastcalibration.txt", "lastcalibration", 0))
-
-
-#computerName = control_values.get("name", "wrong")
-computerName = read_control(CONTROL_ROOT / "name.txt", "name", "errorname")
-
-'''
-if(onlyflash):
-    print("operating in always on flash mode")
-'''
-
-
-#------- Setting up camera settings -------------
-
-'''
-#This is for getting min and max details for certain settings, (See the picam pdf manual)
-print(picam2.camera_controls["AnalogueGain"])
-min_gain, max_gain, default_gain = picam2.camera_controls["AnalogueGain"]
-'''
-#This will be the path to the CSV holding the settings whether it is the one on the disk or the external CSV
-global chosen_settings_path
-default_path = "/boot/firmware/mothbox_custom/camera_settings.csv"
-chosen_settings_path=default_path
-
-#camera_settings = load_camera_settings("camera_settings.csv")#CRONTAB CAN'T TAKE RELATIVE LINKS! 
-camera_settings = load_camera_settings()
-
-    
-#before calibration, set these values to the default we read in
-
-calib_lens_position=6
-
-calib_lens_position = float(read_control(AF_LENS_PATH, "aflensposition", None))
-human_lens_position = camera_settings.get("LensPosition", None)
-
-calib_exposure = float(read_control(AF_EXPOSURE_PATH, "exposuretime", None))
-human_exposure = camera_settings["ExposureTime"]
-
-calib_gain = float(read_control(AF_GAIN_PATH, "autogain", None))
-
-AutoCalibration = camera_settings.pop("AutoCalibration",1) #defaults to what is set above if not in the files being read
-AutoCalibrationPeriod = int(camera_settings.pop("AutoCalibrationPeriod",1000))
-
-
-#Start up cameras
-picam2 = Picamera2()
-
-
-#----Autocalibration ---------
-
-current_time = int(time.time())
-timesincelastcalibration= current_time - LastCalibration
-print("Last calibration was   ",timesincelastcalibration,"  seconds ago \n Autocalibration period is   ", AutoCalibrationPeriod)
-recalibrated= False
-if AutoCalibration and (timesincelastcalibration > AutoCalibrationPeriod):
-    print("Do Autocalibrate")
-    recalibrated=True
-    print(current_time)
-    #picam2.configure(preview_config)
-    #picam2.configure(capture_config_fastAuto)
-    run_calibration()
-else:
-    print("Don't Autocalibration")
-
-# ------ Prepare to take actual photo -----------
-#reload camera settings after possible calibration
-camera_settings = load_camera_settings()
-AutoCalibration = camera_settings.pop("AutoCalibration",1) #defaults to what is set above if not in the files being read
-AutoCalibrationPeriod = int(camera_settings.pop("AutoCalibrationPeriod",1000))
-
-if AutoCalibration:
-    None
-else:
-    calib_lens_position = human_lens_position
-    calib_exposure = human_exposure
-
-
-#remove settings that aren't actually in picamera2
-oldsettingsnames = camera_settings.pop("Name",computerName) #defaults to what is set above if not in the files being read
-ImageFileType = int(camera_settings.pop("ImageFileType",0))
-VerticalFlip = int(camera_settings.pop("VerticalFlip",0))
-onlyflash =int(camera_settings.pop("onlyflash",0))
-
-#HDR settings
-num_photos = int(camera_settings.pop("HDR",num_photos)) #defaults to what is set above if not in the files being read
+#---------------MAIN CODE--------------------- #
 
-exposuretime_width = int(camera_settings.pop("HDR_width",exposuretime_width))
-if(num_photos<1 or num_photos==2):
-    num_photos=1
+def main():
+    global picam2
 
-capture_main = {"size": (width, height), "format": "RGB888", }
-capture_config = picam2.create_still_configuration(main=capture_main,raw=None, lores=None)
-capture_config_flipped =  picam2.create_still_configuration(main=capture_main, transform=Transform(vflip=True, hflip=True), raw=None, lores=None)
-picam2.configure(capture_config)
+    print("----------------- STARTING TAKEPHOTO-------------------")
+    now = datetime.now()
+    formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")  # Adjust the format as needed
 
+    print(f"Current time: {formatted_time}")
 
-if camera_settings:
-    print(camera_settings)
-    print(calib_lens_position, calib_exposure, calib_gain)
-    camera_settings["LensPosition"] = float(calib_lens_position)
-    camera_settings["ExposureTime"] = int(calib_exposure)
-    camera_settings["AnalogueGain"] = float(calib_gain)
-    picam2.set_controls(camera_settings)
+    # only every capture_every-th trigger takes a photo tonight (energy_planner.py), counted with the CaptureDaemon's
+    if energy_skip(ENERGY_PATH):
+        print("Skipping this photo, the energy budget can't afford every trigger tonight")
+        quit()
 
-picam2.start()
-time.sleep(1)
+    if not check_storage():
+        quit()
 
-print("cam started");
+    setup_resolution()
+    setup_flash()
 
-picam2.stop()
+    #I don't really know why we need this below code, but it's here. it may have been an earlier attempt to find the pi model
+    if platform.system() == "Windows":
+    	print(platform.uname().node)
+    else:
+    	#computerName = os.uname()[1]
+    	print(os.uname()[1])   # doesnt work on windows
+
+    #------- Setting up camera settings -------------
+
+    '''
+    #This is for getting min and max details for certain settings, (See the picam pdf manual)
+    print(picam2.camera_controls["AnalogueGain"])
+    min_gain, max_gain, default_gain = picam2.camera_controls["AnalogueGain"]
+    '''
+    load_session_settings()
+
+    #Start up cameras
+    picam2 = Picamera2()
+
+    #----Autocalibration ---------
+    calibration_end = None
+    calibration_mode = "inplace"
+    if "MOTHBOX_CALIBRATION_END" in os.environ:
+        #we are the restarted half of a CalibrationRestart
+        calibration_end = float(os.environ.pop("MOTHBOX_CALIBRATION_END"))
+        os.environ.pop("MOTHBOX_SESSION_START", None)
+        calibration_mode = "restart"
+    prediction = predict_calibration() if AutoCalibration else None
+    if calibration_due():
+        print("Do Autocalibrate")
+        print(int(time.time()))
+        lens = predict_lens()
+        if prediction:
+            calibration_mode = "predicted"
+        if lens is not None:
+            calibration_mode += "+lenstable"
+        run_calibration(restart=bool(CalibrationRestart), predicted=prediction, lens=lens)
+        calibration_end = time.time()
+    else:
+        print("Don't Autocalibration")
 
-if(VerticalFlip):
-    picam2.configure(capture_config_flipped)
-else:
-    picam2.configure(capture_config)
+    # ------ Prepare to take actual photo -----------
+    #reload camera settings after possible calibration
+    load_session_settings()
+    apply_prediction(prediction)
+    configure_still()
 
-time.sleep(.5)
-takePhoto_Manual()
+    takePhoto_Manual()
+    if calibration_end:
+        log_calibration_timing(calibration_mode, calibration_end - session_start, time.time() - calibration_end)
 
+    picam2.stop()
+    pipeline.close()
+    for p in extra_pipelines + [burst_pipeline]:
+        if p is not None:
+            p.close()
+    for cam in extra_cameras:
+        cam.close()
+    #one shot cron runs leave the spool to the capture daemon, unless there is power to spare
+    if on_external_power():
+        drain_spool()
 
-picam2.stop()
+    quit()
 
-quit()
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+"""
+TriggerPhoto - asks the running CaptureDaemon to take a photo
+
+This is what cron (or the Scheduler) should call instead of TakePhoto.py.
+If the daemon isn't running it falls back to running TakePhoto.py the old way, so a photo is never missed.
+
+Usage
+ python TriggerPhoto.py            take a photo
+ python TriggerPhoto.py --status   print whether the daemon is alive
+ python TriggerPhoto.py --stop     ask the daemon to release the camera and exit
+"""
+
+import os
+import sys
+
+#######---- Check for Boot lock ------
+BOOT_LOCK = "/run/boot_script_running"
+
+if os.path.exists(BOOT_LOCK) and "--stop" not in sys.argv:
+    sys.exit(0)
+
+#-----------------------------##
+import socket
+import subprocess
+import time
+
+from capture_client import send, TIMEOUT
+
+TAKEPHOTO_PATH = "/home/pi/Desktop/Mothbox/TakePhoto.py"
+
+
+cmd = "capture"
+if "--status" in sys.argv:
+    cmd = "status"
+elif "--stop" in sys.argv:
+    cmd = "stop"
+
+start = time.time()
+try:
+    reply = send({"cmd": cmd})
+except socket.timeout:
+    # the daemon is alive but busy, don't fight it for the camera
+    print("Capture daemon did not answer within " + str(TIMEOUT) + " seconds")
+    sys.exit(1)
+except (OSError, ValueError) as e:
+    print(f"Capture daemon not available ({e})")
+    if cmd == "capture":
+        print("Falling back to TakePhoto.py")
+        sys.exit(subprocess.run(["python", TAKEPHOTO_PATH], check=False).returncode)
+    sys.exit(0)
+
+print(reply)
+if not reply.get("ok"):
+    sys.exit(1)
+if cmd == "capture":
+    print("Round trip: " + str(round(time.time() - start, 3)) + " seconds")
@@ -0,0 +1,82 @@
+# burst.py
+# Burst capture on a camera that keeps running, for insects that are landing or taking off.
+#
+# BurstFrames frames are taken back to back at the sensor's fastest still rate (or BurstFps), all under
+# one flash window. The frames are copied out of the camera buffers straight away, so the camera always
+# has a free buffer for the next frame, and queued to an EncodePipeline deep enough to hold the whole
+# burst, so capturing never waits for an encoder or the disk.
+#
+# Frames the camera drops anyway show up as gaps between SensorTimestamps a frame time apart.
+
+import time
+
+BUFFERS = 4  # camera buffers while bursting, so the sensor never waits for us to hand one back
+
+
+class BurstEngine:
+    # frames we are willing to wait for the frame rate and exposure to settle before lighting the flash
+    SETTLE_FRAMES = 12
+
+    def __init__(self, picam2, flash):
+        self.picam2 = picam2
+        self.flash = flash
+        self.min_frame, self.max_frame, _ = picam2.camera_controls["FrameDurationLimits"]
+
+    def frame_duration(self, exposure_us, fps):
+        """Frame time in us for the rate we ask for, never shorter than the exposure or what the sensor can do"""
+        frame_us = 1e6 / fps if fps else self.min_frame
+        return int(min(max(frame_us, self.min_frame, exposure_us), self.max_frame))
+
+    def capture(self, frames, exposure_us, fps, on_frame):
+        """
+        Captures `frames` frames in a row under one flash window.
+        on_frame(index, request) is called for every frame as it arrives and takes ownership of the
+        request (it must release it, quickly, the next frame is on its way).
+        Returns stats about the burst.
+        """
+        frame_us = self.frame_duration(exposure_us, fps)
+        self.flash.prepare()
+        self.picam2.set_controls({"FrameDurationLimits": (frame_us, frame_us), "ExposureTime": int(exposure_us)})
+        for _ in range(self.SETTLE_FRAMES):
+            md = self.picam2.capture_metadata()
+            if abs(md.get("FrameDuration", 0) - frame_us) <= 0.05 * frame_us:
+                break
+
+        start = time.time()
+        self.flash.on()
+        on_ns = self.flash.lit_since
+        timestamps = []
+        frames_seen = 0
+        try:
+            while len(timestamps) < frames and frames_seen < 3 * frames + 10:
+                request = self.picam2.capture_request()
+                frames_seen += 1
+                md = request.get_metadata()
+                ts = md.get("SensorTimestamp", 0)
+                if ts - md.get("ExposureTime", 0) * 1000 < on_ns:
+                    request.release()  # it started before the flash was on
+                    continue
+                timestamps.append(ts)
+                on_frame(len(timestamps) - 1, request)
+        finally:
+            lit = self.flash.off()
+            self.picam2.set_controls({"FrameDurationLimits": (self.min_frame, self.max_frame)})
+
+        self.flash.record(lit, exposure_us, frame_us * 1000)
+        frame_ns = frame_us * 1000
+        gaps = [b - a for a, b in zip(timestamps, timestamps[1:])]
+        dropped = sum(max(0, round(g / frame_ns) - 1) for g in gaps)
+        span_s = (timestamps[-1] - timestamps[0]) / 1e9 if len(timestamps) > 1 else 0.0
+        stats = {
+            "frames": len(timestamps),
+            "target_fps": round(1e6 / frame_us, 2),
+            "fps": round((len(timestamps) - 1) / span_s, 2) if span_s else None,
+            "dropped": dropped,
+            "lit_ms": round(lit * 1000, 1),
+            "wall_s": round(time.time() - start, 3),
+        }
+        if stats["frames"] < frames:
+            print(f"⚠️ Burst only got {stats['frames']} of {frames} frames")
+        print(f"Burst of {stats['frames']} at {stats['fps']} fps (asked {stats['target_fps']}), "
+              f"{dropped} frames dropped, flash lit {stats['lit_ms']} ms")
+        return stats
@@ -0,0 +1,103 @@
+# change_detect.py
+# Tells new photos of the sheet apart from ones that show the same thing as the last few.
+#
+# Most photos of a night look exactly like the one before (an empty sheet, or the same moths sitting
+# still), but each one used to be saved at 64MP. The encode workers now shrink every shot to a small
+# grey image and compare it with a rolling background (an average of the last few shots).
+# The score is how many of its pixels changed by more than a few grey levels, a moth landing or
+# flying off changes a patch of them, noise only a few scattered ones.
+#
+# What happens to a redundant shot is RedundantFrames in camera_settings.csv:
+#  0 saved like any other (only logged)   1 saved at half resolution   2 only a thumbnail   3 not saved
+# Every KEYFRAME_EVERY-th redundant shot in a row is still saved in full, just in case.
+
+import os
+import threading
+
+import numpy as np
+
+SMALL_WIDTH = 320  # width of the grey image that gets compared (a moth is still a few pixels)
+PIXEL_DIFF = 12  # grey levels a pixel has to change by to count
+BACKGROUND_RATE = 0.3  # how much of each new shot goes into the background
+KEYFRAME_EVERY = 10
+
+POLICIES = {0: "full", 1: "reduced", 2: "thumbnail", 3: "skip"}
+REDUCED_SCALE = 2
+THUMBNAIL_WIDTH = 1024
+
+
+def small_grey(array, fmt):
+    """Downsampled luminance of a frame, as float32"""
+    import cv2
+    if fmt == "YUV420":
+        grey = array[: array.shape[0] * 2 // 3]  # the Y plane
+    else:
+        grey = array[:, :, 1]  # green is most of the luminance and is in the middle of BGR and RGB
+    h, w = grey.shape[:2]
+    size = (SMALL_WIDTH, max(1, round(h * SMALL_WIDTH / w)))
+    return cv2.resize(grey, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class ChangeDetector:
+    def __init__(self, background_path, change_pixels=20):
+        self.background_path = background_path
+        self.change_pixels = change_pixels
+        self.lock = threading.Lock()
+        self.redundant_run = 0
+        self.background = None
+        try:
+            self.background = np.load(background_path).astype(np.float32)
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        tmp = str(self.background_path) + ".tmp.npy"
+        try:
+            np.save(tmp, self.background.astype(np.uint8))
+            os.replace(tmp, self.background_path)
+        except OSError as e:
+            print(f"⚠️ Could not save the change background: {e}")
+
+    def analyze(self, array, fmt):
+        """Scores a frame against the background and folds it in. Used as an EncodePipeline analyzer"""
+        small = small_grey(array, fmt)
+        with self.lock:
+            if self.background is None or self.background.shape != small.shape:
+                self.background = small
+                self.save()
+                self.redundant_run = 0
+                return {"score": None, "novel": True}
+            # a new calibration changes the brightness of everything, that isn't a moth
+            level = np.median(self.background) / max(float(np.median(small)), 1.0)
+            changed = np.abs(small * level - self.background) > PIXEL_DIFF
+            score = int(np.count_nonzero(changed))
+            novel = score >= self.change_pixels
+            self.background += BACKGROUND_RATE * (small * level - self.background)
+            self.save()
+            self.redundant_run = 0 if novel else self.redundant_run + 1
+            keyframe = not novel and self.redundant_run % KEYFRAME_EVERY == 0
+            return {"score": score, "novel": novel, "keyframe": keyframe}
+
+
+class SaveDecision:
+    """
+    How one shot gets saved. The frame that carries the change analysis resolves it, the other frames
+    of an HDR bracket wait for it so the whole bracket is kept or shrunk together.
+    """
+    def __init__(self, policy):
+        self.policy = POLICIES.get(policy, "full")
+        self.event = threading.Event()
+        self.action = "full"
+
+    def resolve(self, analysis):
+        change = analysis.get("change") or {}
+        if change.get("novel", True) or change.get("keyframe"):
+            self.action = "full"
+        else:
+            self.action = self.policy
+        self.event.set()
+
+    def get(self, timeout=30):
+        if not self.event.wait(timeout):
+            return "full"  # the analysis never came, better too big than lost
+        return self.action
@@ -0,0 +1,253 @@
+# energy_planner.py
+# Makes the battery last until the deployment's planned end date.
+#
+# Every wake the Scheduler records the battery in logs/energy.csv: the voltage and current the
+# INA219 read (scripts/read_Vin.py, run by the startup diagnostics), the charge that voltage means
+# (linear between bat_20perVolts and bat_80perVolts, like the percentage on the display) and the Wh
+# left above 20% of bat_Wh. That history gives what a night costs: the Wh lost between wakes over
+# the last days, per day, less what the charge went up by in that time (the solar panel). Only a
+# jump of more than SWAP_SHARE of the usable Wh between two wakes is left out, that is a battery
+# being swapped or charged, not the sun. Without enough history yet it guesses from the power
+# measured at the wake times the scheduled minutes per day, with no solar.
+# A battery the sun fills up every day hides how much more the sun had to give (the charge stops
+# going up at full), so after the sun filled it in the last REFILL_DAYS the session only has to
+# last until the next day, not until the deployment's end.
+#
+# nights_left = Wh left / Wh per night. If mothbox_settings.csv has a deployment_end date further away
+# than that, tonight's session gets the first of LEVELS (least cut first) whose forecast reaches it:
+#  attract_duty   - the attractor lights only stay on for this part of the session
+#  capture_every  - only every n-th photo trigger takes a photo
+#  runtime        - the session is this much shorter
+# What a level saves comes from the shares of a session's energy below, which are guesses like the
+# storage planner's quality factors: the lights use most of it, the photos (flash and saving) less,
+# and the Pi being awake the rest. The history is recorded with the factor that was in effect, so
+# what a night costs is always worked out for the full schedule (the solar is the same at any level).
+#
+# The decision goes to controls/energy.txt for CaptureDaemon, TakePhoto and Attract_On.py, and the
+# forecast and the decision of every wake to logs/energy.csv. energy_skip() is how a photo trigger
+# keeps to capture_every, counting the triggers in /run so the CaptureDaemon's and the ones TakePhoto
+# takes from cron by itself count together, from 0 again every boot like a session.
+
+import csv
+import datetime
+import os
+import time
+
+LEVELS = [
+    {"attract_duty": 1.0, "capture_every": 1, "runtime": 1.0},
+    {"attract_duty": 0.75, "capture_every": 1, "runtime": 1.0},
+    {"attract_duty": 0.5, "capture_every": 1, "runtime": 1.0},
+    {"attract_duty": 0.5, "capture_every": 2, "runtime": 1.0},
+    {"attract_duty": 0.5, "capture_every": 2, "runtime": 0.75},
+    {"attract_duty": 0.25, "capture_every": 3, "runtime": 0.5},
+]
+ATTRACT_SHARE = 0.5  # of a full session's energy
+PHOTO_SHARE = 0.2
+AWAKE_SHARE = 1.0 - ATTRACT_SHARE - PHOTO_SHARE  # the Pi, which is about all the wake reading sees
+FLOOR_PERCENT = 20  # never plan on the charge below this
+MARGIN = 1.1  # the forecast has to reach the end date with this much to spare
+HISTORY_DAYS = 7
+MIN_HISTORY_DAYS = 0.5
+SWAP_SHARE = 0.6  # of the usable Wh, more than this up between two wakes is a swapped battery
+FULL_SHARE = 0.95  # of the usable Wh, a battery this charged is full
+REFILL_DAYS = 1
+TRIGGER_COUNT_PATH = "/run/mothbox_triggers"  # tmpfs, gone at the next boot
+
+FIELDS = ["time", "mode", "voltage", "current", "power_w", "percent", "wh_left", "factor",
+          "wh_per_night", "from_history", "nights_left", "nights_needed", "level",
+          "attract_duty", "capture_every", "runtime"]
+
+
+def parse_vin(output):
+    """(voltage, current) from read_Vin.py's 'Vin Voltage: 12.124 V, Current: 0.942 A', None if not there"""
+    import re
+    match = re.search(r"Vin Voltage:\s*([\d.]+)\s*V,\s*Current:\s*(-?[\d.]+)\s*A", output or "")
+    if not match:
+        return None
+    return float(match.group(1)), float(match.group(2))
+
+
+def charge_percent(voltage, v20, v80):
+    """The display's battery percentage: linear through bat_20perVolts and bat_80perVolts"""
+    if v80 == v20:
+        return 0.0
+    return max(0.0, min(100.0, 20 + (voltage - v20) * (80 - 20) / (v80 - v20)))
+
+
+def level_factor(level):
+    """Energy of a session at this level compared to the full schedule"""
+    return level["runtime"] * (AWAKE_SHARE + ATTRACT_SHARE * level["attract_duty"]
+                               + PHOTO_SHARE / level["capture_every"])
+
+
+def parse_end(value):
+    """deployment_end from the settings as a date, None if there isn't one"""
+    text = str(value or "").strip()
+    if text.lower() in ("", "0", "none", "false"):
+        return None
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:
+        print(f"⚠️ deployment_end {text} isn't a date like 2026-12-31, not planning for it")
+        return None
+
+
+def read_capture_every(path):
+    """capture_every from energy.txt, 1 when there isn't one"""
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                if key == "capture_every":
+                    return max(1, int(float(value)))
+    except (OSError, ValueError):
+        pass
+    return 1
+
+
+def skips(trigger, every):
+    """Whether the trigger-th photo trigger of a session (from 1) is one capture_every skips"""
+    return (trigger - 1) % max(1, every) != 0
+
+
+def energy_skip(energy_path, count_path=TRIGGER_COUNT_PATH):
+    """True for the photo triggers the energy planner can't afford a photo for"""
+    every = read_capture_every(energy_path)
+    try:
+        with open(count_path) as f:
+            trigger = int(f.read().strip() or 0) + 1
+    except (OSError, ValueError):
+        trigger = 1
+    try:
+        with open(count_path, "w") as f:
+            f.write(str(trigger))
+        if trigger == 1:
+            os.chmod(count_path, 0o666)  # the daemon and the cron jobs run as different users
+    except OSError as e:
+        print(f"⚠️ Could not count the photo trigger: {e}")
+        return False  # without a count every trigger would look like the first, take them all
+    return skips(trigger, every)
+
+
+def session_limits(runtime, plan, now=None):
+    """
+    (session minutes, attractor minutes, attractor off epoch) for a session of runtime minutes at the
+    plan's level. The attractor minutes are None and its off time 0 when it stays on all session.
+    """
+    if runtime <= 0:
+        return runtime, None, 0  # runs until it's turned off, nothing to cut
+    now = time.time() if now is None else now
+    minutes = max(1, int(round(runtime * plan["runtime"])))
+    if plan["attract_duty"] >= 1:
+        return minutes, None, 0
+    attract_minutes = minutes * plan["attract_duty"]
+    return minutes, attract_minutes, int(now + attract_minutes * 60)
+
+
+class EnergyPlanner:
+    def __init__(self, history_path):
+        self.history_path = history_path
+        self.rows = []
+        try:
+            with open(history_path, newline="") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        self.rows.append({k: float(row[k]) for k in ("time", "wh_left", "factor")})
+                    except (KeyError, TypeError, ValueError):
+                        continue  # a wake without a reading, or half a line from a power cut
+        except FileNotFoundError:
+            pass
+
+    def daily_energy(self, now, usable_wh):
+        """
+        (Wh a full schedule uses, Wh the charge went up by) per day from the history, None without
+        enough of it. usable_wh is the battery's Wh above the floor, for telling a swap from the sun.
+        """
+        rows = [r for r in self.rows if r["time"] > now - HISTORY_DAYS * 86400]
+        used = 0.0
+        charged = 0.0
+        days = 0.0
+        for a, b in zip(rows, rows[1:]):
+            change = a["wh_left"] - b["wh_left"]
+            if -change > SWAP_SHARE * usable_wh:
+                continue
+            if change > 0:
+                used += change / max(a["factor"], 0.05)
+            else:
+                charged -= change
+            days += (b["time"] - a["time"]) / 86400
+        if days < MIN_HISTORY_DAYS:
+            return None
+        return used / days, charged / days
+
+    def refilled(self, now, usable_wh):
+        """Whether the charge went back up to a full battery (not a swapped one) in the last REFILL_DAYS"""
+        for a, b in zip(self.rows, self.rows[1:]):
+            rise = b["wh_left"] - a["wh_left"]
+            if (b["time"] > now - REFILL_DAYS * 86400 and 0 < rise <= SWAP_SHARE * usable_wh
+                    and b["wh_left"] >= FULL_SHARE * usable_wh):
+                return True
+        return False
+
+    def plan(self, reading, bat_wh, v20, v80, minutes_per_day, end_date, now=None):
+        """
+        Tonight's level, with the forecast that picked it. reading is (voltage, current) or None,
+        minutes_per_day the scheduled session minutes.
+        """
+        now = time.time() if now is None else now
+        chosen = dict(LEVELS[0], level=0, factor=1.0, voltage=None, current=None, power_w=None,
+                      percent=None, wh_left=None, wh_per_night=None, from_history=0,
+                      nights_left=None, nights_needed=None)
+        if end_date is not None:
+            today = datetime.date.fromtimestamp(now)
+            chosen["nights_needed"] = max(0, (end_date - today).days)
+        if reading is None:
+            return chosen
+
+        voltage, current = reading
+        percent = charge_percent(voltage, v20, v80)
+        wh_left = bat_wh * max(0.0, percent - FLOOR_PERCENT) / 100
+        power = voltage * abs(current)
+        usable_wh = bat_wh * (100 - FLOOR_PERCENT) / 100
+        daily = self.daily_energy(now, usable_wh)
+        chosen.update(voltage=round(voltage, 3), current=round(current, 3), power_w=round(power, 2),
+                      percent=round(percent, 1), wh_left=round(wh_left, 2), from_history=int(daily is not None))
+        if daily is None:
+            # the wake reading is about the Pi alone, a full session is that and the lights and photos
+            daily = (power / AWAKE_SHARE * minutes_per_day / 60, 0.0)
+        used, charged = daily
+        chosen["wh_per_night"] = round(max(0.0, used - charged), 2)
+        needed = chosen["nights_needed"]
+        if needed is not None and self.refilled(now, usable_wh):
+            # a full battery can't show how much more the sun had to give, so the history undercounts it.
+            # While the sun keeps filling it up, tonight only has to last until it does again
+            needed = min(needed, 1)
+
+        for level, settings in enumerate(LEVELS):
+            factor = level_factor(settings)
+            per_night = used * factor - charged
+            if per_night <= 0:
+                # the sun makes up for this level, it lasts as long as that holds
+                chosen.update(settings, level=level, factor=round(factor, 3), nights_left=None)
+                break
+            nights_left = wh_left / per_night
+            chosen.update(settings, level=level, factor=round(factor, 3), nights_left=round(nights_left, 1))
+            if needed is None or nights_left >= needed * MARGIN:
+                break
+        return chosen
+
+    def record(self, plan, mode, now=None):
+        """Appends this wake's reading, forecast and decision to the history"""
+        row = dict(plan, time=round(time.time() if now is None else now), mode=mode)
+        new = not os.path.exists(self.history_path)
+        try:
+            os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+            with open(self.history_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                writer.writerow(row)
+        except OSError as e:
+            print(f"⚠️ Could not save the energy history: {e}")
+        if plan["wh_left"] is not None:
+            self.rows.append({"time": row["time"], "wh_left": plan["wh_left"], "factor": plan["factor"]})
@@ -0,0 +1,154 @@
+# flash_control.py
+# In-process control of the flash and attractor relays for the Mothbox DIY relay board.
+# Flash_On.py / Attract_On.py are still there for cron and humans, but TakePhoto
+# uses this so it doesn't have to start a new python (and import RPi.GPIO) for every toggle.
+# NOTE the relay module is active LOW
+
+import time
+import RPi.GPIO as GPIO
+
+Relay_Ch1 = 26 # Attract
+Relay_Ch2 = 20 # Flash
+Relay_Ch3 = 21 # Attract
+
+
+ENERGY_PATH = "/boot/firmware/mothbox_custom/system/controls/energy.txt"
+
+
+def attract_time_over():
+    """The energy planner (energy_planner.py) can end the attractor's part of a session early"""
+    try:
+        with open(ENERGY_PATH) as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                if key == "attract_until":
+                    return 0 < float(value) < time.time()
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def sleep_until_ns(target_ns):
+    delay = (target_ns - time.monotonic_ns()) / 1e9
+    if delay > 0:
+        time.sleep(delay)
+
+
+class FlashController:
+    # how long the flash takes to actually light after the pin changes (mechanical relays are slow)
+    SWITCH_DELAY = 0.010
+    # extra time on both sides of the frame to cover python scheduling jitter
+    MARGIN = 0.002
+
+    def __init__(self):
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        for pin in (Relay_Ch1, Relay_Ch2, Relay_Ch3):
+            GPIO.setup(pin, GPIO.OUT)
+        self.attract_ready = False
+        self.lit_since = None
+        self.flash_log = []  # one dict per flashed frame
+
+    def attract_on(self):
+        GPIO.output(Relay_Ch3, GPIO.LOW)
+        GPIO.output(Relay_Ch2, GPIO.HIGH)
+        GPIO.output(Relay_Ch1, GPIO.LOW)
+        self.attract_ready = True
+
+    def attract_off(self):
+        # only Ch1, Ch3 also feeds the flash and it needs it for the rest of the session
+        GPIO.output(Relay_Ch1, GPIO.HIGH)
+        self.attract_ready = False
+
+    def prepare(self):
+        """
+        Puts the lights the way this session's energy duty wants them (attract_until in energy.txt):
+        attractors on until then, off after, with Ch3 the flash runs off on either way.
+        Relays are slow, so this runs before a shot's flash timing starts, not inside it.
+        """
+        GPIO.output(Relay_Ch3, GPIO.LOW)
+        if attract_time_over():
+            if self.attract_ready:
+                print("The energy budget has no more attractor time this session")
+                self.attract_off()
+        elif not self.attract_ready:
+            self.attract_on()
+
+    def on(self):
+        GPIO.output(Relay_Ch3, GPIO.LOW) # the flash's supply, whatever the attractors are doing
+        GPIO.output(Relay_Ch2, GPIO.LOW)
+        self.lit_since = time.monotonic_ns()
+
+    def off(self):
+        """Turns the flash off and returns how many seconds it was lit"""
+        GPIO.output(Relay_Ch2, GPIO.HIGH)
+        if self.lit_since is None:
+            return 0.0
+        lit = (time.monotonic_ns() - self.lit_since) / 1e9
+        self.lit_since = None
+        return lit
+
+    def capture_with_flash(self, picam2, exposure_us):
+        """
+        Captures one request from a running camera with the flash lit only around that frame.
+
+        The last frame's SensorTimestamp and FrameDuration predict when the next frame starts,
+        so the flash goes on just before it and off as soon as the (rolling shutter) frame is done,
+        instead of staying lit while we wait for a flush. Falls back to the old
+        on / capture_request(flush=True) / off sequence if the metadata can't be trusted.
+        The caller has to release the returned request.
+        """
+        self.prepare()
+        md = picam2.capture_metadata()
+        frame_ts = md.get("SensorTimestamp")
+        frame_ns = md.get("FrameDuration", 0) * 1000
+        exposure_ns = int(exposure_us) * 1000
+        margin_ns = int(self.MARGIN * 1e9)
+        lead_ns = int(self.SWITCH_DELAY * 1e9) + margin_ns + exposure_ns
+
+        now_ns = time.monotonic_ns()
+        # SensorTimestamp is CLOCK_MONOTONIC on the pi, if it is way off something else is going on
+        if not frame_ts or not frame_ns or abs(now_ns - frame_ts) > 5e9:
+            return self._capture_with_flush(picam2, exposure_us)
+
+        next_start = frame_ts + frame_ns
+        while next_start - lead_ns < now_ns:
+            next_start += frame_ns
+
+        sleep_until_ns(next_start - lead_ns)
+        self.on()
+        on_ns = self.lit_since
+        # the last row of a rolling shutter frame finishes roughly one frame + one exposure later
+        sleep_until_ns(next_start + frame_ns + exposure_ns + margin_ns)
+        off_ns = time.monotonic_ns()
+        lit = self.off()
+
+        for _ in range(4):
+            request = picam2.capture_request()
+            ts = request.get_metadata().get("SensorTimestamp", 0)
+            if ts < on_ns:
+                request.release() # an older frame that was already in the queue
+                continue
+            if ts - exposure_ns >= on_ns and ts + frame_ns + exposure_ns <= off_ns:
+                self.record(lit, exposure_us, frame_ns)
+                return request
+            request.release()
+            break
+
+        print("Flash window missed the frame, using a flushed capture")
+        return self._capture_with_flush(picam2, exposure_us)
+
+    def _capture_with_flush(self, picam2, exposure_us):
+        self.on()
+        request = picam2.capture_request(flush=True)
+        lit = self.off()
+        self.record(lit, exposure_us, None)
+        return request
+
+    def record(self, lit, exposure_us, frame_ns=None):
+        """Keeps (and prints) how long the flash was lit for a frame"""
+        entry = {"lit_ms": round(lit * 1000, 2), "exposure_us": int(exposure_us)}
+        if frame_ns:
+            entry["frame_ms"] = round(frame_ns / 1e6, 2)
+        self.flash_log.append(entry)
+        print(f"Flash lit for {entry['lit_ms']} ms  (exposure {entry['exposure_us']} us)")
@@ -0,0 +1,122 @@
+# frame_metadata.py
+# One line per frame, per night, with what the camera reported when it took it.
+#
+# The photos only carry a few EXIF tags, everything else libcamera tells us about a frame
+# (request.get_metadata(): exposure, gains, lens position, sensor timestamp, colour gains...) used to be
+# thrown away. TakePhoto now appends it, together with what the encode workers found out
+# (sharpness, change score, brightness statistics, what was saved and how big), to
+#     photos/<computerName>_<date>_metadata.csv
+# right next to the night's dated folder. Backup_Files copies it to the USB drive with the photos
+# (copy_folders_with_files copies the files at the top of photos/ as well as the folders) and then
+# moves it to the backed up folder with them.
+#
+# Every row has the same columns in the same order, so a whole night (a few thousand frames) reads
+# back in one go with read_metadata(), or pandas.read_csv / numpy.genfromtxt on a laptop,
+# without opening a single JPEG.
+#
+# New columns only ever go at the end. A file started by an older version keeps its own columns.
+
+import csv
+import os
+import time
+
+FIELDS = [
+    "time", "file", "hdr", "action", "bytes",
+    "sensor_timestamp", "exposure_time", "analogue_gain", "digital_gain", "frame_duration",
+    "lens_position", "colour_gain_red", "colour_gain_blue", "colour_temperature", "lux",
+    "ambient_lux", "board_temp", "cpu_temp",
+    "sharpness", "change_score", "capture_s", "encode_s",
+    "mean_luma", "clipped", "p01", "p50", "p90", "p99",
+]
+TEXT_FIELDS = ("file", "action")
+
+# libcamera metadata name -> column
+CAMERA_FIELDS = {
+    "SensorTimestamp": "sensor_timestamp",
+    "ExposureTime": "exposure_time",
+    "AnalogueGain": "analogue_gain",
+    "DigitalGain": "digital_gain",
+    "FrameDuration": "frame_duration",
+    "LensPosition": "lens_position",
+    "ColourTemperature": "colour_temperature",
+    "Lux": "lux",
+}
+
+
+def metadata_path(folder_path):
+    """The night's metadata file, next to the dated folder create_dated_folder() made"""
+    return folder_path.rstrip("/") + "_metadata.csv"
+
+
+def frame_record(metadata):
+    """The columns we keep from a request's get_metadata()"""
+    record = {column: metadata.get(name) for name, column in CAMERA_FIELDS.items()}
+    gains = metadata.get("ColourGains")
+    if gains:
+        record["colour_gain_red"], record["colour_gain_blue"] = gains
+    return record
+
+
+def clean(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return round(value, 5)
+    return value
+
+
+class MetadataLog:
+    def __init__(self, path):
+        self.path = path
+
+    def columns(self):
+        """The columns of the file as it is on disk, FIELDS for a new one"""
+        try:
+            with open(self.path, newline="") as f:
+                header = next(csv.reader(f), None)
+        except FileNotFoundError:
+            header = None
+        return header or FIELDS
+
+    def append(self, rows):
+        """Appends the rows of one shot, with a single flush so a power cut loses at most that shot"""
+        if not rows:
+            return
+        new = not os.path.exists(self.path)
+        try:
+            fields = FIELDS if new else self.columns()
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                for row in rows:
+                    row.setdefault("time", time.time())
+                    writer.writerow({k: clean(row.get(k)) for k in fields})
+                f.flush()
+                os.fsync(f.fileno())
+            if new:
+                os.chmod(self.path, 0o777)  # mode=0o777 for read write for all users
+        except OSError as e:
+            print(f"⚠️ Could not save frame metadata: {e}")
+
+
+def read_metadata(path, columns=None):
+    """
+    Reads a night's metadata file as {column: [values]}, numbers as floats (None where empty).
+    Half written lines from a power cut are skipped.
+    """
+    columns = columns or FIELDS
+    table = {c: [] for c in columns}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in columns if c not in (reader.fieldnames or [])]  # a file from an older version
+        for row in reader:
+            for c in missing:
+                row[c] = ""
+            try:
+                values = [row[c] if c in TEXT_FIELDS else (float(row[c]) if row[c] else None) for c in columns]
+            except (KeyError, TypeError, ValueError):
+                continue
+            for c, v in zip(columns, values):
+                table[c].append(v)
+    return table
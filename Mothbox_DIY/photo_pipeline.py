@@ -0,0 +1,334 @@
+# photo_pipeline.py
+# Bounded producer/consumer pipeline for saving photos.
+# TakePhoto hands each captured frame to submit() and goes straight back to capturing,
+# while a small pool of worker threads encodes and writes the frames in parallel
+# (Pillow lets go of the GIL while it encodes, so the Pi 5's other cores get used).
+#
+# The queue is bounded: if `depth` frames are already waiting, submit() blocks until a worker
+# picks one up. So at most depth + workers frames (~190MB each at 64MP RGB) are ever in memory.
+#
+# Frames can be PIL images, or RequestFrames. A RequestFrame hands the camera's own buffer to the
+# encoder as a numpy view (no make_image copy) and gives the buffer back to the camera as soon
+# as it has been encoded.
+#
+# JPEGs are encoded by the backend from encoders.py picked with JpegEncoder, PNG and BMP always go through PIL.
+#
+# submit() can also take analyzers, {name: function(array, format)}, that look at the frame in the
+# worker before it is encoded (sharpness for the focus check...). What they return ends up in the
+# frame's timings under "analysis".
+#
+# A SaveDecision (change_detect.py) can turn a frame into a smaller one, or no file at all, after the
+# analyzers have looked at it. The timings say what was done with each frame under "action".
+#
+# With previews on, every saved photo also gets small JPEG copies for the display and for looking
+# through a night quickly, at
+#     <dated folder>/previews/<width>/<photo name>.jpg
+# each shrunk from the one above it. They are made by the workers after the full size file is
+# written, so the camera never waits for them.
+#
+# With a RawSpool (raw_spool.py) the workers copy full size frames into the spool instead of encoding
+# them ("action": "spooled"), a SpoolCompressor encodes them later.
+#
+# submit() can take a crop box (sheet_crop.py), then only that part of the frame is analysed, encoded
+# and spooled. With measure_full the frame is also encoded whole in memory, to see what the crop saved.
+
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from encoders import PILEncoder, make_encoder
+from change_detect import REDUCED_SCALE, THUMBNAIL_WIDTH
+from sheet_crop import crop_frame
+
+PIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".bmp": "BMP"}
+
+# bytes of a frame per pixel in each camera format
+BYTES_PER_PIXEL = {"RGB888": 3, "BGR888": 3, "XBGR8888": 4, "XRGB8888": 4, "YUV420": 1.5}
+
+PREVIEW_DIR = "previews"
+PREVIEW_WIDTHS = (1024, 256)
+PREVIEW_QUALITY = 85
+
+
+class RequestFrame:
+    """
+    A captured picamera2 request on its way to the encoder.
+    view() maps the stream's buffer and yields it as a numpy array without copying,
+    release() hands the buffer back to the camera.
+    """
+    def __init__(self, request, stream="main"):
+        self.request = request
+        self.stream = stream
+        self.format = request.config[stream]["format"]
+        self.size = request.config[stream]["size"]
+
+    @contextmanager
+    def view(self):
+        from picamera2 import MappedArray
+        with MappedArray(self.request, self.stream) as m:
+            yield m.array
+
+    def release(self):
+        if self.request is not None:
+            self.request.release()
+            self.request = None
+
+
+class ArrayFrame:
+    """
+    A frame we made ourselves (a downscaled copy), looks like a RequestFrame to the encoders.
+    size is needed for a YUV420 copy of a camera buffer, its rows can be padded past the photo's width.
+    """
+    def __init__(self, array, fmt, size=None):
+        self.array = array
+        self.format = fmt
+        if size:
+            self.size = tuple(size)
+        elif fmt == "YUV420":
+            self.size = (array.shape[1], array.shape[0] * 2 // 3)
+        else:
+            self.size = (array.shape[1], array.shape[0])
+
+    @contextmanager
+    def view(self):
+        yield self.array
+
+
+@contextmanager
+def pixels(image):
+    """Yields (array, format) for a RequestFrame/ArrayFrame or a PIL image"""
+    if hasattr(image, "view"):
+        with image.view() as array:
+            yield array, image.format
+    else:
+        import numpy as np
+        yield np.asarray(image.convert("RGB")), "BGR888" # libcamera's name for R,G,B bytes
+
+
+def downscale(image, width):
+    """A copy of the frame `width` pixels wide"""
+    import cv2
+    from encoders import planes_to_bgr
+    with pixels(image) as (array, fmt):
+        if fmt == "YUV420":
+            # only converting the pixels we are going to use, the chroma planes skip half as many
+            step = image.size[0] // (2 * width) // 2 * 2
+            array, fmt = planes_to_bgr(array, image.size[0], max(1, step)), "RGB888"
+        h, w = array.shape[:2]
+        size = (width, max(1, round(h * width / w)))
+        # INTER_AREA over all 64MP is slow, skipping rows and columns first keeps at least 2x2 pixels
+        # averaged into every output pixel, which is plenty to not alias, at a fraction of the time
+        step = max(1, w // (2 * width))
+        if step > 1:
+            array = array[::step, ::step]
+        return ArrayFrame(cv2.resize(array, size, interpolation=cv2.INTER_AREA), fmt)
+
+
+def frame_bytes(size, fmt):
+    return int(size[0] * size[1] * BYTES_PER_PIXEL.get(fmt, 3))
+
+
+def with_suffix(filepath, suffix):
+    base, ext = os.path.splitext(filepath)
+    return base + suffix + ext
+
+
+def preview_path(filepath, width):
+    """Where the preview of a photo goes, always a jpeg whatever the photo is saved as"""
+    folder, name = os.path.split(filepath)
+    return os.path.join(folder, PREVIEW_DIR, str(width), os.path.splitext(name)[0] + ".jpg")
+
+
+class EncodePipeline:
+    def __init__(self, workers=2, depth=1, encoder=0, previews=(), spool=None):
+        self.workers = max(1, int(workers))
+        self.depth = max(1, int(depth))
+        self.encoder_choice = encoder
+        self.previews = tuple(sorted(previews, reverse=True))
+        self.spool = spool
+        self.jpeg_encoder = make_encoder(encoder)
+        self.pil_encoder = PILEncoder()
+        self.jobs = queue.Queue(maxsize=self.depth)
+        self.lock = threading.Lock()
+        self.timings = []  # one dict per saved frame
+        self.errors = []
+        self.threads = []
+        for n in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"encoder{n}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, image, filepath, save_kwargs=None, capture_s=None, analyzers=None, decision=None,
+               crop=None, measure_full=False):
+        """
+        Queues a frame to be encoded and written to filepath.
+        decision is a SaveDecision shared by the frames of one shot, the frame with analyzers resolves it.
+        crop is the (x0, y0, x1, y1) box of the frame to keep.
+        Blocks while the queue is full. Returns how long it had to wait for a free slot.
+        """
+        wait_start = time.time()
+        self.jobs.put((image, filepath, save_kwargs or {}, capture_s, analyzers or {}, decision, time.time(),
+                       crop, measure_full))
+        return time.time() - wait_start
+
+    def analyze(self, image, analyzers):
+        """Runs the analyzers on the frame's pixels, a failing one only loses its own result"""
+        results = {}
+        with pixels(image) as (array, fmt):
+            for name, analyzer in analyzers.items():
+                try:
+                    results[name] = analyzer(array, fmt)
+                except Exception as e:
+                    print(f"⚠️ {name} failed: {e}")
+        return results
+
+    def encode(self, image, filepath, save_kwargs):
+        """Encodes the frame in memory and returns the bytes"""
+        fmt = self.format_for(filepath)
+        return self.encoder_for(fmt).encode(image, fmt, save_kwargs)
+
+    def format_for(self, filepath):
+        return PIL_FORMATS.get(os.path.splitext(filepath)[1].lower(), "JPEG")
+
+    def encoder_for(self, fmt):
+        return self.jpeg_encoder if fmt == "JPEG" else self.pil_encoder
+
+    def write(self, data, filepath):
+        with open(filepath, "wb") as f:
+            f.write(data)
+
+    def write_previews(self, image, filepath):
+        """Writes the preview pyramid of a saved photo, each level shrunk from the one above. Returns seconds"""
+        t0 = time.time()
+        level = image
+        try:
+            for width in self.previews:
+                if width < level.size[0]:
+                    level = downscale(level, width)
+                    if hasattr(image, "release"):
+                        image.release()  # the smaller levels don't need the camera buffer
+                path = preview_path(filepath, width)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.write(self.jpeg_encoder.encode(level, "JPEG", {"quality": PREVIEW_QUALITY}), path)
+        except Exception as e:
+            # the photo itself is saved, a missing preview is not worth losing it over
+            print(f"⚠️ Could not make previews of {filepath}: {e}")
+        return round(time.time() - t0, 3)
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            image, filepath, save_kwargs, capture_s, analyzers, decision, queued_at, crop, measure_full = job
+            data = whole = None
+            try:
+                if crop is not None:
+                    whole, image = image, crop_frame(image, crop)
+                t0 = time.time()
+                analysis = self.analyze(image, analyzers) if analyzers else {}
+                action = "full"
+                if decision is not None:
+                    if analyzers:
+                        decision.resolve(analysis)
+                    action = decision.get()
+                ta = time.time()
+                timing = {
+                    "file": filepath,
+                    "submitted": filepath,  # file gets a suffix if the frame is saved smaller
+                    "capture_s": round(capture_s, 3) if capture_s is not None else None,
+                    "queued_s": round(t0 - queued_at, 3),
+                    "analyze_s": round(ta - t0, 3),
+                    "encode_s": 0.0,
+                    "write_s": 0.0,
+                    "bytes": 0,
+                    "action": action,
+                }
+                if analyzers:
+                    timing["analysis"] = analysis
+                if crop is not None:
+                    timing["crop"] = crop
+                if action == "full" and self.spool is not None:
+                    with pixels(image) as (array, fmt):
+                        if self.spool.put(array, fmt, filepath, save_kwargs, image.size):
+                            action = "spooled"
+                    if action == "spooled":
+                        timing.update({"action": action, "write_s": round(time.time() - ta, 3)})
+                    else:
+                        print("⚠️ Spool is full, encoding now")
+                if action not in ("skip", "spooled"):
+                    if action == "reduced":
+                        width = image.size[0] // REDUCED_SCALE
+                        image_out, filepath = downscale(image, width), with_suffix(filepath, "_reduced")
+                    elif action == "thumbnail":
+                        image_out, filepath = downscale(image, THUMBNAIL_WIDTH), with_suffix(filepath, "_thumb")
+                    else:
+                        image_out = image
+                    data = self.encode(image_out, filepath, save_kwargs)
+                    t1 = time.time()
+                    self.write(data, filepath)
+                    t2 = time.time()
+                    timing.update({
+                        "file": filepath,
+                        "encode_s": round(t1 - ta, 3),
+                        "write_s": round(t2 - t1, 3),
+                        "bytes": len(data),
+                        "encoder": self.encoder_for(self.format_for(filepath)).name,
+                    })
+                    if measure_full and whole is not None and action == "full":
+                        # before the previews, they let go of the camera buffer
+                        full = self.encode(whole, filepath, save_kwargs)
+                        timing.update({"full_bytes": len(full), "full_encode_s": round(time.time() - t2, 3)})
+                        full = None
+                    if self.previews:
+                        timing["preview_s"] = self.write_previews(image_out, filepath)
+                    image_out = None
+                with self.lock:
+                    self.timings.append(timing)
+                if action == "skip":
+                    print("Not saving " + filepath + " (nothing new on the sheet)")
+                elif action == "spooled":
+                    print("Image spooled for " + filepath + f"  (write {timing['write_s']}s)")
+                else:
+                    print("Image saved to " + filepath + f"  (encode {timing['encode_s']}s  write {timing['write_s']}s)")
+            except Exception as e:
+                with self.lock:
+                    self.errors.append((filepath, str(e)))
+                print(f"⚠️ Failed saving {filepath}: {e}")
+            finally:
+                if hasattr(image, "release"):
+                    image.release()  # the camera gets its buffer back as soon as we are done with it
+                job = image = whole = data = None
+                self.jobs.task_done()
+
+    def wait(self):
+        """Blocks until every submitted frame is on disk"""
+        self.jobs.join()
+
+    def close(self):
+        self.wait()
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def results(self, since=0):
+        """The timings (and analysis) of the frames saved after index `since`"""
+        with self.lock:
+            return list(self.timings[since:])
+
+    def report(self, since=0):
+        """Prints per stage totals for the frames saved after index `since` and returns them"""
+        frames = self.results(since)
+        if not frames:
+            return {}
+        summary = {"frames": len(frames)}
+        for stage in ("capture_s", "queued_s", "analyze_s", "encode_s", "write_s", "preview_s"):
+            values = [f[stage] for f in frames if f.get(stage) is not None]
+            summary[stage] = round(sum(values), 3)
+        print("Pipeline timings  " + "  ".join(f"{k}: {v}" for k, v in summary.items()))
+        return summary
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+"""
+EncoderBenchmark - compares the JPEG encoder backends in encoders.py (JpegEncoder in camera_settings.csv)
+
+For every backend and resolution it reports (yuv420 is the yuv backend given a frame that was
+already captured as YUV420, so it skips the colour conversion)
+ encode seconds   (best of --repeat runs)
+ MB on disk       at the quality TakePhoto uses (96)
+ PSNR             of the decoded JPEG against the original frame, higher is closer
+ peak MB          peak RSS of the process doing the encoding
+
+No camera is needed. The frame is a synthetic moth sheet (a bright textured sheet with dark
+"insects" and sensor noise) or, with --image, a real photo scaled to the sensor size.
+Every case runs in its own python process so the peak memory of one doesn't hide another's.
+
+Usage
+ python EncoderBenchmark.py                        pi4 (9000x6000) and pi5 (9248x6944)
+ python EncoderBenchmark.py --image photo.jpg      use a real mothbox photo
+ python EncoderBenchmark.py --small                quarter resolution, for a quick try on a laptop
+ python EncoderBenchmark.py --repeat 5
+"""
+
+import os
+import sys
+import json
+import resource
+import subprocess
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+RESOLUTIONS = {"pi4": (9000, 6000), "pi5": (9248, 6944)}
+QUALITY = 96
+
+
+class FakeFrame:
+    """Looks like photo_pipeline.RequestFrame to the encoders, but the buffer is just a numpy array"""
+    def __init__(self, array, fmt, size):
+        self.array = array
+        self.format = fmt
+        self.size = size  # (width, height) of the photo, like RequestFrame's
+
+    @contextmanager
+    def view(self):
+        yield self.array
+
+
+def make_frame(width, height, image_path=None):
+    """Returns a BGR (libcamera RGB888) frame of the given size"""
+    import numpy as np
+    if image_path:
+        from PIL import Image
+        rgb = np.asarray(Image.open(image_path).convert("RGB").resize((width, height)))
+        return np.ascontiguousarray(rgb[:, :, ::-1])
+
+    rng = np.random.default_rng(7)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    # a sheet that is brighter in the middle where the flash hits, with some cloth texture
+    sheet = 200 - 40 * (((x - width / 2) / width) ** 2 + ((y - height / 2) / height) ** 2)
+    sheet += 6 * np.sin(x / 3.0) * np.sin(y / 3.0)
+    frame = np.repeat(sheet[:, :, None], 3, axis=2)
+    frame *= np.array([0.95, 1.0, 1.02], dtype=np.float32)  # BGR, slightly warm
+    for _ in range(60):
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        r = int(rng.integers(width // 200, width // 40))
+        colour = rng.integers(20, 140, size=3)
+        y0, y1, x0, x1 = max(cy - r, 0), min(cy + r, height), max(cx - r, 0), min(cx + r, width)
+        frame[y0:y1, x0:x1] = colour
+    frame += rng.normal(0, 3, size=(height, width, 1)).astype(np.float32)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def psnr(jpeg, bgr):
+    import io
+    import numpy as np
+    from PIL import Image
+    decoded = np.asarray(Image.open(io.BytesIO(bytes(jpeg))).convert("RGB"), dtype=np.float32)
+    mse = np.mean((decoded - bgr[:, :, ::-1].astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # linux reports kB
+
+
+def run_case(backend, width, height, repeat, image_path):
+    from encoders import BACKENDS, rgb_to_planes
+
+    try:
+        encoder = BACKENDS["yuv" if backend == "yuv420" else backend]()
+    except ImportError as e:
+        return {"backend": backend, "error": f"not installed ({e})"}
+    frame_array = make_frame(width, height, image_path)
+    if backend == "yuv420":
+        import numpy as np
+        y, u, v = rgb_to_planes(frame_array, "RGB888")
+        planes = np.concatenate([y.ravel(), u.ravel(), v.ravel()]).reshape(-1, width)
+        frame = FakeFrame(planes, "YUV420", (width, height))
+    else:
+        frame = FakeFrame(frame_array, "RGB888", (width, height))
+    base = peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        jpeg = encoder.encode(frame, "JPEG", {"quality": QUALITY})
+        times.append(time.perf_counter() - t0)
+    return {
+        "backend": backend,
+        "encode_s": round(min(times), 3),
+        "mb": round(len(jpeg) / 1024**2, 2),
+        "psnr": round(psnr(jpeg, frame_array), 2),
+        "frame_mb": round(base, 1),
+        "peak_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    if "--child" in sys.argv:
+        args = json.loads(sys.argv[sys.argv.index("--child") + 1])
+        print(json.dumps(run_case(**args)))
+        return
+
+    repeat = int(sys.argv[sys.argv.index("--repeat") + 1]) if "--repeat" in sys.argv else 3
+    image_path = sys.argv[sys.argv.index("--image") + 1] if "--image" in sys.argv else None
+
+    for name, (width, height) in RESOLUTIONS.items():
+        if "--small" in sys.argv:
+            width, height = width // 4, height // 4
+        print(f"\n{name}  {width}x{height}  quality {QUALITY}  best of {repeat}")
+        print(f"{'backend':>8} {'encode s':>9} {'MB':>7} {'PSNR dB':>8} {'peak MB':>8}")
+        baseline = None
+        for backend in ("pil", "turbo", "yuv", "yuv420"):
+            args = {"backend": backend, "width": width, "height": height,
+                    "repeat": repeat, "image_path": image_path}
+            out = subprocess.run([sys.executable, __file__, "--child", json.dumps(args)],
+                                 capture_output=True, text=True)
+            lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+            if not lines:
+                print(f"{backend:>8} failed: {out.stderr.strip()[-200:]}")
+                continue
+            r = json.loads(lines[-1])
+            if "error" in r:
+                print(f"{backend:>8} {r['error']}")
+                continue
+            if backend == "pil":
+                baseline = r["encode_s"]
+            speedup = f"  {baseline / r['encode_s']:.1f}x" if baseline and r["encode_s"] else ""
+            print(f"{r['backend']:>8} {r['encode_s']:>9} {r['mb']:>7} {r['psnr']:>8} {r['peak_mb']:>8}{speedup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+"""
+PreviewBenchmark - shows that making the preview jpegs (Previews in camera_settings.csv) doesn't slow down capturing
+
+For brackets of 1, 3 and 5 frames, with previews off and on, it reports
+ capture s    seconds the capture side spent waiting for a free camera buffer or a free queue slot,
+              this is the only part of the pipeline the camera ever waits on
+ saved s      seconds until the last photo (and its previews) is on disk
+ preview s    seconds the workers spent on previews, per frame
+
+No camera is needed. A fake camera with a fixed pool of buffers (like libcamera's buffer_count)
+hands out synthetic moth sheet frames (see EncoderBenchmark.py) every --exposure seconds.
+
+Usage
+ python PreviewBenchmark.py                 pi5 resolution
+ python PreviewBenchmark.py --pi4           pi4 resolution
+ python PreviewBenchmark.py --small         quarter resolution, for a quick try on a laptop
+ python PreviewBenchmark.py --exposure 0.5  seconds between frames of a bracket (default 0.3)
+"""
+
+import os
+import sys
+import queue
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from EncoderBenchmark import make_frame
+
+
+class FakeCamera:
+    """A pool of camera buffers holding the same synthetic frame"""
+    def __init__(self, frame, buffer_count):
+        self.free = queue.Queue()
+        for _ in range(buffer_count):
+            self.free.put(frame.copy())
+
+    def capture(self):
+        return FakeFrame(self, self.free.get())
+
+
+class FakeFrame:
+    format = "RGB888"
+
+    def __init__(self, camera, buf):
+        self.camera = camera
+        self.buf = buf
+        self.size = (buf.shape[1], buf.shape[0])
+
+    @contextmanager
+    def view(self):
+        yield self.buf
+
+    def release(self):
+        if self.buf is not None:
+            self.camera.free.put(self.buf)
+            self.buf = None
+
+
+def run_case(frame, previews, bracket, exposure, outdir, workers=2, depth=1):
+    from photo_pipeline import EncodePipeline, PREVIEW_WIDTHS
+
+    pipeline = EncodePipeline(workers=workers, depth=depth, encoder=1,
+                              previews=PREVIEW_WIDTHS if previews else ())
+    camera = FakeCamera(frame, workers + depth + 1)
+    waited = 0.0
+    start = time.time()
+    for i in range(bracket):
+        time.sleep(exposure)  # the sensor is busy exposing the frame
+        t0 = time.time()
+        image = camera.capture()
+        waited += time.time() - t0
+        waited += pipeline.submit(image, os.path.join(outdir, f"p{int(previews)}_{bracket}_{i}.jpg"), {"quality": 96})
+    pipeline.wait()
+    saved = time.time() - start
+    results = pipeline.results()
+    pipeline.close()
+    preview_s = [r.get("preview_s", 0.0) for r in results]
+    return {"capture_s": round(waited, 3), "saved_s": round(saved, 2),
+            "preview_s": round(sum(preview_s) / len(preview_s), 3)}
+
+
+def main():
+    width, height = 9248, 6944
+    if "--pi4" in sys.argv:
+        width, height = 9000, 6000
+    if "--small" in sys.argv:
+        width, height = width // 4, height // 4
+    exposure = float(sys.argv[sys.argv.index("--exposure") + 1]) if "--exposure" in sys.argv else 0.3
+
+    frame = make_frame(width, height)
+    print(f"Frames are {width}x{height}, {exposure}s apart, 2 workers, queue depth 1")
+    print(f"{'bracket':>7} {'previews':>8} {'capture s':>9} {'saved s':>8} {'preview s':>9}")
+    with tempfile.TemporaryDirectory() as outdir:
+        run_case(frame, True, 1, 0, outdir)  # warm up the encoders and the page cache
+        for bracket in (1, 3, 5):
+            for previews in (False, True):
+                r = run_case(frame, previews, bracket, exposure, outdir)
+                print(f"{bracket:>7} {'on' if previews else 'off':>8} {r['capture_s']:>9} {r['saved_s']:>8} {r['preview_s']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,11 @@ import time
 import datetime
 from datetime import datetime
 import subprocess
+import sys
+
+# --lights-only turns off just the attractors and leaves the 12V on for the flash
+# (Scheduler.py uses it when the energy planner ends the attractor's part of a session early)
+lights_only = "--lights-only" in sys.argv[1:]
 
 print("----------------- Attract Off!-------------------")
 now = datetime.now()
@@ -53,7 +58,8 @@ def AttractOn():
     print("Attract Lights On\n")
     
 def AttractOff():
-    run_cmd("python /home/pi/Desktop/Mothbox/scripts/12vOff.py")
+    if not lights_only:
+        run_cmd("python /home/pi/Desktop/Mothbox/scripts/12vOff.py")
 
     
     GPIO.output(GPIO_SW_Ch3,GPIO.LOW)
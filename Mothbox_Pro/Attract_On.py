@@ -61,8 +61,9 @@ def AttractOn():
 
     print("Attract Lights On\n")
     
-def AttractOff():
-    run_cmd("python /home/pi/Desktop/Mothbox/scripts/12vOff.py")
+def AttractOff(lights_only=False):
+    if not lights_only:
+        run_cmd("python /home/pi/Desktop/Mothbox/scripts/12vOff.py")
 
     GPIO.output(GPIO_SW_Ch3,GPIO.LOW)
     GPIO.output(GPIO_SW_Ch2,GPIO.LOW)
@@ -74,7 +75,24 @@ def AttractOff():
     print("Attract Lights Off\n")
 
 
-AttractOn()
+def attract_time_over():
+    """The energy planner (energy_planner.py) can end the attractor's part of a session early"""
+    try:
+        with open("/boot/firmware/mothbox_custom/system/controls/energy.txt") as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                if key == "attract_until":
+                    return 0 < float(value) < time.time()
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+if attract_time_over():
+    print("The energy budget has no more attractor time this session")
+    AttractOff(lights_only=True) # the flash still needs the 12V
+else:
+    AttractOn()
 #AttractOff()
 
 quit()
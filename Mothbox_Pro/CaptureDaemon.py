@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+"""
+CaptureDaemon - keeps the camera open and configured for a whole session
+
+Every cron run of TakePhoto.py pays for importing cv2/picamera2, opening the camera,
+configuring the 64MP still mode and several seconds of warm up sleeps before the first frame.
+This service does all of that ONCE and then waits on a local unix socket for triggers
+(sent by TriggerPhoto.py), so each photo only costs the capture and the save.
+
+Its order of operations is like this
+-Determine if pi4 or pi5 to set max resolution
+-Read in camera settings and calibrate (if mandated)
+-Configure the still mode and keep the camera streaming
+-Wait for a trigger, take the photo, reply with how long it took
+
+Every trigger is logged with
+ trigger_to_capture  - seconds between the trigger arriving and the sensor frame being grabbed
+ total               - seconds between the trigger arriving and the photo being on disk
+
+When the energy planner (energy_planner.py) can't afford every photo tonight, only every
+capture_every-th trigger (controls/energy.txt) takes one, the others are answered as skipped. The
+triggers are counted with TakePhoto's (energy_planner.energy_skip), so a session that mixes both keeps
+to capture_every too.
+
+With SpoolFrames on, the photos are copied raw into the spool (raw_spool.py) and this daemon encodes
+them once no photo has been asked for in SpoolIdleSeconds, or while the box is on external power.
+
+Scheduler.py starts this in ACTIVE mode. The cron job can stay on TakePhoto.py, which hands the photo to
+this daemon when it is running, or point at TriggerPhoto.py (which falls back to TakePhoto.py if this
+daemon is not running).
+"""
+
+import os
+import json
+import socket
+import threading
+import time
+from datetime import datetime
+
+import TakePhoto
+from capture_client import SOCKET_PATH
+from energy_planner import energy_skip
+
+BOOT_LOCK = TakePhoto.BOOT_LOCK
+ENERGY_PATH = TakePhoto.ENERGY_PATH
+
+settings_mtime = None
+last_trigger = time.time()
+capturing = threading.Event()
+external_checked = (0.0, False)
+
+
+def camera_settings_mtime():
+    try:
+        return os.path.getmtime(TakePhoto.CAMERA_SETTINGS_PATH)
+    except OSError:
+        return None
+
+
+def prepare_session(force=False):
+    """
+    (Re)loads the settings and configures the still mode if the camera CSV changed,
+    or a calibration is due. Returns True if the camera was reconfigured.
+    """
+    global settings_mtime
+
+    if force:
+        TakePhoto.load_session_settings()
+    mtime = camera_settings_mtime()
+    due = TakePhoto.calibration_due()
+    if not force and not due and mtime == settings_mtime:
+        return False
+
+    if TakePhoto.picam2.started:
+        TakePhoto.picam2.stop()
+    for cam in TakePhoto.extra_cameras:
+        cam.stop()
+
+    TakePhoto.load_session_settings()
+    prediction = TakePhoto.predict_calibration() if TakePhoto.AutoCalibration else None
+    if due:
+        print("Do Autocalibrate")
+        TakePhoto.run_calibration(predicted=prediction, lens=TakePhoto.predict_lens())
+        TakePhoto.load_session_settings()
+    TakePhoto.apply_prediction(prediction)
+
+    TakePhoto.configure_still()
+    # configure() forgets controls, set them now so they are in place when the camera starts streaming
+    TakePhoto.apply_capture_controls()
+    settings_mtime = camera_settings_mtime()
+    return True
+
+
+def handle_capture():
+    if os.path.exists(BOOT_LOCK):
+        return {"ok": False, "error": "boot lock present"}
+    if energy_skip(ENERGY_PATH):
+        return {"ok": True, "skipped": "energy", "files": []}
+    if not TakePhoto.check_storage():
+        return {"ok": False, "error": "not enough space to take more photos"}
+
+    global last_trigger
+    capturing.set()
+    try:
+        return capture()
+    finally:
+        last_trigger = time.time()
+        capturing.clear()
+
+
+def capture():
+    trigger_time = time.time()
+    flashes_before = len(TakePhoto.flash.flash_log)
+    reconfigured = prepare_session()
+    files = TakePhoto.takePhoto_Manual(keep_running=True)
+    done_time = time.time()
+
+    latency = {
+        "trigger_to_capture": round(TakePhoto.last_capture_time - trigger_time, 3),
+        "total": round(done_time - trigger_time, 3),
+    }
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] trigger latency "
+          f"capture: {latency['trigger_to_capture']}s  total: {latency['total']}s  reconfigured: {reconfigured}")
+    return {"ok": True, "files": files, "latency": latency, "reconfigured": reconfigured,
+            "flash": TakePhoto.flash.flash_log[flashes_before:],
+            "pipeline": TakePhoto.last_pipeline_timings,
+            "bracket": TakePhoto.last_bracket_stats,
+            "storage": TakePhoto.last_storage_plan,
+            "spool": TakePhoto.spool.backlog() if TakePhoto.spool else {},
+            "cameras": TakePhoto.last_rig_stats,
+            "burst": TakePhoto.last_burst_stats}
+
+
+def handle(message):
+    cmd = message.get("cmd", "capture")
+    if cmd == "capture":
+        return handle_capture()
+    if cmd == "status":
+        autofocus_runs, autofocus_saved = TakePhoto.lens_table.counts()
+        return {"ok": True, "started": bool(TakePhoto.picam2.started), "pid": os.getpid(),
+                "autofocus_runs": autofocus_runs, "autofocus_saved": autofocus_saved,
+                "spool": TakePhoto.spool.backlog() if TakePhoto.spool else {}}
+    if cmd == "stop":
+        return {"ok": True, "stopping": True}
+    return {"ok": False, "error": f"unknown command {cmd}"}
+
+
+def may_compress():
+    """Spooled frames are encoded when nobody is waiting for a photo and none is expected soon"""
+    global external_checked
+    if capturing.is_set():
+        return False
+    if time.time() - last_trigger >= TakePhoto.SpoolIdleSeconds:
+        return True
+    checked_at, external = external_checked
+    if time.time() - checked_at > 60:
+        external = TakePhoto.on_external_power()
+        external_checked = (time.time(), external)
+    return external
+
+
+def compress_spool():
+    while True:
+        time.sleep(5)
+        try:
+            if TakePhoto.spool is not None and TakePhoto.spool.pending() and may_compress():
+                TakePhoto.drain_spool(may_compress)
+        except Exception as e:
+            print(f"⚠️ Spool compressor failed: {e}")
+
+
+def serve():
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    os.chmod(SOCKET_PATH, 0o777)  # cron jobs run as different users
+    server.listen(1)
+    print("Capture daemon listening on " + SOCKET_PATH)
+
+    running = True
+    try:
+        while running:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    data = conn.makefile("r").readline()
+                    message = json.loads(data) if data.strip() else {}
+                    reply = handle(message)
+                except Exception as e:
+                    print(f"⚠️ Trigger failed: {e}")
+                    reply = {"ok": False, "error": str(e)}
+                running = not reply.get("stopping", False)
+                try:
+                    conn.sendall((json.dumps(reply) + "\n").encode())
+                except OSError:
+                    pass
+    finally:
+        server.close()
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+
+
+def main():
+    print("----------------- STARTING CAPTURE DAEMON-------------------")
+    startup = time.time()
+
+    TakePhoto.setup_resolution()
+    TakePhoto.setup_flash()
+    TakePhoto.picam2 = TakePhoto.Picamera2()
+    prepare_session(force=True)
+    # get the first warm up out of the way before anyone asks for a photo
+    TakePhoto.picam2.start()
+    print("Camera ready in " + str(round(time.time() - startup, 2)) + " seconds")
+    if TakePhoto.SpoolFrames or TakePhoto.SPOOL_PATH.exists():
+        TakePhoto.get_spool()  # frames left over from before get encoded too
+    threading.Thread(target=compress_spool, name="spool", daemon=True).start()
+
+    try:
+        serve()
+    finally:
+        TakePhoto.picam2.stop()
+        TakePhoto.picam2.close()
+        for cam in TakePhoto.extra_cameras:
+            cam.stop()
+            cam.close()
+        if TakePhoto.pipeline is not None:
+            TakePhoto.pipeline.close()
+        for p in TakePhoto.extra_pipelines + [TakePhoto.burst_pipeline]:
+            if p is not None:
+                p.close()
+        print("Capture daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -220,6 +220,8 @@ PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".gif", ".
 def count_photos(folder):
     count = 0
     for root, dirs, files in os.walk(folder):
+        if "previews" in dirs:
+            dirs.remove("previews") # small copies TakePhoto makes of every photo, not photos of their own
         for name in files:
             if os.path.splitext(name)[1].lower() in PHOTO_EXTENSIONS:
                 count += 1
@@ -0,0 +1,171 @@
+# boot_tasks.py
+# Runs the Scheduler's wake up steps as a dependency graph instead of one after another.
+#
+# Every step is a task with the tasks it has to wait for. A task starts in its own thread as soon as
+# everything it waits for is done, so steps that don't need each other (the GPS poll and the diagnostics)
+# overlap instead of adding up, while the boot lock keeps the camera waiting. Steps that share hardware
+# (the diagnostics and the display both switch the 3V3 sensor line) have to wait for each other.
+# A task that fails doesn't hold up the ones after it, they run with whatever it left behind, the same
+# as when the steps ran in a row. A task can skip() others that haven't started yet, and everything
+# waiting for them is skipped too (OFF and STANDBY don't need the GPS or the display, just the shutdown).
+#
+# After a run, timeline() has every task's start, end and duration, and which tasks were on the
+# critical path: the chain of tasks each waiting for the previous one that decided when the boot was
+# done. log() appends them to logs/boot_timeline.csv, one row per task per boot.
+
+import csv
+import os
+import threading
+import time
+import traceback
+
+FIELDS = ["boot", "uptime_s", "task", "after", "start_s", "end_s", "seconds", "status", "critical"]
+
+
+def uptime():
+    """Seconds since the kernel started, None where there is no /proc"""
+    try:
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class BootTask:
+    def __init__(self, name, func, after):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.start = None
+        self.end = None
+        self.status = "waiting"
+
+
+class BootGraph:
+    def __init__(self):
+        self.tasks = {}
+        self.skipped = set()
+        self.boot = time.time()
+        self.uptime = uptime()
+        self.t0 = time.monotonic()
+        self.marks = {}
+
+    def add(self, name, func, after=()):
+        for dep in after:
+            if dep not in self.tasks:
+                raise ValueError(f"{name} waits for {dep}, which isn't a task (yet)")
+        self.tasks[name] = BootTask(name, func, after)
+
+    def skip(self, *names):
+        """These tasks, and the ones waiting for them, won't run if they haven't started yet"""
+        self.skipped.update(names)
+
+    def mark(self, name):
+        """Remembers when something happened that isn't a task (the boot lock going away...)"""
+        self.marks[name] = time.monotonic() - self.t0
+
+    def run(self):
+        cond = threading.Condition()
+        running = set()
+
+        def work(task):
+            task.start = time.monotonic() - self.t0
+            status = "ok"
+            try:
+                task.func()
+            except Exception:
+                status = "failed"
+                print(f"⚠️ Boot task {task.name} failed")
+                traceback.print_exc()
+            with cond:
+                task.end = time.monotonic() - self.t0
+                task.status = status
+                running.discard(task.name)
+                cond.notify_all()
+
+        with cond:
+            while True:
+                changed = True
+                while changed:
+                    changed = False
+                    for task in self.tasks.values():
+                        if task.status != "waiting":
+                            continue
+                        deps = [self.tasks[d].status for d in task.after]
+                        if task.name in self.skipped or "skipped" in deps:
+                            task.status = "skipped"
+                            changed = True
+                        elif all(d in ("ok", "failed") for d in deps):
+                            task.status = "running"
+                            running.add(task.name)
+                            threading.Thread(target=work, args=(task,), name=f"boot-{task.name}", daemon=True).start()
+                            changed = True
+                if not running:
+                    if any(t.status == "waiting" for t in self.tasks.values()):
+                        raise RuntimeError("boot tasks wait for each other in a circle")
+                    break
+                cond.wait()
+        return self.timeline()
+
+    def critical_path(self):
+        """Names of the tasks that decided how long the boot took, first to last"""
+        done = [t for t in self.tasks.values() if t.end is not None]
+        if not done:
+            return []
+        task = max(done, key=lambda t: t.end)
+        path = [task.name]
+        while True:
+            deps = [self.tasks[d] for d in task.after if self.tasks[d].end is not None]
+            if not deps:
+                break
+            task = max(deps, key=lambda t: t.end)
+            path.append(task.name)
+        return path[::-1]
+
+    def timeline(self):
+        critical = set(self.critical_path())
+        rows = []
+        for task in sorted(self.tasks.values(), key=lambda t: (t.start is None, t.start or 0)):
+            rows.append({
+                "task": task.name, "after": ";".join(task.after),
+                "start_s": None if task.start is None else round(task.start, 2),
+                "end_s": None if task.end is None else round(task.end, 2),
+                "seconds": None if task.end is None else round(task.end - task.start, 2),
+                "status": task.status, "critical": int(task.name in critical),
+            })
+        for name, at in self.marks.items():
+            rows.append({"task": name, "after": "", "start_s": round(at, 2), "end_s": round(at, 2),
+                         "seconds": 0.0, "status": "mark", "critical": 0})
+        return rows
+
+    def report(self):
+        """Prints the timeline, the critical path and the total"""
+        rows = self.timeline()
+        for r in rows:
+            if r["status"] == "mark":
+                print(f"  {r['task']:<22} at {r['start_s']:>6}s")
+                continue
+            span = "" if r["start_s"] is None else f"{r['start_s']:>6}s - {r['end_s']:>6}s  ({r['seconds']}s)"
+            print(f"  {r['task']:<22} {span:<30} {r['status']}{'  *' if r['critical'] else ''}")
+        path = self.critical_path()
+        if path:
+            total = self.tasks[path[-1]].end
+            serial = sum(t.end - t.start for t in self.tasks.values() if t.end is not None)
+            print(f"Boot tasks done in {total:.1f}s ({serial:.1f}s one after another)  critical path: "
+                  + " > ".join(path))
+        return rows
+
+    def log(self, path):
+        """Appends this boot's timeline to a csv"""
+        new = not os.path.exists(path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                for row in self.timeline():
+                    writer.writerow(dict(row, boot=round(self.boot, 1),
+                                         uptime_s=None if self.uptime is None else round(self.uptime, 1)))
+        except OSError as e:
+            print(f"⚠️ Could not save the boot timeline: {e}")
@@ -0,0 +1,103 @@
+# bracketing.py
+# HDR bracketing on a camera that keeps running.
+#
+# The old HDR loop did set_controls / start / sleep 0.3s / capture / stop for every exposure,
+# so a 5 shot bracket was spread over seconds while the insects walked around.
+# Here every exposure is queued into the running camera one frame after the other
+# and the frames that come back are matched to the exposure they were asked for by their
+# ExposureTime metadata. A bracket then takes a handful of frame times.
+
+import time
+
+
+class BracketEngine:
+    # how close the reported ExposureTime has to be to the requested one (the sensor rounds to whole lines)
+    TOLERANCE = 0.05
+    TOLERANCE_US = 50
+    # frames we are willing to wait for the first exposure to settle before lighting the flash
+    SETTLE_FRAMES = 12
+
+    def __init__(self, picam2, flash):
+        self.picam2 = picam2
+        self.flash = flash
+        self.min_exp, self.max_exp, _ = picam2.camera_controls["ExposureTime"]
+
+    def clamp(self, exposure_us):
+        """The camera clamps what it can't do, so match against what it will actually deliver"""
+        return int(min(max(exposure_us, self.min_exp), self.max_exp))
+
+    def matches(self, reported_us, target_us):
+        if not reported_us:
+            return False
+        return abs(reported_us - target_us) <= max(self.TOLERANCE_US, self.TOLERANCE * target_us)
+
+    def capture(self, exposure_times, on_frame):
+        """
+        Captures one frame per exposure in exposure_times.
+        on_frame(index, request) is called as soon as the frame for exposure_times[index] arrives
+        and takes ownership of the request (it must release it).
+        Returns stats about how long the bracket took.
+        """
+        targets = [self.clamp(e) for e in exposure_times]
+        pending = list(range(len(targets)))
+        max_frames = 8 * len(targets) + 20
+
+        # get the first exposure in place before lighting anything
+        self.picam2.set_controls({"ExposureTime": targets[0]})
+        for _ in range(self.SETTLE_FRAMES):
+            if self.matches(self.picam2.capture_metadata().get("ExposureTime"), targets[0]):
+                break
+
+        start = time.time()
+        self.flash.on()
+        on_ns = self.flash.lit_since
+        next_ask = 1
+        frames_seen = 0
+        kept_ts = []
+        try:
+            while pending and frames_seen < max_frames:
+                # keep the control queue full, one new exposure per frame
+                if next_ask < len(targets):
+                    self.picam2.set_controls({"ExposureTime": targets[next_ask]})
+                    next_ask += 1
+                elif frames_seen and frames_seen % len(targets) == 0:
+                    # an exposure we asked for never showed up (dropped frame), ask again
+                    self.picam2.set_controls({"ExposureTime": targets[pending[0]]})
+
+                request = self.picam2.capture_request()
+                frames_seen += 1
+                md = request.get_metadata()
+                ts = md.get("SensorTimestamp", 0)
+                exposure = md.get("ExposureTime", 0)
+
+                match = None
+                if ts - exposure * 1000 >= on_ns:  # it started after the flash was on
+                    for idx in pending:
+                        if self.matches(exposure, targets[idx]):
+                            match = idx
+                            break
+                if match is None:
+                    request.release()
+                    continue
+
+                pending.remove(match)
+                kept_ts.append(ts)
+                print("exp  ", exposure_times[match], "  ", match, "  got ", exposure)
+                on_frame(match, request)
+        finally:
+            lit = self.flash.off()
+
+        self.flash.record(lit, max(targets))
+        spread_ms = (max(kept_ts) - min(kept_ts)) / 1e6 if kept_ts else 0.0
+        stats = {
+            "frames": len(targets) - len(pending),
+            "missing": [exposure_times[i] for i in pending],
+            "frames_seen": frames_seen,
+            "spread_ms": round(spread_ms, 1),
+            "wall_s": round(time.time() - start, 3),
+        }
+        if pending:
+            print("⚠️ Bracket gave up waiting for exposures " + str(stats["missing"]))
+        print(f"Bracket of {stats['frames']} spread over {stats['spread_ms']} ms of sensor time "
+              f"({frames_seen} frames, {stats['wall_s']} s)")
+        return stats
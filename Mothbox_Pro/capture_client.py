@@ -0,0 +1,25 @@
+# capture_client.py
+# Asks the running CaptureDaemon (CaptureDaemon.py) for something over its unix socket.
+# TriggerPhoto.py and TakePhoto.py (when cron still runs it while the daemon has the camera) both send
+# their photo triggers with this, so they can't drift apart.
+
+import json
+import socket
+
+SOCKET_PATH = "/run/mothbox_capture.sock"
+TIMEOUT = 120  # seconds, an HDR bracket with a calibration can take a while
+
+
+def send(message, timeout=TIMEOUT):
+    """
+    Sends one message ({"cmd": "capture"}...) and returns the daemon's reply.
+    Raises socket.timeout when the daemon is alive but busy, OSError or ValueError when no daemon answered.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(SOCKET_PATH)
+        client.sendall((json.dumps(message) + "\n").encode())
+        return json.loads(client.makefile("r").readline())
+    finally:
+        client.close()
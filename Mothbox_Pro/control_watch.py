@@ -0,0 +1,77 @@
+# control_watch.py
+# Sleeps until a control file changes, instead of reading it again every second.
+#
+# ControlWatch asks the kernel (inotify, through ctypes, no extra packages) to wake it when a file in
+# the controls folder is written, replaced or deleted. atomic_update_kv() writes a .tmp file and
+# renames it over the control file, which shows up as the control file being moved in.
+# wait(timeout) sleeps until that happens or the timeout runs out and returns the names of the
+# files that changed (an empty set on timeout).
+#
+# inotify only sees changes made on this Pi, which is where DebugMode and the other scripts change
+# the controls. Where there is no inotify (not Linux, or out of watches) wait() sleeps at most
+# FALLBACK_POLL seconds and returns None: anything might have changed, read the files again.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, then the name
+FALLBACK_POLL = 30  # seconds
+
+
+class ControlWatch:
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+            if libc.inotify_add_watch(fd, self.directory.encode(), mask) < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, "inotify_add_watch")
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            print(f"⚠️ Can't watch {self.directory} for changes ({e}), checking every {FALLBACK_POLL} s instead")
+
+    @property
+    def watching(self):
+        return self.fd is not None
+
+    def wait(self, timeout):
+        """Names of the files that changed, an empty set after timeout seconds, None without inotify"""
+        timeout = max(0.0, timeout)
+        if self.fd is None:
+            time.sleep(min(timeout, FALLBACK_POLL))
+            return None
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        names = set()
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            _, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            names.add(data[offset:offset + length].rstrip(b"\0").decode(errors="replace"))
+            offset += length
+        return names
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
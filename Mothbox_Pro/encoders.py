@@ -0,0 +1,150 @@
+# encoders.py
+# JPEG encoder backends for the photo pipeline, picked with JpegEncoder in camera_settings.csv
+#
+#  0 PIL         - what TakePhoto always used. Also the only one that can write PNG and BMP
+#  1 turbo       - libjpeg-turbo through simplejpeg (comes with picamera2), encodes the camera's BGR buffer directly
+#  2 yuv         - libjpeg-turbo fed YUV420 planes. JPEG is YUV inside anyway, so a YUV420 frame
+#                  skips the colour conversion. RGB frames get converted with cv2 first.
+#
+# YUV420 frames are full range (sYCC, what picamera2 uses for stills), the same as inside a JPEG.
+# Their arrays are as wide as the camera's row stride, which can be a few pixels wider than the photo,
+# so everything that splits them into planes is given the frame's real width.
+#
+# Every backend takes either a PIL image or a frame with view()/format (photo_pipeline.RequestFrame)
+# and returns the encoded bytes.
+
+import io
+
+JPEG_ENCODERS = {0: "pil", 1: "turbo", 2: "yuv"}
+
+# picamera2 format name -> PIL raw mode of the bytes in memory (libcamera RGB888 is stored B,G,R)
+RAW_MODES = {"RGB888": "BGR", "BGR888": "RGB"}
+# picamera2 format name -> simplejpeg colorspace
+TURBO_COLORSPACES = {"RGB888": "BGR", "BGR888": "RGB", "XBGR8888": "RGBX", "XRGB8888": "BGRX"}
+
+
+def insert_exif(jpeg, exif_bytes):
+    """Puts an EXIF (APP1) segment right after the JPEG start of image marker"""
+    if not exif_bytes:
+        return jpeg
+    jpeg = bytes(jpeg)
+    segment = b"\xff\xe1" + (len(exif_bytes) + 2).to_bytes(2, "big") + exif_bytes
+    return jpeg[:2] + segment + jpeg[2:]
+
+
+def split_planes(array, width=None):
+    """
+    Y, U, V views of a (h*3/2, stride) I420 buffer: the Y plane followed by the quarter size U and V planes.
+    width leaves out the padding at the end of the rows.
+    """
+    h = array.shape[0] * 2 // 3
+    stride = array.shape[1]
+    width = width or stride
+    uv = array[h:].reshape(2, h // 2, stride // 2)
+    return array[:h, :width], uv[0, :, :width // 2], uv[1, :, :width // 2]
+
+
+def rgb_to_planes(array, fmt):
+    """Full range Y, U, V planes (chroma at half size) from an RGB888/BGR888 frame"""
+    import cv2
+    code = cv2.COLOR_BGR2YCrCb if fmt == "RGB888" else cv2.COLOR_RGB2YCrCb
+    ycrcb = cv2.cvtColor(contiguous(array), code)
+    h, w = ycrcb.shape[:2]
+    half = ((w + 1) // 2, (h + 1) // 2)  # libjpeg wants the odd row/column to have chroma too
+    u = cv2.resize(ycrcb[:, :, 2], half, interpolation=cv2.INTER_AREA)
+    v = cv2.resize(ycrcb[:, :, 1], half, interpolation=cv2.INTER_AREA)
+    return contiguous(ycrcb[:, :, 0]), u, v
+
+
+def planes_to_bgr(array, width=None, step=1):
+    """BGR frame from a full range I420 buffer. step (1 or even) only converts every step-th pixel"""
+    import cv2
+    y, u, v = split_planes(array, width)
+    if step > 1:
+        y, u, v = y[::step, ::step], u[::step // 2, ::step // 2], v[::step // 2, ::step // 2]
+    y, u, v = contiguous(y), contiguous(u), contiguous(v)
+    size = (y.shape[1], y.shape[0])
+    ycrcb = cv2.merge((y, cv2.resize(v, size), cv2.resize(u, size)))
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+
+
+def contiguous(array):
+    import numpy as np
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array) # only if the camera padded the rows
+    return array
+
+
+class PILEncoder:
+    name = "pil"
+
+    def encode(self, image, fmt, save_kwargs):
+        buf = io.BytesIO()
+        if hasattr(image, "view"):
+            with image.view() as array:
+                self.array_to_pil(array, image.format, image.size[0]).save(buf, format=fmt, **save_kwargs)
+        else:
+            image.save(buf, format=fmt, **save_kwargs)
+        return buf.getbuffer()
+
+    def array_to_pil(self, array, fmt, width=None):
+        from PIL import Image
+        if fmt == "YUV420":
+            array = planes_to_bgr(array, width)
+            fmt = "RGB888"
+        array = contiguous(array)
+        h, w = array.shape[:2]
+        return Image.frombuffer("RGB", (w, h), array, "raw", RAW_MODES.get(fmt, "RGB"), 0, 1)
+
+
+class TurboEncoder:
+    name = "turbo"
+
+    def __init__(self):
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+
+    def encode(self, image, fmt, save_kwargs):
+        quality = int(save_kwargs.get("quality", 96))
+        if hasattr(image, "view"):
+            with image.view() as array:
+                jpeg = self.encode_array(array, image.format, quality, image.size[0])
+        else:
+            import numpy as np
+            jpeg = self.encode_array(np.asarray(image.convert("RGB")), "BGR888", quality)
+        return insert_exif(jpeg, save_kwargs.get("exif"))
+
+    def encode_planes(self, planes, quality):
+        y, u, v = (contiguous(p) for p in planes)
+        return self.simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=quality)
+
+    def encode_array(self, array, fmt, quality, width=None):
+        if fmt == "YUV420":
+            return self.encode_planes(split_planes(array, width), quality)
+        return self.simplejpeg.encode_jpeg(contiguous(array), quality=quality,
+                                           colorspace=TURBO_COLORSPACES.get(fmt, "RGB"),
+                                           colorsubsampling="420")
+
+
+class YUVEncoder(TurboEncoder):
+    name = "yuv"
+
+    def encode_array(self, array, fmt, quality, width=None):
+        planes = split_planes(array, width) if fmt == "YUV420" else rgb_to_planes(array, fmt)
+        return self.encode_planes(planes, quality)
+
+
+BACKENDS = {"pil": PILEncoder, "turbo": TurboEncoder, "yuv": YUVEncoder}
+
+
+def make_encoder(choice):
+    """
+    choice is the JpegEncoder number from the camera CSV (or a backend name).
+    Falls back to PIL if the backend's library isn't installed.
+    """
+    name = JPEG_ENCODERS.get(choice, choice) if not isinstance(choice, str) else choice
+    try:
+        return BACKENDS.get(name, PILEncoder)()
+    except ImportError as e:
+        print(f"⚠️ Warning: {name} encoder not available ({e}), using PIL")
+        return PILEncoder()
@@ -0,0 +1,118 @@
+# exposure_feedback.py
+# Keeps the photos as bright as they were right after calibration, without calibrating again.
+#
+# With the exposure fixed by calibration, the photos drift darker or brighter during the night (the
+# moon comes up, the flash gets warm, the battery sags...). Every shot's middle frame now gets a few
+# statistics of its brightness (frame_stats(), an EncodePipeline analyzer, on a preview sized sample
+# of the frame): mean luma, the fraction of clipped highlights, and the 1st/50th/90th/99th percentiles.
+# They go to the night's metadata file with the rest of the frame's data.
+#
+# The ExposureTracker learns how bright the sheet is in the first shots after a calibration, the same
+# way FocusTracker learns the sharpness, and then nudges the exposure of the next shot back towards
+# that. It steers on the 90th percentile rather than the mean, which is the sheet itself: a sheet full
+# of dark moths has a lower mean but should not get a longer exposure. Clipped highlights always pull
+# it down.
+#
+# The correction is damped (FOLLOW), at most MAX_STEP stops per shot and MAX_STOPS stops away from
+# the calibration in total. It goes into the AnalogueGain first (the exposure time is kept short so the
+# insects are sharp) and only into ExposureTime once the gain is at its limits. Stuck at MAX_STOPS
+# for a few shots, the scene changed too much for nudging and TakePhoto calibrates again.
+
+import math
+
+import numpy as np
+
+SAMPLE_WIDTH = 256  # the size of the smallest preview
+CLIP_LEVEL = 250
+PERCENTILES = (1, 50, 90, 99)
+GAMMA = 2.2  # jpeg brightness goes roughly with exposure ** (1 / GAMMA)
+
+
+def frame_stats(array, fmt):
+    """Brightness statistics of a frame, from every n-th pixel. Used as an EncodePipeline analyzer"""
+    if fmt == "YUV420":
+        luma = array[: array.shape[0] * 2 // 3]  # the Y plane
+        step = max(1, luma.shape[1] // SAMPLE_WIDTH)
+        luma = luma[::step, ::step]
+    else:
+        step = max(1, array.shape[1] // SAMPLE_WIDTH)
+        small = array[::step, ::step, :3].astype(np.uint16)
+        # RGB888 is B,G,R in memory, BGR888 (and PIL) R,G,B
+        b, r = (small[..., 0], small[..., 2]) if fmt in ("RGB888", "XRGB8888") else (small[..., 2], small[..., 0])
+        luma = (29 * b + 150 * small[..., 1] + 77 * r) >> 8
+    hist = np.bincount(luma.ravel(), minlength=256)
+    total = hist.sum()
+    cumulative = np.cumsum(hist)
+    stats = {"mean": round(float(np.dot(hist, np.arange(hist.size)) / total), 2),
+             "clipped": round(float(hist[CLIP_LEVEL:].sum() / total), 5)}
+    for p in PERCENTILES:
+        stats[f"p{p:02d}"] = int(np.searchsorted(cumulative, total * p / 100))
+    return stats
+
+
+class ExposureTracker:
+    LEARN_SHOTS = 3  # shots after a calibration that set the baseline
+    DEADBAND = 0.1  # stops, closer than this to the baseline is left alone
+    FOLLOW = 0.5  # how much of the error one shot corrects
+    MAX_STEP = 0.5  # stops per shot
+    MAX_STOPS = 1.0  # stops from the calibrated exposure
+    MAX_CLIPPED = 0.01  # more clipped highlights than this (and than the baseline had) always darkens
+    CLIP_STEP = -0.3  # stops
+    LIMIT_SHOTS = 3  # shots at MAX_STOPS before asking for a calibration
+
+    def __init__(self, state):
+        """state is the dict saved in the exposure feedback control file"""
+        self.baseline = float(state.get("baseline", 0) or 0)
+        self.baseline_clipped = float(state.get("baseline_clipped", 0) or 0)
+        self.samples = int(float(state.get("samples", 0) or 0))
+        self.stops = float(state.get("stops", 0) or 0)  # correction on top of the calibration
+        self.at_limit = int(float(state.get("at_limit", 0) or 0))
+
+    def state(self):
+        return {"baseline": round(self.baseline, 2), "baseline_clipped": round(self.baseline_clipped, 5),
+                "samples": self.samples, "stops": round(self.stops, 3), "at_limit": self.at_limit}
+
+    def reset(self):
+        """After a calibration the exposure is right again, and the old baseline means nothing"""
+        self.baseline = 0.0
+        self.baseline_clipped = 0.0
+        self.samples = 0
+        self.stops = 0.0
+        self.at_limit = 0
+
+    def learning(self):
+        return self.samples < self.LEARN_SHOTS
+
+    def record(self, stats):
+        """
+        Adds one shot's stats and moves the correction for the next one.
+        Returns how many stops the shot was off the baseline (None while learning).
+        """
+        level = max(float(stats["p90"]), 1.0)
+        if self.learning():
+            self.baseline = (self.baseline * self.samples + level) / (self.samples + 1)
+            self.baseline_clipped = (self.baseline_clipped * self.samples + stats["clipped"]) / (self.samples + 1)
+            self.samples += 1
+            return None
+        self.samples += 1
+        error = GAMMA * math.log2(self.baseline / level)  # stops of exposure the shot was short of the baseline
+        step = 0.0
+        if stats["clipped"] > max(self.MAX_CLIPPED, 2 * self.baseline_clipped):
+            step = self.CLIP_STEP
+        elif abs(error) > self.DEADBAND:
+            step = max(-self.MAX_STEP, min(self.MAX_STEP, self.FOLLOW * error))
+        self.stops = max(-self.MAX_STOPS, min(self.MAX_STOPS, self.stops + step))
+        self.at_limit = self.at_limit + 1 if abs(self.stops) >= self.MAX_STOPS else 0
+        return error
+
+    def needs_calibration(self):
+        return self.at_limit >= self.LIMIT_SHOTS
+
+    def apply(self, exposure, gain, gain_limits, exposure_limits):
+        """The calibrated exposure and gain with the correction, gain first. Returns (exposure, gain)"""
+        factor = 2 ** self.stops
+        new_gain = max(gain_limits[0], min(gain_limits[1], gain * factor))
+        new_exposure = exposure * factor * gain / new_gain
+        new_exposure = max(exposure / 2 ** self.MAX_STOPS, min(exposure * 2 ** self.MAX_STOPS, new_exposure))
+        new_exposure = max(exposure_limits[0], min(exposure_limits[1], new_exposure))
+        return int(new_exposure), round(new_gain, 3)
@@ -0,0 +1,163 @@
+# exposure_model.py
+# Predicts the calibrated ExposureTime / AnalogueGain from the LTR-303 light sensor,
+# so TakePhoto can set the exposure straight away instead of metering with the camera.
+#
+# Every real calibration appends (lux, flash, ExposureValue, exposure, gain) to exposure_history.csv
+# (exposuretime.txt / autogain.txt only keep the latest result, without the light level it was taken in).
+#
+# The camera needs exposure x gain in proportion to 1 / scene brightness, and the scene is lit by
+# the flash plus whatever ambient light the sensor sees, so
+#     1 / (exposure x gain) = a + b x lux
+# is a straight line we can fit. a is the flash's share, b the ambient light's.
+# The prediction is only trusted when there is enough history, the line fits it well and the
+# light level now is inside what the history has seen. Otherwise TakePhoto calibrates as before.
+
+import csv
+import math
+import os
+import sys
+import time
+
+HISTORY_FIELDS = ["time", "lux", "flash", "exposurevalue", "exposuretime", "autogain"]
+
+MIN_POINTS = 6  # calibrations needed before we trust the fit
+MAX_POINTS = 60  # only the latest calibrations, the flash and sheet change over a deployment
+MAX_ERROR = 0.12  # relative rms error of the fit on its own history
+LUX_MARGIN = 1.5  # how far outside the lux range of the history we still extrapolate
+MAX_AGE = 12 * 3600  # meter with the camera at least once a night so the history keeps up
+
+
+def read_ambient_lux():
+    """
+    Lux from the LTR-303 (flash off), same gain and integration time as scripts/readLTR303.py.
+    Returns None when there is no sensor (Mothbox DIY) or it can't be read.
+    """
+    scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+    try:
+        from ltr303 import LTR303
+        sensor = LTR303(bus_num=1)
+        sensor.begin(gain=96, integration_time=400)
+        lux, ch0, ch1 = sensor.read_lux()
+        return float(lux)
+    except Exception as e:  # no smbus2, no sensor on the bus, sensors powered down...
+        print(f"No light sensor reading ({e})")
+        return None
+
+
+class ExposureModel:
+    def __init__(self, history_path):
+        self.history_path = history_path
+        self.rows = self.load()
+
+    def load(self):
+        rows = []
+        try:
+            with open(self.history_path, newline="") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        rows.append({k: float(row[k]) for k in HISTORY_FIELDS})
+                    except (KeyError, TypeError, ValueError):
+                        continue  # half written line from a power cut
+        except FileNotFoundError:
+            pass
+        return rows
+
+    def add(self, lux, flash, exposurevalue, exposuretime, autogain):
+        """Appends one real calibration result to the history"""
+        row = {"time": time.time(), "lux": lux, "flash": int(flash), "exposurevalue": exposurevalue,
+               "exposuretime": exposuretime, "autogain": autogain}
+        self.rows.append({k: float(v) for k, v in row.items()})
+        new = not os.path.exists(self.history_path)
+        try:
+            with open(self.history_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=HISTORY_FIELDS)
+                if new:
+                    writer.writeheader()
+                writer.writerow(row)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"⚠️ Could not save exposure history: {e}")
+
+    def fit(self, flash, exposurevalue):
+        """Least squares line of 1/(exposure x gain) over lux. Returns (a, b, rows) or None"""
+        rows = [r for r in self.rows
+                if r["flash"] == flash and abs(r["exposurevalue"] - exposurevalue) < 1e-6
+                and r["exposuretime"] > 0 and r["autogain"] > 0]
+        rows = rows[-MAX_POINTS:]
+        if len(rows) < MIN_POINTS:
+            return None
+        xs = [r["lux"] for r in rows]
+        ys = [1.0 / (r["exposuretime"] * r["autogain"]) for r in rows]
+        n = len(rows)
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        if sxx == 0:
+            b = 0.0  # every calibration happened in the same light, the flash is all there is
+        else:
+            b = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+        a = mean_y - b * mean_x
+        return a, b, rows
+
+    def predict(self, lux, flash, exposurevalue, exposure_limits, gain_limits):
+        """
+        Returns {"ExposureTime", "AnalogueGain", ...details} when the prediction can be trusted,
+        otherwise None (and prints why).
+        """
+        if lux is None:
+            print("Exposure prediction: no lux reading")
+            return None
+        fitted = self.fit(flash, exposurevalue)
+        if fitted is None:
+            print(f"Exposure prediction: not enough calibration history yet (need {MIN_POINTS})")
+            return None
+        a, b, rows = fitted
+
+        errors = []
+        for r in rows:
+            predicted = a + b * r["lux"]
+            if predicted <= 0:
+                errors.append(1.0)
+            else:
+                actual_total = r["exposuretime"] * r["autogain"]
+                errors.append((1.0 / predicted - actual_total) / actual_total)
+        rms = math.sqrt(sum(e * e for e in errors) / len(errors))
+
+        age = time.time() - rows[-1]["time"]
+        lo = min(r["lux"] for r in rows)
+        hi = max(r["lux"] for r in rows)
+        y = a + b * lux
+        reasons = []
+        if rms > MAX_ERROR:
+            reasons.append(f"fit error {rms:.0%}")
+        if lux > hi * LUX_MARGIN + 0.05 or lux < lo / LUX_MARGIN - 0.05:
+            reasons.append(f"lux {lux:.3f} outside history {lo:.3f}-{hi:.3f}")
+        if y <= 0:
+            reasons.append("fit gives no exposure for this light")
+        if age > MAX_AGE:
+            reasons.append(f"last metered calibration {age / 3600:.1f} h ago")
+        if reasons:
+            print("Exposure prediction not trusted: " + ", ".join(reasons))
+            return None
+
+        # keep the exposure time calibration would have used, and put the rest in gain
+        total = 1.0 / y
+        exposure = sorted(r["exposuretime"] for r in rows)[len(rows) // 2]
+        gain = total / exposure
+        if gain > gain_limits[1]:
+            gain = gain_limits[1]
+            exposure = min(total / gain, exposure_limits[1])
+        gain = min(max(gain, gain_limits[0]), gain_limits[1])
+        prediction = {
+            "ExposureTime": int(exposure),
+            "AnalogueGain": float(gain),
+            "lux": round(lux, 4),
+            "points": len(rows),
+            "error": round(rms, 3),
+        }
+        print(f"Exposure predicted from {lux:.4f} lux: {prediction['ExposureTime']} us  gain {gain:.3f}  "
+              f"({len(rows)} calibrations, {rms:.0%} error)")
+        return prediction
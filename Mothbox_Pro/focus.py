@@ -0,0 +1,208 @@
+# focus.py
+# Decides when the camera needs to autofocus again, from how sharp the photos actually are,
+# instead of recalibrating every AutoCalibrationPeriod seconds while the focus is still fine.
+#
+# sharpness() is the variance of the Laplacian over a downsampled patch in the middle of the frame
+# (the sheet). It is run by the encode workers on the middle exposure of every shot.
+#
+# FocusTracker learns what "sharp" is for the current lens position from the first few shots after
+# an autofocus, then follows it slowly (moths arriving add edges). If a few shots in a row come in
+# well below that baseline, the focus has drifted (temperature, someone bumped the box...) and it asks
+# for a calibration.
+#
+# LensTable remembers where autofocus put the lens at which temperature (the lens focus drifts as
+# the enclosure cools down over the night), so a calibration can often set the lens straight from the
+# table instead of running autofocus_cycle(). Board temperature is the DS18B20 (scripts/BoardTemp_ds18b20.py),
+# boxes without one use the CPU temperature.
+
+import csv
+import glob
+import os
+import time
+
+ROI_SIZE = 2048  # side of the patch in the middle of the frame, in sensor pixels
+ROI_SCALE = 2  # it is downsampled by this before the Laplacian
+
+
+def sharpness(array, fmt):
+    """Variance of the Laplacian of the middle of the frame, higher is sharper"""
+    import cv2
+    if fmt == "YUV420":
+        array = array[: array.shape[0] * 2 // 3]  # the Y plane is all we need
+    h, w = array.shape[:2]
+    side = min(ROI_SIZE, h, w)
+    y0 = (h - side) // 2
+    x0 = (w - side) // 2
+    roi = array[y0:y0 + side, x0:x0 + side]
+    if roi.ndim == 3:
+        roi = roi[:, :, 1]  # green, the sharpest channel of a bayer sensor and the same in RGB or BGR
+    small = cv2.resize(roi, (side // ROI_SCALE, side // ROI_SCALE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(small, cv2.CV_64F).var())
+
+
+def read_board_temp():
+    """DS18B20 temperature in C, None if there is no sensor (same as scripts/BoardTemp_ds18b20.py)"""
+    for device in glob.glob("/sys/bus/w1/devices/28*/w1_slave"):
+        for _ in range(3):
+            try:
+                with open(device) as f:
+                    lines = f.readlines()
+            except OSError:
+                break
+            if len(lines) >= 2 and lines[0].strip().endswith("YES") and "t=" in lines[1]:
+                return float(lines[1].split("t=")[1]) / 1000.0
+            time.sleep(0.2)
+    return None
+
+
+def read_cpu_temp():
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp") as f:
+            return int(f.read()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+class FocusTracker:
+    LEARN_SHOTS = 3  # shots after an autofocus that set the baseline
+    CONFIRM_SHOTS = 2  # blurry shots in a row before we refocus, so one moth on the lens doesn't
+    FOLLOW = 0.1  # how fast the baseline follows sharp shots
+
+    def __init__(self, state, drop=0.7):
+        """state is the dict saved in the focus control file (baseline, samples, low, cached)"""
+        self.baseline = float(state.get("baseline", 0) or 0)
+        self.samples = int(float(state.get("samples", 0) or 0))
+        self.low = int(float(state.get("low", 0) or 0))
+        # the lens was last set from the LensTable, the baseline is still the one from the real autofocus
+        self.cached = int(float(state.get("cached", 0) or 0))
+        self.drop = drop
+
+    def state(self):
+        return {"baseline": round(self.baseline, 3), "samples": self.samples, "low": self.low, "cached": self.cached}
+
+    def reset(self):
+        """After an autofocus the old baseline means nothing"""
+        self.baseline = 0.0
+        self.samples = 0
+        self.low = 0
+        self.cached = 0
+
+    def lens_from_table(self):
+        """
+        The lens was moved to a position from the LensTable. Keep judging against the sharpness the
+        real autofocus gave, so a bad table entry shows up as blurry photos and gets a real autofocus.
+        """
+        self.low = 0
+        self.cached = 1
+
+    def table_failed(self):
+        """Blurry even though the lens came from the table, the next calibration has to really autofocus"""
+        return bool(self.cached) and self.needs_focus()
+
+    def learning(self):
+        return self.samples < self.LEARN_SHOTS
+
+    def record(self, value):
+        """Adds one shot's sharpness. Returns its ratio to the baseline (None while learning)"""
+        if self.learning():
+            self.baseline = (self.baseline * self.samples + value) / (self.samples + 1)
+            self.samples += 1
+            return None
+        self.samples += 1
+        ratio = value / self.baseline if self.baseline > 0 else 1.0
+        if ratio < self.drop:
+            self.low += 1
+        else:
+            self.low = 0
+            self.baseline += self.FOLLOW * (value - self.baseline)
+        return ratio
+
+    def needs_focus(self):
+        return not self.learning() and self.low >= self.CONFIRM_SHOTS
+
+
+class LensTable:
+    """
+    Lens positions found by autofocus, by temperature, in an append-only csv.
+    Rows are either "af" (a real autofocus) or "table" (a calibration that used the table instead),
+    so the file also tells how many autofocus cycles the table saved.
+    """
+    FIELDS = ["time", "source", "board_temp", "cpu_temp", "lens_position"]
+    MIN_POINTS = 3  # real autofocus results before the table is used at all
+    MAX_POINTS = 200
+    BIN = 1.0  # C, autofocus results are grouped per degree
+    BIN_SAMPLES = 5  # latest results per degree that count
+    MAX_GAP = 3.0  # C, furthest apart two known degrees can be to interpolate between them
+    MAX_SPREAD = 0.3  # diopters, a degree whose autofocus results disagree more than this isn't trusted
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = []
+        try:
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        self.rows.append({
+                            "time": float(row["time"]),
+                            "source": row["source"],
+                            "board_temp": float(row["board_temp"]) if row["board_temp"] else None,
+                            "cpu_temp": float(row["cpu_temp"]) if row["cpu_temp"] else None,
+                            "lens_position": float(row["lens_position"]),
+                        })
+                    except (KeyError, TypeError, ValueError):
+                        continue  # half written line from a power cut
+        except FileNotFoundError:
+            pass
+
+    def counts(self):
+        real = sum(1 for r in self.rows if r["source"] == "af")
+        return real, len(self.rows) - real
+
+    def add(self, source, board_temp, cpu_temp, lens_position):
+        row = {"time": time.time(), "source": source, "board_temp": board_temp,
+               "cpu_temp": cpu_temp, "lens_position": float(lens_position)}
+        self.rows.append(row)
+        new = not os.path.exists(self.path)
+        try:
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                if new:
+                    writer.writeheader()
+                writer.writerow({k: ("" if v is None else v) for k, v in row.items()})
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f"⚠️ Could not save lens table: {e}")
+        real, saved = self.counts()
+        print(f"Lens table: {real} autofocus results, {saved} autofocus cycles saved")
+
+    def lookup(self, board_temp, cpu_temp):
+        """Interpolated lens position for these temperatures, or None if the table can't tell"""
+        key, temp = ("board_temp", board_temp) if board_temp is not None else ("cpu_temp", cpu_temp)
+        if temp is None:
+            return None
+        rows = [r for r in self.rows if r["source"] == "af" and r[key] is not None][-self.MAX_POINTS:]
+        if len(rows) < self.MIN_POINTS:
+            return None
+
+        bins = {}
+        for r in rows:
+            bins.setdefault(round(r[key] / self.BIN), []).append(r["lens_position"])
+        known = {}
+        for b, lenses in bins.items():
+            lenses = lenses[-self.BIN_SAMPLES:]
+            if max(lenses) - min(lenses) <= self.MAX_SPREAD:
+                known[b * self.BIN] = sorted(lenses)[len(lenses) // 2]
+
+        below = [t for t in known if t <= temp]
+        above = [t for t in known if t >= temp]
+        if not below or not above:
+            return None  # no extrapolating past what autofocus has seen
+        t0, t1 = max(below), min(above)
+        if t0 == t1 or abs(temp - t0) <= self.BIN / 2:
+            return known[t0]
+        if abs(t1 - temp) <= self.BIN / 2:
+            return known[t1]
+        if t1 - t0 > self.MAX_GAP:
+            return None
+        return known[t0] + (known[t1] - known[t0]) * (temp - t0) / (t1 - t0)
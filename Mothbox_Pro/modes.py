@@ -0,0 +1,43 @@
+# modes.py
+# The mode a Mothbox wakes up in, from the switches on its board (GetConfigSwitches.py writes them
+# to controls/switches.txt). The list of modes and what they do is in Scheduler.py.
+#
+# Scheduler.py decides the mode with this every wake, and scripts/SeasonSimulator.py does the same for
+# the wakes it simulates.
+
+# modes that aren't coded yet run as ACTIVE for now
+NOT_DONE_YET = ("HI_POW", "SWITCHES", "QR_PROG")
+
+
+def mode_from_switches(switches):
+    """The mode the switches ask for, switches being the values from switches.txt (Active, Debug, C1, U1, HI)"""
+    sActive = int(switches.get("Active", 1))
+    sDebug = int(switches.get("Debug", 0))
+    sC1 = int(switches.get("C1", 0))
+    sU1 = int(switches.get("U1", 0))
+    sHI = int(switches.get("HI", 0))
+
+    if sActive == 0:
+        return "OFF"
+    mode = "ACTIVE"
+    if sDebug == 1:
+        mode = "DEBUG"
+    if sDebug == 1 and sC1 == 1:
+        mode = "PARTY"
+    if sDebug == 1 and sU1 == 1:
+        mode = "QR_PROG"
+    if sDebug == 0 and sU1 == 1:
+        mode = "SWITCHES"
+    if sDebug == 0 and sHI == 1:
+        mode = "HI_POW"
+    return mode
+
+
+def running_mode(mode):
+    """The mode the Mothbox actually runs in, ACTIVE for the ones that aren't done yet"""
+    return "ACTIVE" if mode in NOT_DONE_YET else mode
+
+
+def shuts_down(mode, runtime):
+    """Whether the session ends with the shutdown timer, runtime in minutes (0 runs until it's turned off)"""
+    return runtime > 0 and mode != "DEBUG"
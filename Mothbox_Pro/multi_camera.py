@@ -0,0 +1,82 @@
+# multi_camera.py
+# Takes the same photo with several cameras at once (a Pi 5 has two CSI ports), under one flash.
+#
+# Every camera captures in its own thread and hands its frames to its own EncodePipeline, so one
+# camera's encoding never holds up another's capture. The flash goes on once, every thread asks its
+# camera for the next frame that starts after that (capture_request(flush=True)), and the flash goes
+# off when the last camera has its frame. The sensors aren't hardware synchronised, so how far apart
+# the frames really were (skew, from their SensorTimestamps) is measured for every shot.
+#
+# The frames of one shot are saved as <name>_<timestamp>_HDR<i>_cam<n>.jpg so they pair up.
+
+import threading
+import time
+
+from photo_pipeline import with_suffix
+
+# Two 64MP streams at full size crash a Pi 5 (see scripts/TakePhoto_Stereo_HDR.py in Mothbox_DIY),
+# so with more than one camera each one runs at half that
+MULTI_CAMERA_SIZE = (4624, 3472)
+
+
+def camera_count():
+    """How many cameras libcamera can see"""
+    from picamera2 import Picamera2
+    return len(Picamera2.global_camera_info())
+
+
+def camera_filepath(filepath, cam):
+    return with_suffix(filepath, f"_cam{cam}")
+
+
+class CameraRig:
+    def __init__(self, cameras, flash):
+        self.cameras = cameras
+        self.flash = flash
+
+    def capture(self, exposure_us, on_frame):
+        """
+        Captures one frame from every camera under a single flash pulse.
+        on_frame(cam, request) is called from that camera's thread as soon as the flash is off.
+        Returns {"skew_ms", "lit_ms", "capture_s"}.
+        """
+        n = len(self.cameras)
+        self.flash.prepare()
+        captured = threading.Barrier(n + 1)
+        timestamps = [None] * n
+        errors = []
+
+        def run(cam):
+            request = None
+            try:
+                request = self.cameras[cam].capture_request(flush=True)
+                timestamps[cam] = request.get_metadata().get("SensorTimestamp")
+            except Exception as e:
+                errors.append(f"camera {cam}: {e}")
+            try:
+                captured.wait()  # everyone has a frame, the flash can go off
+            except threading.BrokenBarrierError:
+                pass
+            if request is not None:
+                on_frame(cam, request)
+
+        start = time.time()
+        self.flash.on()
+        threads = [threading.Thread(target=run, args=(cam,), name=f"camera{cam}") for cam in range(n)]
+        for t in threads:
+            t.start()
+        try:
+            captured.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            errors.append("a camera didn't deliver a frame in time")
+        lit = self.flash.off()
+        capture_s = time.time() - start
+        self.flash.record(lit, exposure_us)
+        for t in threads:
+            t.join()
+        for e in errors:
+            print(f"⚠️ Capture failed on {e}")
+
+        stamps = [ts for ts in timestamps if ts]
+        skew_ms = round((max(stamps) - min(stamps)) / 1e6, 2) if len(stamps) > 1 else None
+        return {"skew_ms": skew_ms, "lit_ms": round(lit * 1000, 2), "capture_s": round(capture_s, 3)}
@@ -0,0 +1,204 @@
+# raw_spool.py
+# Puts off encoding photos until the attractor lights are off, or the box is on external power.
+#
+# With SpoolFrames on, the encode workers copy each full size frame as it came from the camera (RGB or YUV)
+# into a slot of one big preallocated file (spool.raw) instead of encoding it, which is far less CPU
+# (and battery) while the lights are burning. A SpoolCompressor encodes the spooled frames later, oldest
+# first, through a normal EncodePipeline (so they get their previews too) and frees their slots.
+#
+# The index (spool.raw.index) is a journal of one json line per event:
+#   {"op": "put", "seq", "slot", "file", "format", "shape", "size", "save", "time"}   a frame is in a slot
+#   {"op": "done", "seq"}                                                    it has been encoded
+# A frame's pixels are fsynced before its "put" line is written, and the "done" line only after its
+# photo is on disk, so after a power cut every frame is either in the spool or saved (maybe twice).
+# When nothing is pending the journal is started over.
+#
+# If the spool is full the frame is just encoded right away like before.
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+PAGE = 4096
+
+
+class RawSpool:
+    def __init__(self, path, size_bytes, slot_bytes):
+        self.path = str(path)
+        self.index_path = self.path + ".index"
+        self.lock = threading.Lock()
+        self.pending_entries = {}
+        self.seq = 0
+        requested = -(-int(slot_bytes) // PAGE) * PAGE
+        self.slot_bytes = requested
+        self.load_index()
+        if not self.pending_entries:
+            # nothing is laid out with the journal's slot size, the frames may be bigger now
+            # (another CaptureFormat, resolution or camera)
+            self.slot_bytes = requested
+        self.slots = max(1, int(size_bytes) // self.slot_bytes)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if os.fstat(self.fd).st_size < self.slots * self.slot_bytes:
+                os.posix_fallocate(self.fd, 0, self.slots * self.slot_bytes)
+        except OSError as e:
+            print(f"⚠️ Could not preallocate the spool: {e}")
+            self.slots = max(len(self.pending_entries), os.fstat(self.fd).st_size // self.slot_bytes)
+        used = {e["slot"] for e in self.pending_entries.values()}
+        self.free = [n for n in range(self.slots) if n not in used]
+        if not self.pending_entries:
+            self.start_index(requested)
+
+    def load_index(self):
+        """Replays the journal, whatever has a "put" but no "done" is still waiting to be encoded"""
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # half written line from a power cut
+                    if event.get("op") == "init":
+                        self.slot_bytes = int(event["slot_bytes"])  # the pending frames are laid out with this
+                    elif event.get("op") == "put":
+                        self.pending_entries[event["seq"]] = event
+                    elif event.get("op") == "done":
+                        self.pending_entries.pop(event.get("seq"), None)
+                    self.seq = max(self.seq, int(event.get("seq", 0)))
+        except FileNotFoundError:
+            pass
+        if self.pending_entries:
+            print(f"Spool: {len(self.pending_entries)} frames from before are waiting to be encoded")
+
+    def start_index(self, slot_bytes=None):
+        if slot_bytes:
+            self.slot_bytes = slot_bytes
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps({"op": "init", "slot_bytes": self.slot_bytes}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def journal(self, event):
+        with open(self.index_path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def put(self, array, fmt, filepath, save_kwargs, size=None):
+        """
+        Copies a frame into a free slot. Returns False if it doesn't fit (spool full or frame too big).
+        size is the photo's (width, height), a YUV420 array can be wider than the photo.
+        """
+        array = np.ascontiguousarray(array)
+        if array.nbytes > self.slot_bytes:
+            return False
+        with self.lock:
+            if not self.free:
+                return False
+            slot = self.free.pop(0)
+            self.seq += 1
+            seq = self.seq
+        try:
+            data = memoryview(array).cast("B")
+            offset = slot * self.slot_bytes
+            written = 0
+            while written < len(data):
+                written += os.pwrite(self.fd, data[written:], offset + written)
+            os.fdatasync(self.fd)
+            save = dict(save_kwargs)
+            if save.get("exif"):
+                save["exif"] = save["exif"].hex()
+            event = {"op": "put", "seq": seq, "slot": slot, "file": filepath, "format": fmt,
+                     "shape": list(array.shape), "size": list(size) if size else None, "save": save,
+                     "time": time.time()}
+            with self.lock:
+                self.journal(event)
+                self.pending_entries[seq] = event
+        except Exception:
+            with self.lock:
+                self.free.append(slot)
+            raise
+        return True
+
+    def pending(self):
+        """Spooled frames, oldest first"""
+        with self.lock:
+            return [self.pending_entries[k] for k in sorted(self.pending_entries)]
+
+    def frame(self, entry):
+        """The spooled pixels as an (array, format, save_kwargs), read straight from the spool file"""
+        array = np.memmap(self.path, dtype=np.uint8, mode="r", offset=entry["slot"] * self.slot_bytes,
+                          shape=tuple(entry["shape"]))
+        save = dict(entry["save"])
+        if save.get("exif"):
+            save["exif"] = bytes.fromhex(save["exif"])
+        return array, entry["format"], save
+
+    def done(self, entry):
+        with self.lock:
+            self.journal({"op": "done", "seq": entry["seq"]})
+            self.pending_entries.pop(entry["seq"], None)
+            self.free.append(entry["slot"])
+            if not self.pending_entries:
+                self.start_index()
+
+    def backlog(self):
+        """How far behind the compressor is"""
+        entries = self.pending()
+        return {
+            "pending": len(entries),
+            "free_slots": len(self.free),
+            "pending_gb": round(sum(int(np.prod(e["shape"])) for e in entries) / 1024**3, 2),
+            "oldest_s": round(time.time() - entries[0]["time"], 1) if entries else 0,
+        }
+
+
+class SpoolCompressor:
+    def __init__(self, spool, pipeline):
+        """pipeline is an EncodePipeline of its own, so it never waits behind the camera's frames"""
+        self.spool = spool
+        self.pipeline = pipeline
+
+    def drain(self, keep_going=lambda: True):
+        """
+        Encodes spooled frames oldest first for as long as keep_going() says so.
+        Returns one dict per encoded frame (file, spooled_s, encode_s).
+        """
+        from photo_pipeline import ArrayFrame
+        encoded = []
+        for entry in self.spool.pending():
+            if not keep_going():
+                break
+            array, fmt, save_kwargs = self.spool.frame(entry)
+            errors_before = len(self.pipeline.errors)
+            t0 = time.time()
+            self.pipeline.submit(ArrayFrame(array, fmt, entry.get("size")), entry["file"], save_kwargs)
+            self.pipeline.wait()
+            array = None
+            if any(f == entry["file"] for f, _ in self.pipeline.errors[errors_before:]):
+                print(f"⚠️ Could not encode spooled {entry['file']}, leaving it in the spool")
+                break
+            self.spool.done(entry)
+            encoded.append({"file": entry["file"], "spooled_s": round(t0 - entry["time"], 1),
+                            "encode_s": round(time.time() - t0, 3)})
+        return encoded
+
+
+def external_power(min_volts):
+    """
+    True if the INA219 on the Vin line (scripts/read_Vin.py) reads at least min_volts, which only a
+    power supply gets to (pick it above your battery's full voltage). None if there is no INA219.
+    """
+    try:
+        import smbus2
+        with smbus2.SMBus(1) as bus:
+            raw = bus.read_word_data(0x40, 0x02)  # bus voltage register
+        raw = ((raw & 0xFF) << 8) | (raw >> 8)
+        return (raw >> 3) * 0.004 >= min_volts
+    except Exception:
+        return None
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+"""
+CaptureFormatBenchmark - compares capturing RGB888 frames with capturing YUV420 frames (CaptureFormat)
+
+For both formats it saves a few photos through the EncodePipeline the way TakePhoto does
+(zero copy camera buffers, previews on) and reports
+ buffer MB    - one camera buffer in that format
+ peak MB      - peak memory (RSS) while the photos are saved: the camera buffers plus what the
+                encoders and previews need on top of them
+ s/frame      - from handing the frame to the pipeline until its photo and previews are on disk
+ encode s     - of that, the time spent encoding the full size JPEG
+
+It runs at the pi4 (9000x6000) and the pi5 (9248x6944) resolution.
+No camera is needed, a fake camera with a fixed pool of buffers (like libcamera's buffer_count)
+hands out frames of the real size, YUV420 ones with their rows padded to a 64 byte stride like
+the camera's. Every case runs in its own python process, and memory is sampled from /proc while the
+photos are saved, so making the fake frames doesn't count.
+
+Usage
+ python CaptureFormatBenchmark.py                both resolutions, JpegEncoder 1 (turbo)
+ python CaptureFormatBenchmark.py --encoder 2    another JpegEncoder (0 pil  1 turbo  2 yuv)
+ python CaptureFormatBenchmark.py --small        quarter resolutions, for a quick try on a laptop
+"""
+
+import os
+import sys
+import json
+import queue
+import subprocess
+import threading
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+FRAMES = 4
+STRIDE_ALIGN = 64
+
+
+def sheet(width, height):
+    """A BGR frame that looks a bit like a night on the sheet: bright sheet, dark edges, some insects"""
+    import cv2
+    import numpy as np
+    rng = np.random.default_rng(1)
+    small = np.full((height // 16, width // 16, 3), 25, dtype=np.uint8)
+    h, w = small.shape[:2]
+    small[h // 8:h * 7 // 8, w // 6:w * 5 // 6] = (205, 215, 220)
+    for _ in range(40):
+        y, x = rng.integers(h // 8, h * 7 // 8), rng.integers(w // 6, w * 5 // 6)
+        cv2.ellipse(small, (int(x), int(y)), (int(rng.integers(3, 12)), int(rng.integers(2, 6))),
+                    float(rng.integers(0, 180)), 0, 360, tuple(int(c) for c in rng.integers(20, 120, 3)), -1)
+    frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    noise = rng.integers(0, 6, (height, width // 4, 3), dtype=np.uint8)
+    frame[:, :noise.shape[1] * 4] += np.repeat(noise, 4, axis=1)  # sensor noise, so it doesn't compress unrealistically well
+    return frame
+
+
+def to_yuv420(frame):
+    """Full range I420 planes of a BGR frame, in a (h*3/2, stride) buffer like picamera2 gives"""
+    import numpy as np
+    from encoders import rgb_to_planes
+    y, u, v = rgb_to_planes(frame, "RGB888")
+    h, w = y.shape
+    stride = -(-w // STRIDE_ALIGN) * STRIDE_ALIGN
+    buf = np.zeros((h * 3 // 2, stride), dtype=np.uint8)
+    buf[:h, :w] = y
+    chroma = buf[h:].reshape(2, h // 2, stride // 2)
+    chroma[0, :, :w // 2] = u
+    chroma[1, :, :w // 2] = v
+    return buf
+
+
+class FakeCamera:
+    """A pool of buffer_count frame buffers in the capture format, all holding the same sheet"""
+    def __init__(self, width, height, fmt, buffer_count):
+        frame = sheet(width, height)
+        if fmt == "YUV420":
+            frame = to_yuv420(frame)
+        self.size = (width, height)
+        self.format = fmt
+        self.free = queue.Queue()
+        for n in range(buffer_count):
+            self.free.put(frame.copy())  # copies touch every page, so they count towards RSS
+        self.buffer_mb = frame.nbytes / 1024**2
+
+    def capture(self):
+        return FakeFrame(self, self.free.get())
+
+
+class FakeFrame:
+    def __init__(self, camera, buf):
+        self.camera = camera
+        self.buf = buf
+        self.format = camera.format
+        self.size = camera.size
+
+    @contextmanager
+    def view(self):
+        yield self.buf
+
+    def release(self):
+        if self.buf is not None:
+            self.camera.free.put(self.buf)
+            self.buf = None
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+class PeakSampler:
+    """Highest RSS seen while it runs"""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = rss_mb()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, rss_mb())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return self.peak
+
+
+def run_case(fmt, width, height, encoder, outdir):
+    from photo_pipeline import EncodePipeline, PREVIEW_WIDTHS
+
+    workers, depth = 2, 1
+    camera = FakeCamera(width, height, fmt, workers + depth + 1)
+    pipeline = EncodePipeline(workers=workers, depth=depth, encoder=encoder, previews=PREVIEW_WIDTHS)
+    sampler = PeakSampler()
+    start = time.time()
+    for i in range(FRAMES):
+        pipeline.submit(camera.capture(), os.path.join(outdir, f"{fmt}_{i}.jpg"), {"quality": 96})
+    pipeline.close()
+    seconds = time.time() - start
+    peak = sampler.stop()
+    frames = pipeline.results()
+    return {
+        "format": fmt, "width": width, "height": height,
+        "buffer_mb": round(camera.buffer_mb, 1),
+        "peak_rss_mb": round(peak, 1),
+        "s_per_frame": round(seconds / FRAMES, 3),
+        "encode_s": round(sum(f["encode_s"] for f in frames) / max(1, len(frames)), 3),
+        "kb": round(sum(f["bytes"] for f in frames) / max(1, len(frames)) / 1024),
+        "errors": len(pipeline.errors),
+    }
+
+
+def main():
+    if "--child" in sys.argv:
+        args = json.loads(sys.argv[sys.argv.index("--child") + 1])
+        with tempfile.TemporaryDirectory() as outdir:
+            print(json.dumps(run_case(outdir=outdir, **args)))
+        return
+
+    encoder = int(sys.argv[sys.argv.index("--encoder") + 1]) if "--encoder" in sys.argv else 1
+    resolutions = {"pi4": (9000, 6000), "pi5": (9248, 6944)}
+    if "--small" in sys.argv:
+        resolutions = {name: (w // 4, h // 4) for name, (w, h) in resolutions.items()}
+
+    print(f"{FRAMES} photos per case, JpegEncoder {encoder}, previews on")
+    print(f"{'':>4} {'size':>10} {'format':>7} {'buffer MB':>9} {'peak MB':>8} {'s/frame':>8} {'encode s':>8} {'KB':>6}")
+    for name, (width, height) in resolutions.items():
+        for fmt in ("RGB888", "YUV420"):
+            args = {"fmt": fmt, "width": width, "height": height, "encoder": encoder}
+            out = subprocess.run([sys.executable, __file__, "--child", json.dumps(args)],
+                                 capture_output=True, text=True)
+            lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+            if not lines:
+                print(f"{name:>4} {fmt:>7} failed: {out.stderr.strip()[-200:]}")
+                continue
+            r = json.loads(lines[-1])
+            size = f"{width}x{height}"
+            print(f"{name:>4} {size:>10} {r['format']:>7} {r['buffer_mb']:>9} {r['peak_rss_mb']:>8} "
+                  f"{r['s_per_frame']:>8} {r['encode_s']:>8} {r['kb']:>6}" + (f"  {r['errors']} errors" if r["errors"] else ""))
+
+
+if __name__ == "__main__":
+    main()
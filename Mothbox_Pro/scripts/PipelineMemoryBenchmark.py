@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+"""
+PipelineMemoryBenchmark - shows how peak memory (RSS) grows while saving an HDR bracket
+
+It compares
+ copy      - the old way: every frame is turned into a PIL image and they are all kept until the bracket is saved
+ zerocopy  - the camera buffers go straight to the EncodePipeline and are given back as soon as they are encoded
+
+No camera is needed, a fake camera with a fixed pool of buffers (like libcamera's buffer_count)
+hands out frames of the real size. Every case runs in its own python process because
+peak RSS can only go up inside a process.
+
+Usage
+ python PipelineMemoryBenchmark.py                 pi5 resolution, brackets of 1 3 5
+ python PipelineMemoryBenchmark.py --pi4           pi4 resolution
+ python PipelineMemoryBenchmark.py --small         quarter resolution, for a quick try on a laptop
+"""
+
+import os
+import sys
+import json
+import queue
+import resource
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class FakeCamera:
+    """A pool of preallocated frame buffers, the same way the camera only has buffer_count of them"""
+    def __init__(self, width, height, buffer_count):
+        import numpy as np
+        self.free = queue.Queue()
+        for n in range(buffer_count):
+            buf = np.empty((height, width, 3), dtype=np.uint8)
+            buf[:] = (n * 40) % 255  # touch every page so it counts towards RSS
+            self.free.put(buf)
+
+    def capture(self):
+        return FakeFrame(self, self.free.get())
+
+
+class FakeFrame:
+    format = "RGB888"
+
+    def __init__(self, camera, buf):
+        self.camera = camera
+        self.buf = buf
+        self.size = (buf.shape[1], buf.shape[0])
+
+    @contextmanager
+    def view(self):
+        yield self.buf
+
+    def make_image(self):
+        from PIL import Image
+        return Image.frombuffer("RGB", self.size, self.buf, "raw", "BGR", 0, 1).copy()
+
+    def release(self):
+        if self.buf is not None:
+            self.camera.free.put(self.buf)
+            self.buf = None
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # linux reports kB
+
+
+def run_case(mode, width, height, bracket, workers, depth, outdir):
+    from photo_pipeline import EncodePipeline
+
+    start = time.time()
+    pipeline = EncodePipeline(workers=workers, depth=depth)
+    if mode == "zerocopy":
+        camera = FakeCamera(width, height, workers + depth + 1)
+        base = peak_rss_mb()
+        for i in range(bracket):
+            pipeline.submit(camera.capture(), os.path.join(outdir, f"z{i}.jpg"), {"quality": 96})
+    else:
+        camera = FakeCamera(width, height, 1)
+        base = peak_rss_mb()
+        images = []
+        for i in range(bracket):
+            frame = camera.capture()
+            images.append(frame.make_image())
+            frame.release()
+        for i, img in enumerate(images):
+            pipeline.submit(img, os.path.join(outdir, f"c{i}.jpg"), {"quality": 96})
+        images = None
+    pipeline.close()
+    return {
+        "mode": mode, "bracket": bracket, "workers": workers, "depth": depth,
+        "camera_buffers_mb": round(base, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "seconds": round(time.time() - start, 2),
+    }
+
+
+def main():
+    if "--child" in sys.argv:
+        args = json.loads(sys.argv[sys.argv.index("--child") + 1])
+        with tempfile.TemporaryDirectory() as outdir:
+            print(json.dumps(run_case(outdir=outdir, **args)))
+        return
+
+    width, height = 9248, 6944
+    if "--pi4" in sys.argv:
+        width, height = 9000, 6000
+    if "--small" in sys.argv:
+        width, height = width // 4, height // 4
+
+    print(f"Frames are {width}x{height} RGB888 ({width * height * 3 / 1024**2:.0f} MB each)")
+    print(f"{'mode':>9} {'bracket':>7} {'workers':>7} {'depth':>5} {'peak MB':>8} {'seconds':>8}")
+    for bracket in (1, 3, 5):
+        for mode, workers, depth in (("copy", 2, 1), ("zerocopy", 1, 1), ("zerocopy", 2, 1)):
+            args = {"mode": mode, "width": width, "height": height,
+                    "bracket": bracket, "workers": workers, "depth": depth}
+            out = subprocess.run([sys.executable, __file__, "--child", json.dumps(args)],
+                                 capture_output=True, text=True)
+            lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+            if not lines:
+                print(f"{mode:>9} {bracket:>7} failed: {out.stderr.strip()[-200:]}")
+                continue
+            r = json.loads(lines[-1])
+            print(f"{r['mode']:>9} {r['bracket']:>7} {r['workers']:>7} {r['depth']:>5} {r['peak_rss_mb']:>8} {r['seconds']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/python3
+
+"""
+SeasonSimulator - plays a mothbox_settings.csv out over a whole deployment on a virtual clock
+
+Every wake of the season goes through the same code the Mothbox decides it with, on a clock that
+jumps from one event to the next instead of waiting:
+ mode       - modes.py, from the switches given with --switches (Active=1 by default)
+ standby    - an ACTIVE wake outside of a session goes back to sleep (WakeSchedule.in_session)
+ energy     - energy_planner.py picks every session's level from the battery reading at the wake and
+              its own history, session_limits() turns that into the runtime and the attractor time
+ photos     - a trigger every --photo-every seconds, only every capture_every-th one takes a photo
+              (energy_planner.skips, like CaptureDaemon and TakePhoto), and none below the safety floor of free space (check_storage)
+ storage    - storage_planner.py picks every photo's quality and RedundantFrames policy
+ shutdown   - the session ends after its runtime, the next wake is WakeSchedule.next_wake() from then
+Nothing from the Pi is needed. The battery is bat_Wh that the Pi, the lights and the flash take from
+(and --solar-wh puts back in the daytime), the SD card is a number of free bytes, and a photo is a
+size around --photo-mb. The energy and storage histories go to a temporary folder.
+
+At the end it prints the wakes, the energy, how the battery and the card went, and the scheduled
+sessions that were missed and why:
+ battery empty  - the battery was flat, the Mothbox boots again once the sun brings it back up
+ still awake    - the session before hadn't shut down yet (a runtime as long as the gap between starts)
+ switched off   - the Active switch is off
+ card full      - it woke up, but every photo of the session was lost to a full card
+Not simulated: the backups to a USB drive (Backup_Files.py), and TakePhoto still saving every 10th
+redundant photo in a row in full.
+
+Options (default)
+ --settings        mothbox_settings.csv (the Pi's, or the one in this tree's mothbox_custom folder)
+ --start           the day it is switched on, at noon (today)       --days  how long (90)
+ --deployment-end  instead of the settings' deployment_end
+ --switches        like Active=1,Debug=0,C1=0,U1=0,HI=0 (all default)
+ --start-percent   charge at the start (100)        --solar-wh  a day's solar charge, 7 to 17 h (0)
+ --pi-w            the Pi awake (4.5)   --attract-w  the attractor lights (6)   --off-w  shut down (0.05)
+ --photo-j         flash and saving, per photo (30)
+ --boot-s          waking up until the session starts (60)    --shutdown-s  (20)
+ --photo-every     seconds between triggers (60)
+ --photo-mb        a photo at quality 96 (14)    --novel  part of the photos that show something new (1)
+ --redundant       RedundantFrames (0)           --storage-planning  StoragePlanning (1)
+ --free-gb         free space at the start (100) --safety-gb  safetygb (9)
+ --utc             UTC offset, when the settings' timezone isn't known (0)
+ --revive-percent  charge a flat battery needs to boot again (10)
+ --seed            (1)      --csv  also write every wake to this csv
+
+Usage
+ python SeasonSimulator.py                                  90 days of the settings in this tree
+ python SeasonSimulator.py --settings my_settings.csv --start 2026-11-01 --days 120
+ python SeasonSimulator.py --deployment-end 2027-01-31 --solar-wh 40 --csv season.csv
+ python SeasonSimulator.py --switches Active=1,Debug=1        what DEBUG mode would do
+"""
+
+import os
+import sys
+import csv
+import time
+import random
+import datetime
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from wake_schedule import WakeSchedule  # noqa: E402
+from energy_planner import EnergyPlanner, parse_end, session_limits, skips  # noqa: E402
+from storage_planner import StoragePlanner, minutes_left_tonight, QUALITY_FACTOR, POLICY_FACTOR  # noqa: E402
+from modes import mode_from_switches, running_mode, shuts_down  # noqa: E402
+
+SETTINGS = "/boot/firmware/mothbox_custom/mothbox_settings.csv"
+OPTIONS = {
+    "settings": None, "start": None, "days": 90, "deployment-end": None, "switches": "",
+    "start-percent": 100.0, "solar-wh": 0.0, "pi-w": 4.5, "attract-w": 6.0, "off-w": 0.05,
+    "photo-j": 30.0, "boot-s": 60, "shutdown-s": 20, "photo-every": 60, "photo-mb": 14.0,
+    "novel": 1.0, "redundant": 0, "storage-planning": 1, "free-gb": 100.0, "safety-gb": 9,
+    "utc": 0.0, "revive-percent": 10.0, "seed": 1, "csv": None,
+}
+SUN = (7, 17)  # hours the solar panel charges, local time
+GB = 1024**3
+WAKE_FIELDS = ["time", "reason", "mode", "level", "runtime", "attract_min", "triggers", "photos",
+               "skipped_energy", "lost_storage", "saved_gb", "percent_start", "percent_end", "free_gb"]
+
+
+def option(name):
+    default = OPTIONS[name]
+    flag = "--" + name
+    if flag not in sys.argv:
+        return default
+    value = sys.argv[sys.argv.index(flag) + 1]
+    if default is None or isinstance(default, str):
+        return value
+    return type(default)(float(value)) if isinstance(default, int) else type(default)(value)
+
+
+def default_settings_path():
+    """The Pi's settings, or on another computer the mothbox_custom ones next to this tree"""
+    if os.path.exists(SETTINGS):
+        return SETTINGS
+    tree = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    kind = os.path.basename(tree).split("_", 1)[-1]
+    return os.path.join(os.path.dirname(tree), f"mothbox_custom_{kind}", "mothbox_settings.csv")
+
+
+def load_settings(path):
+    """SETTING -> VALUE of a mothbox_settings.csv, stripped"""
+    with open(path, newline="") as f:
+        return {row["SETTING"].strip(): (row["VALUE"] or "").strip() for row in csv.DictReader(f)}
+
+
+class Battery:
+    def __init__(self, wh, percent, solar_wh, wake):
+        self.wh = wh
+        self.charge = wh * percent / 100
+        self.solar_wh = solar_wh
+        self.wake = wake  # for the local time of the sun
+        self.used = Counter()
+        self.solar = 0.0
+        self.lowest = (self.percent, None)
+
+    @property
+    def percent(self):
+        return 100 * self.charge / self.wh
+
+    def sun(self, t0, t1):
+        """Wh the solar panel gives from t0 until t1"""
+        if self.solar_wh <= 0 or t1 <= t0:
+            return 0.0
+        seconds = 0.0
+        day = self.wake.local_date(t0)
+        while True:
+            up = self.wake.to_epoch(datetime.datetime.combine(day, datetime.time(SUN[0])))
+            if up >= t1:
+                break
+            down = self.wake.to_epoch(datetime.datetime.combine(day, datetime.time(SUN[1])))
+            seconds += max(0, min(t1, down) - max(t0, up))
+            day += datetime.timedelta(days=1)
+        return self.solar_wh * seconds / ((SUN[1] - SUN[0]) * 3600)
+
+    def use(self, t0, t1, **watts):
+        """Runs the loads (in W) from t0 until t1, False if the battery went flat"""
+        gained = self.sun(t0, t1)
+        spent = 0.0
+        for load, w in watts.items():
+            self.used[load] += w * (t1 - t0) / 3600
+            spent += w * (t1 - t0) / 3600
+        self.solar += gained
+        self.charge = min(self.wh, self.charge + gained - spent)
+        if self.percent < self.lowest[0]:
+            self.lowest = (max(self.percent, 0.0), t1)
+        if self.charge <= 0:
+            self.charge = 0.0
+            return False
+        return True
+
+    def spend(self, load, wh):
+        self.used[load] += wh
+        self.charge = max(0.0, self.charge - wh)
+        return self.charge > 0
+
+    def reading(self, v20, v80, watts):
+        """What read_Vin.py would say: the voltage of this charge (charge_percent backwards) and the current"""
+        voltage = v20 + (self.percent - 20) * (v80 - v20) / (80 - 20)
+        return round(voltage, 3), round(watts / voltage, 3)
+
+
+class Season:
+    def __init__(self, settings, start, days, history):
+        self.o = {name: option(name) for name in OPTIONS}
+        self.start = start
+        self.end = start + days * 86400
+        self.rng = random.Random(self.o["seed"])
+        self.switches = dict(kv.split("=", 1) for kv in self.o["switches"].split(",") if "=" in kv)
+        self.runtime = int(float(settings.get("runtime", 0) or 0))
+        self.wake = WakeSchedule(settings["minute"], settings["hour"], settings["weekday"], self.runtime,
+                                 utc_offset=self.o["utc"], timezone=settings.get("timezone"), now=start)
+        self.bat_wh = float(settings.get("bat_Wh", 10))
+        self.v80 = float(settings.get("bat_80perVolts", 12.0))
+        self.v20 = float(settings.get("bat_20perVolts", 10.5))
+        self.end_date = parse_end(self.o["deployment-end"] or settings.get("deployment_end"))
+        self.battery = Battery(self.bat_wh, self.o["start-percent"], self.o["solar-wh"], self.wake)
+        self.energy = EnergyPlanner(os.path.join(history, "energy.csv"))
+        self.storage = StoragePlanner(os.path.join(history, "storage_plan.csv"))
+        self.free = self.o["free-gb"] * GB
+        self.reserve = (self.o["safety-gb"] - 1) * GB  # like TakePhoto, a GB under safetygb
+        self.card_full = None
+        self.rows = []
+        self.awake = []  # (from, until) the Pi was on
+        self.flat = []  # (from, until) the battery was empty
+        self.ran = set()  # session starts that had an ACTIVE wake
+        self.lost = set()  # session starts where every photo was lost to a full card
+        self.switched_off = set()  # session starts it woke up for in OFF
+        self.levels = Counter()
+        self.qualities = Counter()
+        self.cut_minutes = 0
+
+    def run(self):
+        t, reason = self.start, "power on"
+        while t < self.end:
+            off, alarm = self.wake_up(t, reason)
+            if alarm is None:
+                t, reason = self.revive(off), "power on"
+                continue
+            if not self.battery.use(off, alarm, off=self.o["off-w"]):
+                t, reason = self.revive(alarm), "power on"
+                continue
+            t, reason = alarm, "alarm"
+
+    def wake_up(self, t, reason):
+        """One wake from t until shut down: (the time it was off, the wake alarm, None when it went flat)"""
+        o = self.o
+        row = dict.fromkeys(WAKE_FIELDS, 0)
+        row.update(time=t, reason=reason, percent_start=round(self.battery.percent, 1))
+        self.rows.append(row)
+        now = t + o["boot-s"]
+        if not self.battery.use(t, now, pi=o["pi-w"]):
+            return self.went_flat(t, now, row)
+
+        mode = running_mode(mode_from_switches(self.switches))
+        session = self.wake.in_session(now)
+        if mode == "ACTIVE" and session is None:
+            mode = "STANDBY"
+        row["mode"] = mode
+        if mode == "OFF" and session is not None:
+            self.switched_off.add(session)
+        plan = None
+        if mode != "OFF":
+            # the startup diagnostics read the battery, the energy task plans with it (like Scheduler.py)
+            reading = self.battery.reading(self.v20, self.v80, o["pi-w"])
+            plan = self.energy.plan(reading, self.bat_wh, self.v20, self.v80,
+                                    self.wake.minutes_per_day(now), self.end_date, now)
+            if mode != "ACTIVE":
+                plan.update(level=0, factor=1.0, attract_duty=1.0, capture_every=1, runtime=1.0)
+            self.energy.record(plan, mode, now)
+            row["level"] = plan["level"]
+
+        stop = now
+        if mode not in ("OFF", "STANDBY"):
+            minutes, attract_minutes, _ = session_limits(self.runtime, plan, now)
+            stop = now + minutes * 60 if shuts_down(mode, self.runtime) else self.end
+            lights_off = stop if attract_minutes is None else now + attract_minutes * 60
+            if mode == "DEBUG":
+                lights_off = now  # the lights are off by default in DEBUG
+            row.update(runtime=minutes, attract_min=round((min(lights_off, stop) - now) / 60, 1))
+            if mode == "ACTIVE":
+                self.ran.add(session)
+                self.levels[plan["level"]] += 1
+                self.cut_minutes += self.runtime - minutes
+            if not self.session(now, stop, lights_off, mode == "ACTIVE", plan, row):
+                return self.went_flat(t, self.flat_at, row)
+            if mode == "ACTIVE" and row["lost_storage"] and not row["photos"]:
+                self.lost.add(session)
+
+        off = min(stop, self.end) + o["shutdown-s"]
+        if not self.battery.use(stop, off, pi=o["pi-w"]):
+            return self.went_flat(t, off, row)
+        self.awake.append((t, off))
+        row.update(percent_end=round(self.battery.percent, 1), free_gb=round(self.free / GB, 1))
+        return off, self.wake.next_wake(off)
+
+    def session(self, now, stop, lights_off, photos, plan, row):
+        """Runs the session from now until stop, False if the battery went flat in it"""
+        o = self.o
+        every = o["photo-every"]
+        trigger = (now // every + 1) * every  # cron triggers on the clock, not from the wake
+        triggers = 0
+        t0 = now
+        while t0 < stop:
+            if photos and t0 >= trigger:
+                triggers += 1
+                self.shoot(t0, plan, triggers, row)
+                trigger += every
+            t1 = min(stop, t0 + 3600)
+            if photos:
+                t1 = min(t1, trigger)
+            if t0 < lights_off:
+                t1 = min(t1, lights_off)
+            lights = o["attract-w"] if t0 < lights_off else 0.0
+            if not self.battery.use(t0, t1, pi=o["pi-w"], lights=lights):
+                self.flat_at = t1
+                return False
+            t0 = t1
+        return True
+
+    def shoot(self, t, plan, triggers, row):
+        """One photo trigger of CaptureDaemon's"""
+        row["triggers"] += 1
+        if skips(triggers, plan["capture_every"]):
+            row["skipped_energy"] += 1
+            return
+        if self.free < self.reserve:
+            row["lost_storage"] += 1
+            if self.card_full is None:
+                self.card_full = t
+            return
+        storage = None
+        if self.o["storage-planning"]:
+            storage = self.storage.plan(self.free, self.reserve, minutes_left_tonight(self.wake, t),
+                                        self.o["redundant"])
+        quality = storage["quality"] if storage else 96
+        policy = storage["redundant"] if storage else self.o["redundant"]
+        novel = self.rng.random() < self.o["novel"]
+        size = self.o["photo-mb"] * 1024**2 * self.rng.uniform(0.8, 1.2) * QUALITY_FACTOR[quality]
+        if not novel:
+            size *= POLICY_FACTOR.get(policy, 1.0)
+        if storage:
+            self.storage.record(storage, size, 1, novel, t)
+        self.free -= size
+        self.qualities[quality] += 1
+        row["photos"] += 1
+        row["saved_gb"] += size / GB
+        self.battery.spend("photos", self.o["photo-j"] / 3600)
+
+    def went_flat(self, t, at, row):
+        self.awake.append((t, at))
+        row.update(percent_end=0.0, free_gb=round(self.free / GB, 1))
+        return at, None
+
+    def revive(self, t):
+        """When a flat battery has charged enough to boot again, the end of the season if it doesn't"""
+        flat = t
+        while t < self.end and self.battery.percent < self.o["revive-percent"]:
+            if self.o["solar-wh"] <= 0:
+                t = self.end
+                break
+            self.battery.use(t, min(t + 3600, self.end))
+            t += 3600
+        self.flat.append((flat, t))
+        return t
+
+    def missed(self):
+        """Why each scheduled session start that didn't get its session was missed"""
+        reasons = Counter()
+        s = self.wake.next_wake(self.start - 1)
+        scheduled = 0
+        while s < self.end:
+            scheduled += 1
+            if s in self.lost:
+                reasons["card full"] += 1
+            elif s in self.switched_off:
+                reasons["switched off"] += 1
+            elif s not in self.ran:
+                if any(a <= s < b for a, b in self.flat):
+                    reasons["battery empty"] += 1
+                elif any(a < s < b for a, b in self.awake):
+                    reasons["still awake"] += 1
+                else:
+                    reasons["not woken"] += 1
+            s = self.wake.next_wake(s)
+        return scheduled, reasons
+
+    def local(self, t):
+        return self.wake.local_time(t).strftime("%Y-%m-%d %H:%M")
+
+    def report(self, cpu):
+        b = self.battery
+        modes = Counter(r["mode"] for r in self.rows)
+        scheduled, reasons = self.missed()
+        days = (self.end - self.start) / 86400
+        print(f"Season {self.local(self.start)} - {self.local(self.end)} ({days:g} days), {self.wake}")
+        print(f"  wakes        {len(self.rows)} ({', '.join(f'{n} {m}' for m, n in modes.most_common())}), "
+              f"{sum(r['reason'] == 'power on' for r in self.rows)} power on")
+        missed = sum(reasons.values())
+        print(f"  sessions     {scheduled} scheduled, {scheduled - missed} ran, {missed} missed"
+              + ("" if not missed else ": " + ", ".join(f"{r} {n}" for r, n in reasons.most_common())))
+        print(f"  energy       {sum(b.used.values()):.0f} Wh used ("
+              + ", ".join(f"{k} {v:.0f}" for k, v in b.used.most_common()) + f"), {b.solar:.0f} Wh solar")
+        lowest = "" if b.lowest[1] is None else f" on {self.local(b.lowest[1])}"
+        print(f"  battery      {self.o['start-percent']:g}% -> {b.percent:.0f}%, lowest {b.lowest[0]:.0f}%{lowest}"
+              + (f", empty {len(self.flat)} times from {self.local(self.flat[0][0])}" if self.flat else ""))
+        print("  levels       " + (", ".join(f"{n} at {lv}" for lv, n in sorted(self.levels.items())) or "no sessions")
+              + (f", {self.cut_minutes} session minutes cut" if self.cut_minutes else "")
+              + ("" if self.end_date is None else f" (deployment_end {self.end_date})"))
+        photos = sum(r["photos"] for r in self.rows)
+        saved = sum(r["saved_gb"] for r in self.rows)
+        print(f"  photos       {sum(r['triggers'] for r in self.rows)} triggers, {photos} taken, "
+              f"{sum(r['skipped_energy'] for r in self.rows)} skipped for energy, "
+              f"{sum(r['lost_storage'] for r in self.rows)} lost to a full card")
+        print(f"  storage      {saved:.1f} GB saved, {self.free / GB:.1f} GB free at the end"
+              + (f", full on {self.local(self.card_full)}" if self.card_full else "")
+              + ("" if not self.qualities else ", quality " + ", ".join(
+                  f"{q}: {n}" for q, n in sorted(self.qualities.items(), reverse=True))))
+        print(f"  took {cpu:.2f} s of cpu")
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=WAKE_FIELDS)
+            writer.writeheader()
+            for row in self.rows:
+                writer.writerow(dict(row, time=self.local(row["time"]), saved_gb=round(row["saved_gb"], 2)))
+        print(f"Every wake is in {path}")
+
+
+def main():
+    path = option("settings") or default_settings_path()
+    settings = load_settings(path)
+    print(f"Settings from {path}")
+    with tempfile.TemporaryDirectory() as history:
+        # the first wake is someone switching it on at noon
+        probe = WakeSchedule(settings["minute"], settings["hour"], settings["weekday"],
+                             utc_offset=option("utc"), timezone=settings.get("timezone"))
+        day = datetime.date.fromisoformat(option("start")) if option("start") else datetime.date.today()
+        start = probe.to_epoch(datetime.datetime.combine(day, datetime.time(12)))
+        season = Season(settings, start, option("days"), history)
+        cpu = time.process_time()
+        season.run()
+        season.report(time.process_time() - cpu)
+        if option("csv"):
+            season.write_csv(option("csv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+"""
+WakeScheduleCheck - checks wake_schedule.py against what the Scheduler did before it
+
+Throws random schedules, UTC offsets and times at WakeSchedule and checks that
+ next wake     - with a fixed UTC offset (fractional ones too) it is the same as the old
+                 python-crontab calculation: the first matching minute after now, in local time
+                 made with the offset (worked out here minute by minute)
+ in session    - it agrees with the old is_now_in_schedule() (runtimes up to a day)
+ fields        - the cron syntax (*, ranges, steps, 0 and 7 for sunday) gives the same values as cron
+ timezones     - with a real timezone the starts are in order, every one is at a scheduled local
+                 time (or right after a DST jump skipped it), and there is no start between now and
+                 the next wake. It also counts the wakeups the fixed offset would have got wrong
+ far ahead     - asking past the end of the compiled weeks still gives the right answer
+If python-crontab is installed, the next wakes are also compared with it directly.
+Then it times compiling and the queries against the old way of doing them.
+
+Usage
+ python WakeScheduleCheck.py                 500 random cases
+ python WakeScheduleCheck.py --cases 5000 --seed 3
+"""
+
+import os
+import sys
+import random
+import datetime
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from wake_schedule import WakeSchedule, parse_field  # noqa: E402
+
+EPOCH = datetime.datetime(1970, 1, 1)
+OFFSETS = [-12, -9.5, -5, -3.5, -3, 0, 1, 3.5, 4.5, 5.5, 5.75, 8.75, 9.5, 10.5, 12.75, 14]
+ZONES = ["America/Panama", "America/New_York", "America/Santiago", "Europe/London",
+         "Australia/Lord_Howe", "Asia/Kathmandu", "Pacific/Chatham", "Africa/Timbuktu"]
+FIELD_CASES = [
+    ("minute", "0", [0]), ("minute", "*/15", [0, 15, 30, 45]), ("minute", "5/20", [5, 25, 45]),
+    ("minute", "10-13", [10, 11, 12, 13]), ("hour", "19;21;23;2;4", [2, 4, 19, 21, 23]),
+    ("hour", "1,3", [1, 3]), ("hour", "*/6", [0, 6, 12, 18]), ("hour", "20-23/2", [20, 22]),
+    ("weekday", "1;2;3;4;5;6;7", [0, 1, 2, 3, 4, 5, 6]), ("weekday", "*", [0, 1, 2, 3, 4, 5, 6]),
+    ("weekday", "0", [6]), ("weekday", "7", [6]), ("weekday", "1-5", [0, 1, 2, 3, 4]),
+    ("weekday", "*/2", [1, 3, 5, 6]),
+]
+
+
+def random_spec(rng):
+    minutes = sorted(rng.sample(range(60), rng.choice([1, 1, 1, 2, 4])))
+    hours = sorted(rng.sample(range(24), rng.choice([1, 2, 5, 8])))
+    days = sorted(rng.sample(range(1, 8), rng.choice([1, 3, 5, 7])))
+    if rng.random() < 0.2:
+        days = [0 if d == 7 else d for d in days]  # sunday as cron's 0
+    return minutes, hours, days
+
+
+def text(values):
+    return ";".join(map(str, values))
+
+
+def old_next_wake(minutes, hours, days, utc_off, now):
+    """The first matching minute after now, in local time made with the fixed offset (python-crontab)"""
+    local = EPOCH + datetime.timedelta(seconds=now + utc_off * 3600)
+    t = local.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    cron_days = {d % 7 for d in days}  # 7 and 0 are sunday
+    for _ in range(8 * 1440):
+        if t.minute in minutes and t.hour in hours and (t.weekday() + 1) % 7 in cron_days:
+            return int((t - EPOCH).total_seconds() - utc_off * 3600)
+        t += datetime.timedelta(minutes=1)
+    raise RuntimeError("no wake in 8 days")
+
+
+def old_is_now_in_schedule(minutes, hours, days, runtime_minutes, now):
+    """Scheduler's is_now_in_schedule() before wake_schedule.py, with now as a naive local datetime"""
+    weekdays = [(d - 1) % 7 for d in days]
+    for day_offset in (0, -1):
+        day = now.date() + datetime.timedelta(days=day_offset)
+        if (now.weekday() + day_offset) % 7 not in weekdays:
+            continue
+        for h in hours:
+            for m in minutes:
+                start = datetime.datetime.combine(day, datetime.time(hour=h, minute=m))
+                if start <= now < start + datetime.timedelta(minutes=runtime_minutes):
+                    return True
+    return False
+
+
+def crontab_next_wake(minutes, hours, days, utc_off, now):
+    from crontab import CronTab
+    cron = CronTab()
+    job = cron.new(command="true")
+    job.setall(f"{','.join(map(str, minutes))} {','.join(map(str, hours))} * * {','.join(map(str, days))}")
+    local = EPOCH + datetime.timedelta(seconds=now + utc_off * 3600)
+    nxt = job.schedule(date_from=local).get_next()
+    return int((nxt - EPOCH).total_seconds() - utc_off * 3600)
+
+
+class Check:
+    def __init__(self, name):
+        self.name = name
+        self.cases = 0
+        self.failed = []
+
+    def __call__(self, ok, detail):
+        self.cases += 1
+        if not ok and len(self.failed) < 5:
+            self.failed.append(detail)
+
+    def report(self):
+        state = "ok" if not self.failed else f"FAILED {len(self.failed)}+"
+        print(f"  {self.name:<16} {self.cases:>6} cases  {state}")
+        for f in self.failed:
+            print(f"      {f}")
+        return not self.failed
+
+
+def main():
+    cases = int(sys.argv[sys.argv.index("--cases") + 1]) if "--cases" in sys.argv else 500
+    seed = int(sys.argv[sys.argv.index("--seed") + 1]) if "--seed" in sys.argv else 1
+    rng = random.Random(seed)
+    base = time.time()
+    try:
+        import crontab  # noqa: F401
+        have_crontab = True
+    except ImportError:
+        have_crontab = False
+
+    fields, nexts, sessions, zones, ahead, direct = (Check(n) for n in (
+        "fields", "next wake", "in session", "timezones", "far ahead", "python-crontab"))
+
+    for name, value, expected in FIELD_CASES:
+        got = parse_field(value, name)
+        fields(got == expected, f"{name} {value}: {got} != {expected}")
+
+    for _ in range(cases):
+        minutes, hours, days = random_spec(rng)
+        utc_off = rng.choice(OFFSETS)
+        runtime = rng.choice([1, 30, 59, 120, 600, 1440])
+        start = base + rng.uniform(-30, 30) * 86400
+        wake = WakeSchedule(text(minutes), text(hours), text(days), runtime, utc_offset=utc_off, now=start)
+        spec = f"m={minutes} h={hours} d={days} off={utc_off} runtime={runtime}"
+
+        # next wake, near the compiled time and past the compiled weeks
+        for far in (False, True):
+            now = start + (rng.uniform(20, 60) if far else rng.uniform(-1, 6)) * 86400
+            if rng.random() < 0.3:
+                now = float(wake.next_wake(now) - rng.choice([0, 1, 60]))  # right on or before a start
+            got, want = wake.next_wake(now), old_next_wake(minutes, hours, days, utc_off, now)
+            (ahead if far else nexts)(got == want, f"{spec} now={now:.0f}: {got} != {want}")
+            if have_crontab and not far:
+                direct(got == crontab_next_wake(minutes, hours, days, utc_off, now), f"{spec} now={now:.0f}")
+
+        # in session, mostly around the ends of sessions
+        for _ in range(4):
+            s = wake.next_wake(start + rng.uniform(-1, 6) * 86400)
+            now = s + rng.choice([-61, -1, 0, 1, runtime * 60 - 1, runtime * 60, runtime * 60 + 1,
+                                  rng.uniform(0, runtime * 60)])
+            local = EPOCH + datetime.timedelta(seconds=now + utc_off * 3600)
+            got = wake.in_session(now) is not None
+            want = old_is_now_in_schedule(minutes, hours, days, runtime, local)
+            sessions(got == want, f"{spec} local={local}: {got} != {want}")
+
+    # real timezones, over a year so every DST change is in
+    from zoneinfo import ZoneInfo
+    wrong_before = 0
+    total = 0
+    for zone_name in ZONES:
+        zone = ZoneInfo(zone_name)
+        for _ in range(max(1, cases // 50)):
+            minutes, hours, days = random_spec(rng)
+            first = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+            wake = WakeSchedule(text(minutes), text(hours), text(days), 60, timezone=zone_name, now=first, weeks=53)
+            spec = f"{zone_name} m={minutes} h={hours} d={days}"
+            starts = wake.starts
+            zones(all(a < b for a, b in zip(starts, starts[1:])), f"{spec}: starts not in order")
+            for s in starts:
+                local = datetime.datetime.fromtimestamp(s, zone)
+                scheduled = local.hour in hours and local.minute in minutes and local.weekday() in wake.weekdays
+                if not scheduled:
+                    # only allowed just after a jump forward, for a wall time that didn't exist
+                    before = datetime.datetime.fromtimestamp(s - 3 * 3600, zone)
+                    jump = local.utcoffset() - before.utcoffset()
+                    wall = local.replace(tzinfo=None) - jump
+                    missing = datetime.datetime.fromtimestamp(wall.replace(tzinfo=zone).timestamp(), zone).replace(tzinfo=None) != wall
+                    scheduled = jump > datetime.timedelta(0) and missing and wall.hour in hours and wall.minute in minutes
+                zones(scheduled, f"{spec}: {local} isn't a scheduled time")
+            for _ in range(20):
+                now = first + rng.uniform(0, 360) * 86400
+                nxt = wake.next_wake(now)
+                zones(nxt > now and not any(now < s < nxt for s in starts), f"{spec} now={now:.0f}: skipped a start")
+                # what today's fixed offset would have given, the old way
+                offset = datetime.datetime.fromtimestamp(now, zone).utcoffset().total_seconds() / 3600
+                total += 1
+                wrong_before += old_next_wake(minutes, hours, [(d + 1) % 7 or 7 for d in wake.weekdays],
+                                              offset, now) != nxt
+
+    print(f"{cases} random schedules (seed {seed})" + ("" if have_crontab else ", python-crontab not installed"))
+    ok = all(c.report() for c in (fields, nexts, sessions, zones, ahead) + ((direct,) if have_crontab else ()))
+    print(f"  with DST, the fixed UTC offset would have woken at the wrong time {wrong_before} of {total} times")
+
+    # timing: compile once and query, against the old per query ways
+    minutes, hours, days = [0], [19, 21, 23, 2, 4], list(range(1, 8))
+    t = time.perf_counter()
+    wake = WakeSchedule("0", "19;21;23;2;4", "1;2;3;4;5;6;7", 59, timezone="America/Panama")
+    compile_ms = (time.perf_counter() - t) * 1000
+    nows = [base + rng.uniform(0, 14) * 86400 for _ in range(2000)]
+    t = time.perf_counter()
+    for now in nows:
+        wake.next_wake(now)
+        wake.in_session(now)
+    query_us = (time.perf_counter() - t) / len(nows) * 1e6
+    t = time.perf_counter()
+    for now in nows[:200]:
+        old_is_now_in_schedule(minutes, hours, days, 59, EPOCH + datetime.timedelta(seconds=now - 5 * 3600))
+    old_us = (time.perf_counter() - t) / 200 * 1e6
+    print(f"  compile {len(wake.starts)} starts {compile_ms:.1f} ms, next wake + in session {query_us:.1f} us "
+          f"(old in session alone {old_us:.1f} us)")
+    if have_crontab:
+        t = time.perf_counter()
+        for now in nows[:200]:
+            crontab_next_wake(minutes, hours, days, -5, now)
+        print(f"  python-crontab next wake {(time.perf_counter() - t) / 200 * 1e6:.0f} us")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
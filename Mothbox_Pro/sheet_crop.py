@@ -0,0 +1,177 @@
+# sheet_crop.py
+# Only keeps the part of the photo with the sheet on it.
+#
+# The camera sees a lot of enclosure and background around the sheet, and all of it used to be encoded,
+# stored and backed up at full resolution. With SheetCrop on, every calibration that runs the camera
+# also finds the sheet (the biggest bright, roughly rectangular thing under the flash) on a preview
+# frame and saves where it is, in sensor pixels, to controls/sheetcrop.txt:
+#     sheetcrop=x;y;w;h        (or none if no sheet was found, then photos are saved whole)
+# Sensor pixels, because the preview and the still are cropped and scaled differently from the sensor;
+# every frame's ScalerCrop metadata says how to get from one to the other.
+#
+# SheetCrop
+#   0  off, whole photos like before
+#   1  the encode workers cut the sheet out of the full frame before encoding it (works everywhere)
+#   2  the camera only outputs the sheet (ScalerCrop with a smaller output size), so the camera buffers,
+#      copies, spool and encoders all handle fewer pixels. The sensor still reads out the whole frame
+#
+# The first photo after a new crop is also encoded whole (in memory, not written), which gives how
+# much smaller and faster the cropped photos are. That ratio is what logs/sheet_crop.csv reports per
+# frame; with SheetCrop 2 there is no whole frame to compare with, so it is guessed from the area.
+
+from contextlib import contextmanager
+
+import numpy as np
+
+SMALL_WIDTH = 480
+MARGIN = 0.04  # of the sheet's size on every side, so an insect on the edge of the sheet stays in
+MIN_AREA = 0.1  # of the frame, anything smaller isn't the sheet
+MAX_AREA = 0.9  # of the frame, anything bigger leaves nothing worth cropping
+MIN_FILL = 0.6  # of its bounding box the sheet has to cover, a sheet is close to a rectangle
+
+
+def detect_sheet(array, fmt):
+    """
+    The sheet's bounding box with MARGIN around it, as fractions (x, y, w, h) of the frame.
+    None if nothing in the frame looks like the sheet.
+    """
+    import cv2
+    if fmt == "YUV420":
+        array = array[: array.shape[0] * 2 // 3]  # the Y plane
+    step = max(1, array.shape[1] // SMALL_WIDTH)
+    small = np.ascontiguousarray(array[::step, ::step])
+    grey = cv2.cvtColor(small[..., :3], cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    h, w = grey.shape
+    grey = cv2.GaussianBlur(grey, (5, 5), 0)
+    # the flash makes the sheet by far the brightest thing in the frame, Otsu finds where that starts
+    _, mask = cv2.threshold(grey, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # insects and their shadows are dark holes in the sheet
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((9, 9), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    sheet = max(contours, key=cv2.contourArea)
+    x, y, bw, bh = cv2.boundingRect(sheet)
+    area = cv2.contourArea(sheet)
+    if not MIN_AREA <= area / (w * h) <= MAX_AREA or area < MIN_FILL * bw * bh:
+        return None
+    mx, my = MARGIN * bw, MARGIN * bh
+    x0, y0 = max(0.0, x - mx), max(0.0, y - my)
+    x1, y1 = min(float(w), x + bw + mx), min(float(h), y + bh + my)
+    return (x0 / w, y0 / h, (x1 - x0) / w, (y1 - y0) / h)
+
+
+def to_sensor(box, scaler_crop):
+    """Fractions of a frame -> sensor pixels (x, y, w, h), through the frame's ScalerCrop metadata"""
+    cx, cy, cw, ch = scaler_crop
+    return tuple(int(round(v)) for v in (cx + box[0] * cw, cy + box[1] * ch, box[2] * cw, box[3] * ch))
+
+
+def to_frame(rect, scaler_crop, size, flipped=False):
+    """
+    Sensor pixels -> the (x0, y0, x1, y1) box in a frame of `size` that was taken with scaler_crop,
+    on even pixels so the YUV420 chroma planes crop with it. None if the sheet isn't in that frame.
+    flipped is for frames taken with VerticalFlip (turned 180 degrees from the calibration preview).
+    """
+    cx, cy, cw, ch = scaler_crop
+    fw, fh = size
+    x0 = max(0, int((rect[0] - cx) * fw / cw)) & ~1
+    y0 = max(0, int((rect[1] - cy) * fh / ch)) & ~1
+    x1 = min(fw, -(-int((rect[0] + rect[2] - cx) * fw / cw) // 2) * 2)
+    y1 = min(fh, -(-int((rect[1] + rect[3] - cy) * fh / ch) // 2) * 2)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    if flipped:
+        return (fw - x1, fh - y1, fw - x0, fh - y0)
+    return (x0, y0, x1, y1)
+
+
+def scaler_crop(rect, maximum, size):
+    """
+    The ScalerCrop and output size for SheetCrop 2. size is the output size the still would have
+    without the crop, so the photo keeps the same pixels per mm of sheet.
+    """
+    scale = max(size[0] / maximum[2], size[1] / maximum[3])  # what the uncropped still is scaled by
+    x = max(maximum[0], rect[0])
+    y = max(maximum[1], rect[1])
+    w = min(maximum[0] + maximum[2], rect[0] + rect[2]) - x
+    h = min(maximum[1] + maximum[3], rect[1] + rect[3]) - y
+    out = (max(64, int(w * scale) // 32 * 32), max(64, int(h * scale) // 2 * 2))  # the ISP wants aligned rows
+    return (x, y, int(out[0] / scale), int(out[1] / scale)), out
+
+
+def parse_crop(text):
+    """The sensor rect from the sheetcrop control value, None when there isn't one"""
+    try:
+        rect = tuple(int(v) for v in str(text).split(";"))
+    except ValueError:
+        return None
+    return rect if len(rect) == 4 and rect[2] > 0 and rect[3] > 0 else None
+
+
+def format_crop(rect):
+    return "none" if rect is None else ";".join(str(int(v)) for v in rect)
+
+
+def crop_planes(array, box):
+    """A cropped copy of a (h*3/2, w) I420 frame, still laid out as I420"""
+    from encoders import split_planes
+    x0, y0, x1, y1 = box
+    y, u, v = split_planes(array)
+    w, h = x1 - x0, y1 - y0
+    out = np.empty((h * 3 // 2, w), dtype=array.dtype)
+    out[:h] = y[y0:y1, x0:x1]
+    chroma = out[h:].reshape(2, h // 2, w // 2)
+    chroma[0] = u[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+    chroma[1] = v[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+    return out
+
+
+class CroppedFrame:
+    """The sheet's part of a RequestFrame/ArrayFrame, a view of its pixels (a copy for YUV420)"""
+    def __init__(self, frame, box):
+        self.frame = frame
+        self.box = box
+        self.format = frame.format
+        self.size = (box[2] - box[0], box[3] - box[1])
+
+    @contextmanager
+    def view(self):
+        x0, y0, x1, y1 = self.box
+        with self.frame.view() as array:
+            if self.format == "YUV420":
+                yield crop_planes(array, self.box)
+            else:
+                yield array[y0:y1, x0:x1]
+
+    def release(self):
+        if hasattr(self.frame, "release"):
+            self.frame.release()
+
+
+def crop_frame(image, box):
+    """The box (x0, y0, x1, y1) of a frame or PIL image"""
+    if hasattr(image, "view"):
+        return CroppedFrame(image, box)
+    return image.crop(box)
+
+
+class CropSavings:
+    """How much smaller and faster cropped photos are than whole ones, from the last measured frame"""
+    def __init__(self, area):
+        self.area = area  # of the whole frame the crop keeps
+        self.bytes_ratio = None
+        self.encode_ratio = None
+
+    def measure(self, cropped_bytes, cropped_s, full_bytes, full_s):
+        if full_bytes and full_s:
+            self.bytes_ratio = cropped_bytes / full_bytes
+            self.encode_ratio = cropped_s / full_s
+
+    def saved(self, cropped_bytes, cropped_s):
+        """(bytes saved, encode seconds saved, measured) for one cropped frame"""
+        bytes_ratio = self.bytes_ratio or self.area
+        encode_ratio = self.encode_ratio or self.area
+        saved_bytes = cropped_bytes / bytes_ratio - cropped_bytes if bytes_ratio else 0
+        saved_s = cropped_s / encode_ratio - cropped_s if encode_ratio else 0
+        return int(saved_bytes), round(saved_s, 3), self.bytes_ratio is not None
@@ -0,0 +1,149 @@
+# storage_planner.py
+# Makes the free space on the SD card last for the rest of the night, instead of taking full quality
+# photos until check_storage() says no at 2am and nothing after that.
+#
+# Before every shot it works out
+#  - how many shots are left tonight: the minutes still inside the schedule's sessions (the same
+#    WakeSchedule the Scheduler wakes up with, so in the Mothbox's timezone) until noon (the end of
+#    the night, the same as create_dated_folder's) times how often shots have been coming in
+#  - how big a shot is: from the last shots it saved, scaled back to full quality
+#  - the budget: free space minus the safetygb floor
+# and picks the first level of LEVELS (best photos first) whose forecast fits in the budget.
+# Lower levels save the JPEGs at lower quality and shrink or skip the photos that show nothing new
+# (RedundantFrames, see change_detect.py), the photos with moths on them are always kept.
+#
+# Every shot's forecast and the level it got are appended to logs/storage_plan.csv, which is also the
+# history the next forecast is made from.
+
+import csv
+import datetime
+import os
+import time
+
+# quality, and the RedundantFrames policy at least this strict (None keeps the camera_settings one)
+LEVELS = [
+    {"quality": 96, "redundant": None},
+    {"quality": 90, "redundant": None},
+    {"quality": 85, "redundant": 1},
+    {"quality": 80, "redundant": 2},
+    {"quality": 75, "redundant": 3},
+]
+# size of a JPEG at this quality compared to quality 96. A bit above what the sheet in
+# scripts/EncoderBenchmark.py gives (0.5 0.36 0.29 0.24), guessing too big only costs quality
+QUALITY_FACTOR = {96: 1.0, 90: 0.6, 85: 0.45, 80: 0.38, 75: 0.32}
+# size of a redundant frame under each RedundantFrames policy compared to saving it in full
+POLICY_FACTOR = {0: 1.0, 1: 0.27, 2: 0.02, 3: 0.0}
+MARGIN = 1.1  # previews, metadata, filesystem overhead and being wrong
+HISTORY_SHOTS = 30
+MAX_GAP = 15 * 60  # seconds, longer than this between shots is a new session, not the shot interval
+NIGHT_ENDS = 12  # hour
+
+FIELDS = ["time", "level", "quality", "redundant", "bytes", "frames", "novel",
+          "free_bytes", "budget_bytes", "minutes_left", "shots_left", "shot_bytes", "forecast_bytes"]
+
+
+def minutes_left_tonight(schedule, now=None):
+    """
+    Minutes from now until the end of the night that fall inside a session of the WakeSchedule
+    (wake_schedule.py), whose runtime 0 means the mothbox runs until it is turned off.
+    """
+    now = time.time() if now is None else now
+    local = schedule.local_time(now)
+    end = local.replace(hour=NIGHT_ENDS, minute=0, second=0, microsecond=0)
+    if end <= local:
+        end += datetime.timedelta(days=1)
+    end = schedule.to_epoch(end)
+    if schedule.runtime <= 0:
+        return (end - now) / 60
+    # sessions can overlap when runtime is longer than the gap between them
+    total = 0.0
+    covered = now
+    start = schedule.in_session(now)
+    if start is None:
+        start = schedule.next_wake(now)
+    while start < end:
+        stop = min(start + schedule.runtime, end)
+        if stop > max(start, covered):
+            total += stop - max(start, covered)
+            covered = stop
+        start = schedule.next_wake(start)
+    return total / 60
+
+
+class StoragePlanner:
+    def __init__(self, history_path):
+        self.history_path = history_path
+        self.rows = []
+        try:
+            with open(history_path, newline="") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        self.rows.append({k: float(row[k]) for k in ("time", "quality", "redundant",
+                                                                      "bytes", "frames", "novel")})
+                    except (KeyError, TypeError, ValueError):
+                        continue  # half written line from a power cut
+        except FileNotFoundError:
+            pass
+        self.rows = self.rows[-HISTORY_SHOTS:]
+
+    def full_shot_bytes(self):
+        """Median size of a shot that was saved in full, scaled to quality 96. None without history"""
+        sizes = []
+        for r in self.rows:
+            if r["bytes"] > 0 and (r["novel"] or r["redundant"] == 0):
+                sizes.append(r["bytes"] / QUALITY_FACTOR.get(int(r["quality"]), 1.0))
+        if not sizes:
+            return None
+        return sorted(sizes)[len(sizes) // 2]
+
+    def novel_fraction(self):
+        if not self.rows:
+            return 1.0
+        return sum(r["novel"] for r in self.rows) / len(self.rows)
+
+    def shot_interval(self):
+        """Median seconds between shots of the same session, 60 if we can't tell yet"""
+        gaps = [b["time"] - a["time"] for a, b in zip(self.rows, self.rows[1:])]
+        gaps = [g for g in gaps if 0 < g < MAX_GAP]
+        if not gaps:
+            return 60.0
+        return max(sorted(gaps)[len(gaps) // 2], 1.0)
+
+    def plan(self, free_bytes, reserve_bytes, minutes_left, redundant):
+        """
+        The level to take the next shot at, with the forecast that picked it.
+        redundant is RedundantFrames from camera_settings.csv.
+        """
+        budget = free_bytes - reserve_bytes
+        shots_left = minutes_left * 60 / self.shot_interval()
+        full = self.full_shot_bytes()
+        novel = self.novel_fraction()
+        chosen = None
+        for level, settings in enumerate(LEVELS):
+            policy = redundant if settings["redundant"] is None else max(redundant, settings["redundant"])
+            shot_bytes = 0.0
+            if full is not None:
+                shot_bytes = (full * QUALITY_FACTOR[settings["quality"]] * MARGIN
+                              * (novel + (1 - novel) * POLICY_FACTOR.get(policy, 1.0)))
+            chosen = {"level": level, "quality": settings["quality"], "redundant": policy,
+                      "free_bytes": int(free_bytes), "budget_bytes": int(budget),
+                      "minutes_left": round(minutes_left, 1), "shots_left": int(shots_left),
+                      "shot_bytes": int(shot_bytes), "forecast_bytes": int(shot_bytes * shots_left)}
+            if chosen["forecast_bytes"] <= budget:
+                break
+        return chosen
+
+    def record(self, plan, shot_bytes, frames, novel, now=None):
+        """Appends what the shot actually cost to the history, next to the forecast it was taken with"""
+        row = dict(plan, time=time.time() if now is None else now, bytes=int(shot_bytes), frames=frames, novel=int(novel))
+        self.rows = (self.rows + [{k: float(row[k]) for k in ("time", "quality", "redundant",
+                                                              "bytes", "frames", "novel")}])[-HISTORY_SHOTS:]
+        new = not os.path.exists(self.history_path)
+        try:
+            with open(self.history_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                writer.writerow(row)
+        except OSError as e:
+            print(f"⚠️ Could not save storage plan: {e}")
@@ -0,0 +1,164 @@
+# wake_schedule.py
+# Works out when the Mothbox has to wake up from the minute/hour/weekday settings, without cron.
+#
+# The settings are compiled once into a sorted table of every session start (UTC epoch seconds),
+# from a little before now until WEEKS weeks ahead. The next wakeup and whether now is inside a
+# session are then binary searches in that table; a query outside of it compiles a new one.
+# The fields take what the settings csv takes (19;21;23) and the cron syntax python-crontab used to
+# take (*, 1-5, */2, 1,3). Weekdays go 1 monday ... 7 sunday, 0 is sunday too, like in cron.
+#
+# Local times become UTC with the timezone itself when it is known (zoneinfo), so a session at 19:00
+# stays at 19:00 across a DST change; the wake alarm used to be worked out with today's UTC offset
+# and was an hour off after one. Without a timezone the fixed UTC offset is used, like before, and
+# that can be fractional (5.75 for Nepal). A start in the hour that is skipped when the clocks go
+# forward happens after the jump (02:30 -> 03:30), one in the hour that repeats when they go back
+# happens only once.
+
+import bisect
+import datetime
+import time
+
+WEEKS = 3
+DAY = 86400
+FIELDS = {"minute": (0, 59), "hour": (0, 23), "weekday": (0, 7)}
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_field(value, name):
+    """The sorted values of one schedule field (weekdays as python's 0 monday ... 6 sunday)"""
+    lo, hi = FIELDS[name]
+    values = set()
+    for part in str(value).replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError(f"{name} {value!r}: the step has to be 1 or more")
+        if part == "*":
+            start, end = lo, (6 if name == "weekday" else hi)
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = hi if step > 1 else start  # 5/15 is 5-59/15 like in cron
+        if not lo <= start <= end <= hi:
+            raise ValueError(f"{name} {value!r}: {part} is not within {lo}-{hi}")
+        values.update(range(start, end + 1, step))
+    if not values:
+        raise ValueError(f"no {name} in {value!r}")
+    if name == "weekday":
+        return sorted({(d - 1) % 7 for d in values})
+    return sorted(values)
+
+
+def load_zone(name):
+    """The ZoneInfo of a timezone name, None if there is no name or it isn't a timezone"""
+    if not name:
+        return None
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(str(name).strip())
+    except Exception as e:
+        print(f"⚠️ Timezone {name} not found ({e}), using the fixed UTC offset")
+        return None
+
+
+class WakeSchedule:
+    def __init__(self, minute, hour, weekday, runtime=0, utc_offset=0, timezone=None, now=None, weeks=WEEKS):
+        """runtime is in minutes, utc_offset in hours, timezone a name like America/Panama"""
+        self.minutes = parse_field(minute, "minute")
+        self.hours = parse_field(hour, "hour")
+        self.weekdays = parse_field(weekday, "weekday")
+        self.runtime = int(float(runtime or 0)) * 60
+        self.utc_offset = float(utc_offset or 0)
+        self.zone = load_zone(timezone)
+        self.weeks = weeks
+        self.compile(now)
+
+    def __str__(self):
+        zone = self.zone.key if self.zone else f"UTC{self.utc_offset:+g}"
+        days = ",".join(str(d + 1) for d in self.weekdays)
+        return (f"minute {','.join(map(str, self.minutes))} hour {','.join(map(str, self.hours))} "
+                f"weekday {days} for {self.runtime // 60} min ({zone})")
+
+    def to_epoch(self, local):
+        """A naive local datetime -> UTC epoch seconds"""
+        if self.zone:
+            return int(local.replace(tzinfo=self.zone).timestamp())
+        return int((local - EPOCH).total_seconds() - self.utc_offset * 3600)
+
+    def local_time(self, epoch):
+        """UTC epoch seconds -> a naive local datetime"""
+        if self.zone:
+            return datetime.datetime.fromtimestamp(epoch, self.zone).replace(tzinfo=None)
+        return EPOCH + datetime.timedelta(seconds=epoch + self.utc_offset * 3600)
+
+    def local_date(self, epoch):
+        return self.local_time(epoch).date()
+
+    def compile(self, now=None):
+        """Every start from a day (and a runtime) before now until self.weeks weeks after it"""
+        now = time.time() if now is None else now
+        first = self.local_date(now - self.runtime) - datetime.timedelta(days=1)
+        last = self.local_date(now) + datetime.timedelta(weeks=self.weeks)
+        times = [datetime.time(h, m) for h in self.hours for m in self.minutes]
+        starts = set()
+        day = first
+        while day <= last:
+            if day.weekday() in self.weekdays:
+                starts.update(self.to_epoch(datetime.datetime.combine(day, t)) for t in times)
+            day += datetime.timedelta(days=1)
+        self.starts = sorted(starts)
+        # every start in here is in the table (a day of slack for DST at the edges)
+        self.covers = (self.to_epoch(datetime.datetime.combine(first, datetime.time())) + DAY,
+                       self.to_epoch(datetime.datetime.combine(last, datetime.time())))
+
+    def next_wake(self, now=None):
+        """The first session start after now, UTC epoch seconds"""
+        now = time.time() if now is None else now
+        i = bisect.bisect_right(self.starts, now)
+        if now < self.covers[0] or i == len(self.starts) or self.starts[i] > self.covers[1]:
+            self.compile(now)
+            i = bisect.bisect_right(self.starts, now)
+        return self.starts[i]
+
+    def in_session(self, now=None):
+        """The start of the session that now is in, None if it isn't in one"""
+        now = time.time() if now is None else now
+        if now - self.runtime < self.covers[0] or now > self.covers[1]:
+            self.compile(now)
+        i = bisect.bisect_right(self.starts, now) - 1
+        # all sessions are equally long, so the latest start is the one that ends last
+        if i >= 0 and now < self.starts[i] + self.runtime:
+            return self.starts[i]
+        return None
+
+    def sessions_between(self, start, end):
+        """How many sessions start from start until end (both UTC epoch seconds)"""
+        count = 0
+        while start < end:
+            if start < self.covers[0] or start >= self.covers[1]:
+                self.compile(start)
+            stop = min(end, self.covers[1])
+            count += bisect.bisect_left(self.starts, stop) - bisect.bisect_left(self.starts, start)
+            start = stop
+        return count
+
+    def minutes_per_day(self, now=None, days=7):
+        """Scheduled session minutes per day, averaged over the next days"""
+        now = time.time() if now is None else now
+        return self.sessions_between(now, now + days * DAY) * self.runtime / 60 / days
+
+    def upcoming(self, count, now=None):
+        """The next count session starts after now"""
+        now = time.time() if now is None else now
+        out = []
+        while len(out) < count:
+            wake = self.next_wake(now)
+            out.append(wake)
+            now = wake
+        return out